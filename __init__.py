@@ -20,6 +20,10 @@ from . import baking
 from . import drivers
 from . import ik
 from . import savefile
+from . import plan
+from . import solver
+from . import native
+from . import profiling
 from importlib import reload
 
 
@@ -33,6 +37,7 @@ modules = [
 	drivers,
 	ik,
 	savefile,
+	profiling,
 ]
 
 
@@ -46,6 +51,15 @@ def register():
 
 	bpy.types.Object.retargeting_context = bpy.props.PointerProperty(type=modules[0].Context)
 	bpy.app.handlers.load_post.append(post_load)
+	bpy.app.handlers.depsgraph_update_pre.append(drivers.handle_depsgraph_update_pre)
+	bpy.app.handlers.depsgraph_update_post.append(drivers.handle_depsgraph_update_post)
+	bpy.app.handlers.depsgraph_update_post.append(plan.handle_depsgraph_update_post)
+	bpy.app.handlers.depsgraph_update_post.append(solver.handle_depsgraph_update_post)
+	bpy.app.handlers.depsgraph_update_post.append(native.handle_depsgraph_update_post)
+	bpy.app.handlers.frame_change_post.append(solver.handle_frame_change_post)
+	bpy.app.handlers.frame_change_post.append(profiling.handle_frame_change_post)
+	bpy.app.handlers.undo_post.append(plan.handle_undo_redo)
+	bpy.app.handlers.redo_post.append(plan.handle_undo_redo)
 
 
 def unregister():
@@ -58,11 +72,44 @@ def unregister():
 	if post_load in bpy.app.handlers.load_post:
 		bpy.app.handlers.load_post.remove(post_load)
 
+	if drivers.handle_depsgraph_update_pre in bpy.app.handlers.depsgraph_update_pre:
+		bpy.app.handlers.depsgraph_update_pre.remove(drivers.handle_depsgraph_update_pre)
+
+	if drivers.handle_depsgraph_update_post in bpy.app.handlers.depsgraph_update_post:
+		bpy.app.handlers.depsgraph_update_post.remove(drivers.handle_depsgraph_update_post)
+
+	if plan.handle_depsgraph_update_post in bpy.app.handlers.depsgraph_update_post:
+		bpy.app.handlers.depsgraph_update_post.remove(plan.handle_depsgraph_update_post)
+
+	if solver.handle_depsgraph_update_post in bpy.app.handlers.depsgraph_update_post:
+		bpy.app.handlers.depsgraph_update_post.remove(solver.handle_depsgraph_update_post)
+
+	if native.handle_depsgraph_update_post in bpy.app.handlers.depsgraph_update_post:
+		bpy.app.handlers.depsgraph_update_post.remove(native.handle_depsgraph_update_post)
+
+	if solver.handle_frame_change_post in bpy.app.handlers.frame_change_post:
+		bpy.app.handlers.frame_change_post.remove(solver.handle_frame_change_post)
+
+	if profiling.handle_frame_change_post in bpy.app.handlers.frame_change_post:
+		bpy.app.handlers.frame_change_post.remove(profiling.handle_frame_change_post)
+
+	for handlers in (bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+		if plan.handle_undo_redo in handlers:
+			handlers.remove(plan.handle_undo_redo)
+
 
 @bpy.app.handlers.persistent
 def post_load(_):
-	from .drivers import update_drivers
+	from .drivers import register_driver_namespace, defer_restore, pending_restores, requested_restores
+
+	plan.invalidate_all()
+	context.invalidate_caches()
+	pending_restores.clear()
+	requested_restores.clear()
+
+	# the stored drivers call into these, they have to exist before the first evaluation
+	register_driver_namespace()
 
 	for obj in bpy.data.objects:
 		if obj.type == 'ARMATURE':
-			update_drivers(obj.retargeting_context)
\ No newline at end of file
+			defer_restore(obj.retargeting_context)
\ No newline at end of file
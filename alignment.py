@@ -1,6 +1,9 @@
 import bpy
+import numpy as np
+from mathutils import Matrix
 from .drivers import clear_drivers, update_drivers
-from .util import matrix_to_list, list_to_matrix
+from .util import pack_floats, unpack_floats, fingerprint
+from .log import warn
 
 
 def draw_panel(ctx, layout):
@@ -34,38 +37,65 @@ def enter_alignment_mode(ctx):
 	bpy.ops.object.mode_set(mode='POSE')
 
 	clear_drivers(ctx)
-	ctx.target_pose_backup.clear()
+	backup_pose(ctx)
 
-	for bone in ctx.target.pose.bones:
-		bp = ctx.target_pose_backup.add()
-		bp.bone = bone.name
-		bp.matrix = matrix_to_list(bone.matrix_basis)
+	pose_bones = ctx.target.pose.bones
+	matrices = ctx.get_mapping_matrices()
 
-	for bone in ctx.target.pose.bones:
-		for m in ctx.mappings:
-			if m.target == bone.name:
-				bone.matrix_basis = list_to_matrix(m.offset)
+	for i, m in enumerate(ctx.mappings):
+		bone = pose_bones.get(m.target)
+
+		if bone != None:
+			bone.matrix_basis = Matrix(matrices[i, 1].tolist())
 
 	bpy.app.handlers.depsgraph_update_post.append(handle_edit_change)
 
 
 def store_alignments(ctx):
-	for bone in ctx.target.pose.bones:
-		for m in ctx.mappings:
-			if m.target == bone.name:
-				m.rest = matrix_to_list(bone.matrix)
-				m.offset = matrix_to_list(bone.matrix_basis)
+	pose_bones = ctx.target.pose.bones
+	matrices = ctx.get_mapping_matrices().copy()
+
+	for i, m in enumerate(ctx.mappings):
+		bone = pose_bones.get(m.target)
+
+		if bone != None:
+			matrices[i, 0] = bone.matrix
+			matrices[i, 1] = bone.matrix_basis
+
+	ctx.set_mapping_matrices(matrices)
+
+
+def backup_pose(ctx):
+	pose_bones = ctx.target.pose.bones
+	matrices = np.empty(len(pose_bones) * 16, dtype=np.float32)
+	pose_bones.foreach_get('matrix_basis', matrices)
+
+	ctx.target_pose_backup = pack_floats(matrices)
+	ctx.target_pose_backup_bones = fingerprint(*[bone.name for bone in pose_bones])
+
+
+def restore_pose(ctx):
+	pose_bones = ctx.target.pose.bones
+
+	if ctx.target_pose_backup == '':
+		return
+
+	# the backup is indexed by bone order, it cannot be applied to a changed skeleton
+	if ctx.target_pose_backup_bones != fingerprint(*[bone.name for bone in pose_bones]):
+		warn('bones of %s changed while aligning, pose not restored' % ctx.target.name)
+	else:
+		pose_bones.foreach_set('matrix_basis', unpack_floats(ctx.target_pose_backup))
+		ctx.target.update_tag(refresh={'DATA'})
+
+	ctx.target_pose_backup = ''
+	ctx.target_pose_backup_bones = ''
 
 
 def leave_alignment_mode(ctx):
 	if handle_edit_change in bpy.app.handlers.depsgraph_update_post:
 		bpy.app.handlers.depsgraph_update_post.remove(handle_edit_change)
 
-	for bone in ctx.target.pose.bones:
-		for bp in ctx.target_pose_backup:
-			if bp.bone == bone.name:
-				bone.matrix_basis = list_to_matrix(bp.matrix)
-				break
+	restore_pose(ctx)
 
 	ctx.ui_editing_alignment = False
 	ctx.get_source_armature().pose_position = 'POSE'
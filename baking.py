@@ -1,29 +1,67 @@
 import os
 import bpy
+import numpy as np
 from bpy_extras.io_utils import ImportHelper
+from .plan import get_plan
+from .batch import run_batch
+from .kernel import euler_to_quat, axis_angle_to_quat, quat_to_mat3, mat3_to_quat, mat_to_compatible_euler_xyz
+from .profiling import timed, section
 from .log import info
 
 
+direct_bake_chunk_size = 1000
+
+
 def draw_panel(ctx, layout):
 	layout.enabled = not ctx.ui_editing_mappings and not ctx.ui_editing_alignment and not ctx.setting_disable_drivers
 	row = layout.row()
 	row.prop(ctx, 'setting_bake_step', text='Frame Step')
 	row.prop(ctx, 'setting_bake_linear', text='Linear Interpolation')
+	row = layout.row()
+	row.prop(ctx, 'setting_bake_method', expand=True)
 	layout.operator(BakingBakeOperator.bl_idname, icon='RENDER_ANIMATION')
 	layout.operator(BakingBatchFBXImportOperator.bl_idname, icon='FILE_FOLDER')
 
 
 def get_keyframes(obj):
+	anim = obj.animation_data
+
+	if anim is None or anim.action is None:
+		return np.empty(0)
+
 	frames = []
+
+	for fcu in anim.action.fcurves:
+		co = np.empty(len(fcu.keyframe_points) * 2)
+		fcu.keyframe_points.foreach_get('co', co)
+		frames.append(co[0::2])
+
+	if len(frames) == 0:
+		return np.empty(0)
+
+	return np.unique(np.concatenate(frames))
+
+
+def get_frame_range(obj):
 	anim = obj.animation_data
-	if anim is not None and anim.action is not None:
-		for fcu in anim.action.fcurves:
-			for keyframe in fcu.keyframe_points:
-				x, y = keyframe.co
-				if x not in frames:
-					frames.append(x)
 
-	return frames
+	if anim is None or anim.action is None:
+		return None
+
+	action = anim.action
+	start, end = action.frame_range
+
+	# frame_range is the key extent unless a manual range is set, but Blender
+	# pads single-frame actions to one frame length, so those need the actual keys
+	if not getattr(action, 'use_frame_range', False) and end - start > 1:
+		return start, end
+
+	keyframes = get_keyframes(obj)
+
+	if len(keyframes) == 0:
+		return None
+
+	return keyframes[0], keyframes[-1]
 
 
 def find_action(name):
@@ -34,8 +72,9 @@ def find_action(name):
 	return None
 
 
+@timed('transfer_anim')
 def transfer_anim(ctx):
-	keyframes = get_keyframes(ctx.source)
+	frame_range = get_frame_range(ctx.source)
 	source_action = ctx.source.animation_data.action
 	target_action_name = ctx.target.name + '|' + source_action.name.replace(ctx.source.name + '|', '')
 	target_action = find_action(target_action_name)
@@ -51,24 +90,250 @@ def transfer_anim(ctx):
 
 	ctx.target.animation_data.action = target_action
 
+	frame_start = int(frame_range[0])
+	frame_end = int(frame_range[1])
+	step = int(ctx.setting_bake_step)
+	interpolation = 'LINEAR' if ctx.setting_bake_linear else None
+
+	if ctx.setting_bake_method == 'DIRECT' and can_bake_direct(ctx):
+		bake_direct(ctx, source_action, target_action, range(frame_start, frame_end + 1, max(step, 1)), interpolation)
+	else:
+		bake_visual(target_action, frame_start, frame_end, step, interpolation)
+
+	target_action.use_fake_user = True
+
+	info('bake complete')
+
+	return target_action
+
+
+def import_and_bake(ctx, filepath, ignore_leaf_bones=False, automatic_bone_orientation=False):
+	with section('import_and_bake: import'):
+		if filepath.lower().endswith('.bvh'):
+			bpy.ops.import_anim.bvh(filepath=filepath)
+		else:
+			bpy.ops.import_scene.fbx(
+				filepath=filepath,
+				use_custom_props=True,
+				use_custom_props_enum_as_string=True,
+				ignore_leaf_bones=ignore_leaf_bones,
+				automatic_bone_orientation=automatic_bone_orientation
+			)
+
+	imported_objects = []
+	imported_source = None
+	target_action = None
+
+	for obj in bpy.context.selected_objects:
+		imported_objects.append(obj)
+
+		if obj.type == 'ARMATURE':
+			imported_source = obj
+
+	for obj in imported_objects:
+		obj.select_set(False)
+
+	if imported_source != None:
+		imported_action = imported_source.animation_data.action
+
+		if ctx.source != None:
+			imported_source.scale = ctx.source.scale
+
+		bpy.context.view_layer.objects.active = ctx.target
+		ctx.target.select_set(True)
+		prev = ctx.source
+
+		# switching the source rebuilds the drivers for the imported armature
+		with section('import_and_bake: switch source'):
+			ctx.selected_source = imported_source
+
+		target_action = transfer_anim(ctx)
+
+		with section('import_and_bake: restore source'):
+			ctx.selected_source = prev
+
+		imported_source.animation_data.action = None
+		bpy.data.actions.remove(imported_action)
+
+	with section('import_and_bake: cleanup'):
+		for obj in imported_objects:
+			bpy.data.objects.remove(obj, do_unlink=True)
+
+	return target_action
+
+
+def bake_visual(target_action, frame_start, frame_end, step, interpolation):
 	bpy.ops.nla.bake(
-		frame_start=int(min(keyframes)),
-		frame_end=int(max(keyframes)),
-		step=int(ctx.setting_bake_step),
+		frame_start=frame_start,
+		frame_end=frame_end,
+		step=step,
 		visual_keying=True,
 		use_current_action=True,
 		bake_types={'POSE'},
 		only_selected=False
 	)
 
-	if ctx.setting_bake_linear:
-		for fc in ctx.target.animation_data.action.fcurves:
-			for kp in fc.keyframe_points:
-				kp.interpolation = 'LINEAR'
+	if interpolation != None:
+		set_keyframe_interpolation(target_action.fcurves, interpolation)
 
-	target_action.use_fake_user = True
 
-	info('bake complete')
+def set_keyframe_interpolation(fcurves, interpolation):
+	value = bpy.types.Keyframe.bl_rna.properties['interpolation'].enum_items[interpolation].value
+
+	for fc in fcurves:
+		fc.keyframe_points.foreach_set('interpolation', np.full(len(fc.keyframe_points), value, dtype=np.int32))
+		fc.update()
+
+
+def can_bake_direct(ctx):
+	# IK corrections are solved by constraints, which only the depsgraph evaluates
+	return not any(limb.enabled for limb in ctx.ik_limbs)
+
+
+def bake_direct(ctx, source_action, target_action, frames, interpolation=None):
+	frames = np.array(frames, dtype=np.float64)
+	plan = get_plan(ctx)
+	stacks = plan.get_stacks()
+	src_bones = ctx.source.data.bones
+	src_pose_bones = ctx.source.pose.bones
+	curves = {(fc.data_path, fc.array_index): fc for fc in source_action.fcurves}
+	basis_mats = {}
+	pose_mats = {}
+
+	def get_basis_mats(name):
+		if name not in basis_mats:
+			basis_mats[name] = sample_basis_mats(src_pose_bones[name], curves, frames)
+
+		return basis_mats[name]
+
+	def get_pose_mats(name):
+		if name not in pose_mats:
+			bone = src_bones[name]
+
+			if bone.parent:
+				rel_mat = np.array(bone.parent.matrix_local.inverted() @ bone.matrix_local)
+				pose_mats[name] = get_pose_mats(bone.parent.name) @ rel_mat @ get_basis_mats(name)
+			else:
+				pose_mats[name] = np.array(bone.matrix_local) @ get_basis_mats(name)
+
+		return pose_mats[name]
+
+	n = len(frames)
+	bone_plans = list(plan.bones.values())
+	locs = np.zeros((n, len(bone_plans), 3))
+	rots = np.zeros((n, len(bone_plans), 4))
+	base_pose = np.tile((1.0, 0.0, 0.0, 0.0), (n, len(bone_plans), 1))
+	head_pose = np.tile((1.0, 0.0, 0.0, 0.0), (n, len(bone_plans), 1))
+
+	for i, bone_plan in enumerate(bone_plans):
+		basis = get_basis_mats(bone_plan.source)
+		locs[:, i] = basis[:, :3, 3]
+		rots[:, i] = sample_rotation(src_pose_bones[bone_plan.source], curves, frames)
+
+		if bone_plan.has_chain:
+			head_pose[:, i] = mat3_to_quat(get_pose_mats(bone_plan.chain_head))
+
+			if bone_plan.chain_base:
+				base_pose[:, i] = mat3_to_quat(get_pose_mats(bone_plan.chain_base))
+
+	dest_locs = np.empty(locs.shape)
+	dest_eulers = np.empty(locs.shape)
+	prev = None
+
+	for start in range(0, n, direct_bake_chunk_size):
+		chunk = slice(start, start + direct_bake_chunk_size)
+		mats = plan.evaluate_batch(locs[chunk], rots[chunk], base_pose[chunk], head_pose[chunk])
+		dest_locs[chunk] = mats[..., :3, 3]
+		dest_eulers[chunk] = mat_to_compatible_euler_xyz(mats, prev)
+		prev = dest_eulers[chunk][-1]
+
+	channels = {}
+
+	for i, name in enumerate(stacks['names']):
+		channels[name] = (
+			('location', dest_locs[:, i]),
+			('rotation_euler', dest_eulers[:, i]),
+			('scale', np.tile(tuple(ctx.target.pose.bones[name].scale), (n, 1)))
+		)
+
+	# like bpy.ops.nla.bake, unmapped bones are keyed with their current pose
+	for pose_bone in ctx.target.pose.bones:
+		if pose_bone.name in channels:
+			continue
+
+		channels[pose_bone.name] = tuple(
+			(path, np.tile(tuple(getattr(pose_bone, path)), (n, 1)))
+			for path in ('location', get_rotation_path(pose_bone), 'scale')
+		)
+
+	for pose_bone in ctx.target.pose.bones:
+		if pose_bone.name in plan.bones:
+			pose_bone.rotation_mode = 'XYZ'
+
+		for path, values in channels[pose_bone.name]:
+			data_path = 'pose.bones["%s"].%s' % (bpy.utils.escape_identifier(pose_bone.name), path)
+
+			for index in range(values.shape[1]):
+				write_fcurve(target_action, data_path, index, pose_bone.name, frames, values[:, index], interpolation)
+
+	info('directly baked %i frames for %i bones' % (n, len(plan.bones)))
+
+
+def sample_channel(pose_bone, curves, frames, path, size):
+	data_path = 'pose.bones["%s"].%s' % (bpy.utils.escape_identifier(pose_bone.name), path)
+	values = np.empty((len(frames), size))
+
+	for index in range(size):
+		fc = curves.get((data_path, index))
+
+		if fc == None:
+			values[:, index] = getattr(pose_bone, path)[index]
+		else:
+			values[:, index] = [fc.evaluate(frame) for frame in frames]
+
+	return values
+
+
+def sample_rotation(pose_bone, curves, frames):
+	if pose_bone.rotation_mode == 'QUATERNION':
+		quats = sample_channel(pose_bone, curves, frames, 'rotation_quaternion', 4)
+		return quats / np.linalg.norm(quats, axis=-1, keepdims=True)
+	elif pose_bone.rotation_mode == 'AXIS_ANGLE':
+		return axis_angle_to_quat(sample_channel(pose_bone, curves, frames, 'rotation_axis_angle', 4))
+	else:
+		return euler_to_quat(sample_channel(pose_bone, curves, frames, 'rotation_euler', 3), pose_bone.rotation_mode)
+
+
+def sample_basis_mats(pose_bone, curves, frames):
+	mats = np.zeros((len(frames), 4, 4))
+	mats[:, :3, :3] = quat_to_mat3(sample_rotation(pose_bone, curves, frames))
+	mats[:, :3, :3] *= sample_channel(pose_bone, curves, frames, 'scale', 3)[:, None, :]
+	mats[:, :3, 3] = sample_channel(pose_bone, curves, frames, 'location', 3)
+	mats[:, 3, 3] = 1.0
+
+	return mats
+
+
+def get_rotation_path(pose_bone):
+	if pose_bone.rotation_mode == 'QUATERNION':
+		return 'rotation_quaternion'
+	elif pose_bone.rotation_mode == 'AXIS_ANGLE':
+		return 'rotation_axis_angle'
+	else:
+		return 'rotation_euler'
+
+
+def write_fcurve(action, data_path, index, group, frames, values, interpolation=None):
+	fc = action.fcurves.new(data_path, index=index, action_group=group)
+	fc.keyframe_points.add(len(frames))
+	fc.keyframe_points.foreach_set('co', np.column_stack((frames, values)).ravel())
+
+	if interpolation != None:
+		set_keyframe_interpolation((fc,), interpolation)
+	else:
+		fc.update()
+
+	return fc
 
 
 
@@ -120,65 +385,59 @@ class BakingBatchFBXImportOperator(bpy.types.Operator, ImportHelper):
 		default=False,
 	)
 
+	worker_count: bpy.props.IntProperty(
+		name='Worker Processes',
+		description='Number of background Blender processes baking the files in parallel. 1 bakes inside this session',
+		default=1,
+		min=1,
+		max=64
+	)
+
 	def draw(self, context):
 		self.layout.prop(self, 'ignore_leaf_bones')
 		self.layout.prop(self, 'automatic_bone_orientation')
+		self.layout.prop(self, 'worker_count')
 
 	def execute(self, context):
 		ctx = context.object.retargeting_context
+		filepaths = [os.path.join(self.directory, file.name) for file in self.files]
+		options = {
+			'ignore_leaf_bones': self.ignore_leaf_bones,
+			'automatic_bone_orientation': self.automatic_bone_orientation
+		}
 
-		bpy.context.window_manager.progress_begin(0, len(self.files) * 2)
-		progress = 0
-
-		for file in self.files:
-			bpy.ops.import_scene.fbx(
-				filepath=os.path.join(self.directory, file.name),
-				use_custom_props=True,
-				use_custom_props_enum_as_string=True,
-				ignore_leaf_bones=self.ignore_leaf_bones,
-				automatic_bone_orientation=self.automatic_bone_orientation
-			)
-
-			bpy.context.window_manager.progress_update(progress)
-			progress += 1
+		if self.worker_count > 1:
+			return self.execute_parallel(context, ctx, filepaths, options)
 
-			imported_objects = []
-			imported_source = None
+		bpy.context.window_manager.progress_begin(0, len(filepaths))
 
-			for obj in context.selected_objects:
-				imported_objects.append(obj)
+		for i, filepath in enumerate(filepaths):
+			import_and_bake(ctx, filepath, **options)
+			bpy.context.window_manager.progress_update(i + 1)
 
-				if obj.type == 'ARMATURE':
-					imported_source = obj
+		bpy.context.window_manager.progress_end()
 
+		return {'FINISHED'}
 
-			for obj in imported_objects:
-				obj.select_set(False)
+	def execute_parallel(self, context, ctx, filepaths, options):
+		progress = [0]
 
-			if imported_source != None:
-				imported_action = imported_source.animation_data.action
-				imported_source.scale = ctx.source.scale
-				bpy.context.view_layer.objects.active = ctx.target
-				ctx.target.select_set(True)
-				prev = ctx.source
-				ctx.selected_source = imported_source
-				transfer_anim(ctx)
-				ctx.selected_source = prev
-				imported_source.animation_data.action = None
-				bpy.data.actions.remove(imported_action)
+		def on_progress(result):
+			progress[0] += 1
+			context.window_manager.progress_update(progress[0])
 
-			for obj in imported_objects:
-				bpy.data.objects.remove(obj, do_unlink=True)
+		context.window_manager.progress_begin(0, len(filepaths))
+		results = run_batch(ctx, filepaths, self.worker_count, options, on_progress)
+		context.window_manager.progress_end()
 
-			bpy.context.window_manager.progress_update(progress)
-			progress += 1
+		failed = [result for result in results if result['status'] != 'ok']
 
-		bpy.context.window_manager.progress_end()
+		if len(failed) > 0:
+			self.report({'WARNING'}, '%i of %i files failed to bake, see the console for details' % (len(failed), len(results)))
 
 		return {'FINISHED'}
 
 
-
 classes = (
 	BakingBakeOperator,
 	BakingBatchFBXImportOperator
@@ -0,0 +1,196 @@
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import tempfile
+import threading
+import subprocess
+import bpy
+from . import baking
+from . import savefile
+from . import profiling
+from .profiling import timed, section
+from .log import info, warn
+
+
+status_prefix = 'RETARGET_BATCH '
+
+
+def run_batch(ctx, filepaths, worker_count, options, on_progress=None):
+	work_dir = tempfile.mkdtemp(prefix='retarget-batch-')
+	config_path = os.path.join(work_dir, 'config.blend-retarget')
+	blend_path = os.path.join(work_dir, 'scene.blend')
+
+	jobs = [list(enumerate(filepaths))[i::worker_count] for i in range(worker_count)]
+	statuses = queue.Queue()
+	readers = []
+
+	with section('batch: start workers'):
+		savefile.write_state(config_path, ctx)
+
+		bpy.ops.wm.save_as_mainfile(filepath=blend_path, copy=True)
+
+		for i, files in enumerate(jobs):
+			if len(files) == 0:
+				continue
+
+			job_path = os.path.join(work_dir, 'job-%i.json' % i)
+
+			with open(job_path, 'w') as f:
+				json.dump({
+					'target': ctx.target.name,
+					'config': config_path,
+					'files': files,
+					'output_dir': work_dir,
+					'options': options,
+					'profiling': profiling.enabled
+				}, f)
+
+			process = start_worker(blend_path, job_path)
+			reader = threading.Thread(target=read_worker_output, args=(process, files, statuses), daemon=True)
+			reader.start()
+			readers.append(reader)
+
+	info('baking %i files in %i worker processes' % (len(filepaths), len(readers)))
+
+	results = []
+
+	with section('batch: wait for workers'):
+		while len(results) < len(filepaths):
+			result = statuses.get()
+			results.append(result)
+			report_result(result, len(results), len(filepaths))
+
+			# the workers' own timings, of bake_file and everything it calls
+			if profiling.enabled and 'profile' in result:
+				profiling.merge_stats(result.pop('profile'))
+
+			if on_progress != None:
+				on_progress(result)
+
+		for reader in readers:
+			reader.join()
+
+	load_baked_actions(results)
+	shutil.rmtree(work_dir, ignore_errors=True)
+
+	return results
+
+
+def start_worker(blend_path, job_path):
+	return subprocess.Popen(
+		[
+			bpy.app.binary_path,
+			'-b', blend_path,
+			'--addons', __package__,
+			'--python-expr', 'import importlib; importlib.import_module(%r).run_worker()' % __name__,
+			'--', job_path
+		],
+		stdout=subprocess.PIPE,
+		stderr=subprocess.STDOUT,
+		text=True
+	)
+
+
+def read_worker_output(process, files, statuses):
+	pending = {filepath: index for index, filepath in files}
+
+	for line in process.stdout:
+		if not line.startswith(status_prefix):
+			continue
+
+		result = json.loads(line[len(status_prefix):])
+		pending.pop(result['file'], None)
+		statuses.put(result)
+
+	process.wait()
+
+	# a crashed worker must still account for the files it never got to
+	for filepath in pending:
+		statuses.put({
+			'index': pending[filepath],
+			'file': filepath,
+			'status': 'failed',
+			'error': 'worker exited with code %i' % process.returncode
+		})
+
+
+def report_result(result, done_n, total_n):
+	if result['status'] == 'ok':
+		info('[%i/%i] baked %s into "%s" (%.1fs)' % (done_n, total_n, result['file'], result['action'], result['seconds']))
+	else:
+		warn('[%i/%i] %s %s: %s' % (done_n, total_n, result['status'], result['file'], result.get('error', '')))
+
+
+@timed('batch: load_baked_actions')
+def load_baked_actions(results):
+	# same order as a serial bake, so later files win on action name clashes
+	for result in sorted(results, key=lambda result: result['index']):
+		if result['status'] != 'ok':
+			continue
+
+		name = result['action']
+		existing = bpy.data.actions.get(name)
+
+		with bpy.data.libraries.load(result['library']) as (data_from, data_to):
+			data_to.actions = [name]
+
+		action = data_to.actions[0]
+
+		# overwrite like an in-session bake does, keeping users of the old action
+		if existing != None and existing != action:
+			existing.user_remap(action)
+			bpy.data.actions.remove(existing)
+			action.name = name
+
+		action.use_fake_user = True
+
+
+def run_worker():
+	job_path = sys.argv[sys.argv.index('--') + 1]
+
+	with open(job_path, 'r') as f:
+		job = json.load(f)
+
+	target = bpy.data.objects[job['target']]
+	ctx = target.retargeting_context
+	bpy.context.view_layer.objects.active = target
+
+	savefile.load_serialized_state(ctx, savefile.read_state(job['config']))
+	profiling.set_enabled(job.get('profiling', False))
+
+	for index, filepath in job['files']:
+		profiling.reset()
+		result = bake_file(ctx, index, filepath, job['options'], job['output_dir'])
+
+		if profiling.enabled:
+			result['profile'] = profiling.dump_stats()
+
+		print(status_prefix + json.dumps(result), flush=True)
+
+
+@timed('batch: bake_file')
+def bake_file(ctx, index, filepath, options, library_dir=None):
+	start = time.perf_counter()
+	result = {'index': index, 'file': filepath}
+
+	try:
+		action = baking.import_and_bake(ctx, filepath, **options)
+
+		if action == None:
+			result.update(status='skipped', error='no armature found in file')
+		else:
+			result.update(status='ok', action=action.name)
+
+			if library_dir != None:
+				library = os.path.join(library_dir, 'result-%i.blend' % index)
+				bpy.data.libraries.write(library, {action}, fake_user=True)
+				result['library'] = library
+	except Exception as e:
+		result.update(status='failed', error=str(e))
+
+	result['seconds'] = time.perf_counter() - start
+
+	return result
@@ -0,0 +1,212 @@
+import math
+import numpy as np
+from .standins import Matrix, Vector, Armature, Bone, Object, Action, AnimData
+
+
+# Synthetic humanoid skeletons of any size. The core is a 22 bone humanoid, larger
+# rigs get finger chains on the hands and facial bones on the head, the way real
+# rigs grow. The same skeleton can be named in two conventions, so the name guesser
+# has to work for its matches:
+#
+#   source: "mixamorig:LeftForeArm", "mixamorig:LeftHandFinger3_2"
+#   target: "forearm.L", "hand_finger3_2.L"
+
+
+core_bones = (
+	# part, parent, side, direction, length
+	('Hips', None, None, (0, 0, 1), 0.10),
+	('Spine', 'Hips', None, (0, 0, 1), 0.12),
+	('Spine1', 'Spine', None, (0, 0, 1), 0.12),
+	('Spine2', 'Spine1', None, (0, 0, 1), 0.12),
+	('Neck', 'Spine2', None, (0, 0, 1), 0.08),
+	('Head', 'Neck', None, (0, 0, 1), 0.15),
+	('Shoulder', 'Spine2', 'side', (1, 0, 0.2), 0.12),
+	('Arm', 'Shoulder', 'side', (1, 0, -0.1), 0.28),
+	('ForeArm', 'Arm', 'side', (1, 0, -0.05), 0.26),
+	('Hand', 'ForeArm', 'side', (1, 0, 0), 0.08),
+	('UpLeg', 'Hips', 'side', (0.1, 0, -1), 0.42),
+	('Leg', 'UpLeg', 'side', (0, 0.05, -1), 0.40),
+	('Foot', 'Leg', 'side', (0, -0.6, -1), 0.12),
+	('ToeBase', 'Foot', 'side', (0, -1, 0), 0.08),
+)
+
+target_parts = {
+	'Arm': 'upper_arm',
+	'ForeArm': 'forearm',
+	'UpLeg': 'thigh',
+	'Leg': 'shin',
+	'ToeBase': 'toe',
+}
+
+
+def get_skeleton(bone_count):
+	# (part, parent index, side, head, tail) in armature space, parents before children
+	bones = []
+	indices = {}
+
+	def add(part, parent, side, direction, length):
+		head = bones[parent][4] if parent is not None else (0.0, 0.0, 1.0)
+		direction = np.array(direction, dtype=np.float64)
+		tail = tuple(np.array(head) + direction / np.linalg.norm(direction) * length)
+		bones.append((part, parent, side, tuple(head), tail))
+		return len(bones) - 1
+
+	for part, parent, side, direction, length in core_bones:
+		for sign, side_name in (((1, 'Left'), (-1, 'Right')) if side else ((1, None),)):
+			parent_index = indices.get((parent, side_name), indices.get((parent, None)))
+			indices[(part, side_name)] = add(part, parent_index, side_name, (direction[0] * sign,) + direction[1:], length)
+
+	extra = 0
+
+	while len(bones) < bone_count:
+		for sign, side_name in ((1, 'Left'), (-1, 'Right')):
+			if extra % 2 == 0:
+				# a three bone finger, fanned out over the hand
+				parent = indices[('Hand', side_name)]
+				angle = (extra // 2 % 9 - 4) * 0.15
+
+				for joint in range(1, 4):
+					if len(bones) < bone_count:
+						parent = add('HandFinger%i_%i' % (extra // 2 + 1, joint), parent, side_name, (sign * math.cos(angle), math.sin(angle), 0), 0.03)
+			elif len(bones) < bone_count:
+				angle = extra * 0.37
+				add('Face%i' % (extra // 2 + 1), indices[('Head', None)], side_name, (sign * 0.5, -1, math.sin(angle)), 0.02)
+
+		extra += 1
+
+	return bones[:bone_count]
+
+
+def get_bone_name(part, side, style):
+	if style == 'source':
+		return 'mixamorig:' + (side or '') + part
+
+	name = target_parts.get(part, '_'.join(s.lower() for s in split_camel(part)))
+	return name + ('.' + side[0] if side else '')
+
+
+def split_camel(part):
+	words = []
+
+	for c in part:
+		if c.isupper() or len(words) == 0:
+			words.append(c)
+		else:
+			words[-1] += c
+
+	return words
+
+
+def get_bone_matrix(head, tail):
+	# Y along the bone like Blender, X kept as horizontal as possible
+	y = np.array(tail) - np.array(head)
+	y /= np.linalg.norm(y)
+	up = (0.0, 0.0, 1.0) if abs(y[2]) < 0.9 else (0.0, 1.0, 0.0)
+	x = np.cross(y, up)
+	x /= np.linalg.norm(x)
+	z = np.cross(x, y)
+	mat = np.identity(4)
+	mat[:3, 0], mat[:3, 1], mat[:3, 2], mat[:3, 3] = x, y, z, head
+	return Matrix(mat)
+
+
+def create_rig(name, bone_count, style, scale=1.0):
+	armature = Armature(name)
+	created = []
+
+	for part, parent, side, head, tail in get_skeleton(bone_count):
+		head = tuple(v * scale for v in head)
+		tail = tuple(v * scale for v in tail)
+		bone = Bone(
+			get_bone_name(part, side, style),
+			created[parent] if parent is not None else None,
+			head,
+			tail,
+			get_bone_matrix(head, tail)
+		)
+		created.append(armature.bones.append(bone))
+
+	return Object(name, armature)
+
+
+def create_clip(obj, frame_count, seed=0):
+	# location and quaternion keys on every frame of every bone, smooth and deterministic
+	rng = np.random.default_rng(seed)
+	action = Action(obj.name + '|Clip')
+	frames = np.arange(1, frame_count + 1, dtype=np.float64)
+
+	for pose_bone in obj.pose.bones:
+		pose_bone.rotation_mode = 'QUATERNION'
+		phase, speed = rng.uniform(0, math.tau), rng.uniform(0.02, 0.2)
+		angle = np.sin(frames * speed + phase) * 0.4
+		axis = rng.normal(size=3)
+		axis /= np.linalg.norm(axis)
+		channels = [
+			('location', np.sin(frames * speed + phase + i) * 0.01)
+			for i in range(3)
+		] + [
+			('rotation_quaternion', np.cos(angle / 2)),
+		] + [
+			('rotation_quaternion', np.sin(angle / 2) * axis[i])
+			for i in range(3)
+		]
+
+		for index, (path, values) in enumerate(channels):
+			fc = action.fcurves.new(
+				'pose.bones["%s"].%s' % (pose_bone.name, path),
+				index=index if index < 3 else index - 3,
+				action_group=pose_bone.name
+			)
+			fc.keyframe_points.add(frame_count)
+			fc.keyframe_points.foreach_set('co', np.column_stack((frames, values)).ravel())
+
+	obj.animation_data = AnimData()
+	obj.animation_data.action = action
+
+	return action
+
+
+def get_mapped_pairs(source, target):
+	# every fifth bone stays unmapped, so intermediate chains are part of the workload
+	return [
+		(sbone.name, tbone.name)
+		for i, (sbone, tbone) in enumerate(zip(source.data.bones, target.data.bones))
+		if i % 5 != 2 or sbone.parent is None
+	]
+
+
+def create_scene(bpy, context_type, bone_count, frame_count=0):
+	bpy.data.objects.clear()
+	bpy.data.actions.clear()
+
+	source = bpy.data.objects.append(create_rig('Source', bone_count, 'source'))
+	target = bpy.data.objects.append(create_rig('Target', bone_count, 'target', scale=1.1))
+	target.matrix_world = Matrix.Translation(Vector((1.0, 0.0, 0.0)))
+
+	if frame_count > 0:
+		bpy.data.actions.append(create_clip(source, frame_count))
+
+	target.animation_data = AnimData()
+
+	for obj in (source, target):
+		obj.retargeting_context = context_type(id_data=obj)
+
+	ctx = target.retargeting_context
+	ctx.source = source
+	ctx.target = target
+	ctx.did_setup_empty_alignment = True
+
+	for sname, tname in get_mapped_pairs(source, target):
+		mapping = ctx.mappings.add()
+		mapping.source = sname
+		mapping.target = tname
+
+	ctx.set_mapping_matrices([
+		(target.data.bones[mapping.target].matrix_local, np.identity(4))
+		for mapping in ctx.mappings
+	])
+
+	bpy.context.object = target
+	bpy.context.selected_pose_bones = list(target.pose.bones)
+
+	return ctx
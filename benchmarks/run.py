@@ -0,0 +1,316 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import importlib.util
+import numpy as np
+from . import standins
+from . import rigs
+
+
+# Headless benchmarks of the retargeting hot paths on synthetic rigs, run from the
+# repository root with plain Python:
+#
+#   python -m benchmarks.run
+#   python -m benchmarks.run --sizes 20,500 --frames 250 --cases drive_bone_mat,transfer_anim
+#   python -m benchmarks.run --record
+#
+# Timings are stored in the baseline relative to a fixed calibration workload, so a
+# baseline recorded on one machine roughly carries over to another. A run exits
+# non-zero when any case got slower than the baseline by more than the threshold.
+
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+default_sizes = (20, 100, 500, 2000)
+default_frames = 100
+min_seconds = 0.2
+max_runs = 1000
+
+
+
+def load_addon():
+	bpy = standins.install()
+	spec = importlib.util.spec_from_file_location(
+		'retarget',
+		os.path.join(root_dir, '__init__.py'),
+		submodule_search_locations=[root_dir]
+	)
+	addon = importlib.util.module_from_spec(spec)
+	sys.modules['retarget'] = addon
+	spec.loader.exec_module(addon)
+	logging.getLogger('anim-retarget-addon').setLevel(logging.WARNING)
+
+	return bpy, addon
+
+
+
+### CASES
+#
+# Each case sets up a scene and returns (prepare, run). Only run is timed,
+# prepare resets whatever state run changed.
+
+
+def create_scene(bpy, addon, bone_count, frame_count=0):
+	ctx = rigs.create_scene(bpy, addon.context.Context, bone_count, frame_count)
+
+	# every scene replaces the previous one like loading a file, so nothing cached carries over
+	addon.post_load(None)
+
+	return ctx
+
+
+def case_drive_bone_mat(bpy, addon, bone_count, frame_count):
+	# one frame of every mapped bone, as the drivers evaluate it
+	ctx = create_scene(bpy, addon, bone_count)
+	addon.plan.compile_plan(ctx)
+	calls = []
+
+	for mapping in ctx.mappings:
+		basis = ctx.source.pose.bones[mapping.source].matrix_basis
+		calls.append((mapping.target, list(basis.to_translation()) + list(basis.to_quaternion())))
+
+	def run():
+		for bone_name, src_vars in calls:
+			addon.drivers.drive_bone_mat(ctx.target.name, bone_name, src_vars)
+
+	return None, run
+
+
+def case_build_drivers(bpy, addon, bone_count, frame_count):
+	ctx = create_scene(bpy, addon, bone_count)
+	return lambda: addon.drivers.clear_drivers(ctx), lambda: addon.drivers.build_drivers(ctx)
+
+
+def case_guess_mappings(bpy, addon, bone_count, frame_count):
+	ctx = create_scene(bpy, addon, bone_count)
+	return lambda: ctx.mappings.clear(), lambda: addon.mapping.guess_mappings(ctx)
+
+
+def case_guess_group_by_side(bpy, addon, bone_count, frame_count):
+	ctx = create_scene(bpy, addon, bone_count)
+	names = [bone.name for obj in (ctx.source, ctx.target) for bone in obj.data.bones]
+	return None, lambda: addon.mapping.guess_group_by_side(names)
+
+
+def case_get_keyframes(bpy, addon, bone_count, frame_count):
+	ctx = create_scene(bpy, addon, bone_count, frame_count)
+	return None, lambda: addon.baking.get_keyframes(ctx.source)
+
+
+def case_transfer_anim(bpy, addon, bone_count, frame_count):
+	ctx = create_scene(bpy, addon, bone_count, frame_count)
+	ctx.setting_bake_method = 'DIRECT'
+
+	def prepare():
+		for action in list(bpy.data.actions):
+			if action.name.startswith(ctx.target.name + '|'):
+				bpy.data.actions.remove(action)
+
+	return prepare, lambda: addon.baking.transfer_anim(ctx)
+
+
+cases = {
+	'drive_bone_mat': case_drive_bone_mat,
+	'build_drivers': case_build_drivers,
+	'guess_mappings': case_guess_mappings,
+	'guess_group_by_side': case_guess_group_by_side,
+	'get_keyframes': case_get_keyframes,
+	'transfer_anim': case_transfer_anim,
+}
+
+
+
+### TIMING
+
+
+def measure(prepare, run, repeat):
+	# best of at least `repeat` runs, more for fast cases until min_seconds have passed
+	best = float('inf')
+	total = 0.0
+	runs = 0
+
+	while runs < repeat or (total < min_seconds and runs < max_runs):
+		if prepare != None:
+			prepare()
+
+		start = time.perf_counter()
+		run()
+		elapsed = time.perf_counter() - start
+
+		best = min(best, elapsed)
+		total += elapsed
+		runs += 1
+
+	return best
+
+
+def calibrate():
+	# a mix of interpreter and small NumPy work, like the addon's hot paths
+	def workload():
+		mat = np.identity(4)
+		acc = 0
+
+		for i in range(20000):
+			acc += i * i % 7
+			mat = mat @ np.identity(4)
+
+		return acc
+
+	return measure(None, workload, 5)
+
+
+def get_scaling(sizes, seconds):
+	# exponent k of the best fitting t ~ n^k
+	if len(sizes) < 2:
+		return None
+
+	return float(np.polyfit(np.log(sizes), np.log(seconds), 1)[0])
+
+
+def run_cases(bpy, addon, case_names, sizes, frame_count, repeat):
+	results = {}
+
+	for name in case_names:
+		results[name] = {}
+
+		for bone_count in sizes:
+			prepare, run = cases[name](bpy, addon, bone_count, frame_count)
+			results[name][bone_count] = measure(prepare, run, repeat)
+
+	return results
+
+
+
+### REPORTING
+
+
+def format_seconds(seconds):
+	if seconds < 1e-3:
+		return '%.1fus' % (seconds * 1e6)
+	elif seconds < 1:
+		return '%.2fms' % (seconds * 1e3)
+
+	return '%.2fs' % seconds
+
+
+def print_report(results, sizes, frame_count, calibration):
+	print('bones: %s, frames: %i, calibration: %s' % (', '.join(map(str, sizes)), frame_count, format_seconds(calibration)))
+	print()
+	print('%-22s' % 'case' + ''.join('%12s' % n for n in sizes) + '%10s' % 'scaling')
+
+	for name, timings in results.items():
+		seconds = [timings[n] for n in sizes]
+		scaling = get_scaling(sizes, seconds)
+		print(
+			'%-22s' % name
+			+ ''.join('%12s' % format_seconds(s) for s in seconds)
+			+ ('%10s' % ('n^%.2f' % scaling) if scaling != None else '')
+		)
+
+
+def to_baseline(results, frame_count, calibration):
+	return {
+		'frames': frame_count,
+		'cases': {
+			name: {str(n): round(seconds / calibration, 6) for n, seconds in timings.items()}
+			for name, timings in results.items()
+		}
+	}
+
+
+def compare_baseline(baseline, results, frame_count, calibration, threshold):
+	regressions = []
+
+	if baseline['frames'] != frame_count:
+		print('baseline was recorded with %i frames, clip dependent cases are not compared' % baseline['frames'])
+
+	for name, timings in results.items():
+		if baseline['frames'] != frame_count and name in ('get_keyframes', 'transfer_anim'):
+			continue
+
+		for n, seconds in timings.items():
+			recorded = baseline['cases'].get(name, {}).get(str(n))
+
+			if recorded == None:
+				continue
+
+			ratio = seconds / calibration / recorded
+
+			if ratio > threshold:
+				regressions.append((name, n, ratio))
+
+	return regressions
+
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(prog='benchmarks.run', description='Benchmark the retargeting hot paths on synthetic rigs')
+	parser.add_argument('--sizes', default=','.join(map(str, default_sizes)), help='comma separated bone counts (default: %(default)s)')
+	parser.add_argument('--frames', type=int, default=default_frames, help='clip length for the baking cases (default: %(default)s)')
+	parser.add_argument('--cases', default=','.join(cases), help='comma separated cases to run (default: all)')
+	parser.add_argument('--repeat', type=int, default=3, help='minimum runs per measurement, the best one counts (default: %(default)s)')
+	parser.add_argument('--baseline', default=default_baseline, help='baseline file to compare against or record into')
+	parser.add_argument('--threshold', type=float, default=1.5, help='slowdown factor over the baseline that fails the run (default: %(default)s)')
+	parser.add_argument('--record', action='store_true', help='write the results as the new baseline instead of comparing')
+
+	return parser.parse_args(argv)
+
+
+def main(argv=None):
+	args = parse_args(sys.argv[1:] if argv == None else argv)
+	sizes = sorted(int(n) for n in args.sizes.split(','))
+	case_names = [name.strip() for name in args.cases.split(',')]
+	unknown = [name for name in case_names if name not in cases]
+
+	if len(unknown) > 0:
+		sys.exit('unknown cases: %s (available: %s)' % (', '.join(unknown), ', '.join(cases)))
+
+	bpy, addon = load_addon()
+	calibration = calibrate()
+	results = run_cases(bpy, addon, case_names, sizes, args.frames, args.repeat)
+
+	print_report(results, sizes, args.frames, calibration)
+
+	if args.record:
+		baseline = to_baseline(results, args.frames, calibration)
+
+		# recording a subset keeps the other cases of an existing baseline
+		if os.path.exists(args.baseline):
+			with open(args.baseline, 'r') as f:
+				previous = json.load(f)
+
+			if previous['frames'] == args.frames:
+				for name, timings in previous['cases'].items():
+					baseline['cases'][name] = {**timings, **baseline['cases'].get(name, {})}
+
+		with open(args.baseline, 'w') as f:
+			json.dump(baseline, f, indent=4)
+
+		print()
+		print('recorded baseline to %s' % args.baseline)
+		return
+
+	if not os.path.exists(args.baseline):
+		print()
+		print('no baseline at %s, record one with --record' % args.baseline)
+		return
+
+	with open(args.baseline, 'r') as f:
+		regressions = compare_baseline(json.load(f), results, args.frames, calibration, args.threshold)
+
+	print()
+
+	if len(regressions) == 0:
+		print('no regressions beyond %.2fx of the baseline' % args.threshold)
+		return
+
+	for name, n, ratio in regressions:
+		print('REGRESSION %s at %i bones: %.2fx the baseline' % (name, n, ratio))
+
+	sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,909 @@
+import sys
+import math
+import types
+import bisect
+import numpy as np
+
+
+# Just enough of bpy, mathutils and bpy_extras for the addon to import and for the
+# benchmarked functions to run under plain Python. Data blocks and properties
+# behave like their Blender counterparts as far as the addon uses them, math is
+# done with NumPy. Name lookups are hashed and drivers are kept per data path, so
+# the stand-ins add no scaling of their own to the measurements.
+
+
+
+### MATHUTILS
+
+
+class Vector:
+	def __init__(self, values=(0.0, 0.0, 0.0)):
+		self.values = np.array(values, dtype=np.float64).ravel()
+
+	x = property(lambda self: float(self.values[0]), lambda self, v: self.values.__setitem__(0, v))
+	y = property(lambda self: float(self.values[1]), lambda self, v: self.values.__setitem__(1, v))
+	z = property(lambda self: float(self.values[2]), lambda self, v: self.values.__setitem__(2, v))
+
+	def __len__(self):
+		return len(self.values)
+
+	def __iter__(self):
+		return iter(self.values.tolist())
+
+	def __getitem__(self, i):
+		return self.values[i]
+
+	def __setitem__(self, i, value):
+		self.values[i] = value
+
+	def __array__(self, dtype=None, copy=None):
+		return self.values.astype(dtype) if dtype else self.values.copy()
+
+	def __add__(self, other):
+		return Vector(self.values + np.asarray(other))
+
+	def __sub__(self, other):
+		return Vector(self.values - np.asarray(other))
+
+	def __mul__(self, factor):
+		return Vector(self.values * factor)
+
+	def __neg__(self):
+		return Vector(-self.values)
+
+	@property
+	def length(self):
+		return float(np.linalg.norm(self.values))
+
+	def normalized(self):
+		return Vector(self.values / (np.linalg.norm(self.values) or 1.0))
+
+	def copy(self):
+		return Vector(self.values)
+
+	def __repr__(self):
+		return 'Vector(%r)' % (tuple(self),)
+
+
+class Euler(Vector):
+	def __init__(self, values=(0.0, 0.0, 0.0), order='XYZ'):
+		super().__init__(values)
+		self.order = order
+
+	def to_matrix(self):
+		x, y, z = self.values
+		rx = np.array(((1, 0, 0), (0, math.cos(x), -math.sin(x)), (0, math.sin(x), math.cos(x))))
+		ry = np.array(((math.cos(y), 0, math.sin(y)), (0, 1, 0), (-math.sin(y), 0, math.cos(y))))
+		rz = np.array(((math.cos(z), -math.sin(z), 0), (math.sin(z), math.cos(z), 0), (0, 0, 1)))
+		return Matrix(rz @ ry @ rx)
+
+	def to_quaternion(self):
+		return self.to_matrix().to_quaternion()
+
+
+class Quaternion:
+	def __init__(self, values=(1.0, 0.0, 0.0, 0.0)):
+		self.values = np.array(values, dtype=np.float64).ravel()
+
+	w = property(lambda self: float(self.values[0]))
+	x = property(lambda self: float(self.values[1]))
+	y = property(lambda self: float(self.values[2]))
+	z = property(lambda self: float(self.values[3]))
+
+	def __len__(self):
+		return 4
+
+	def __iter__(self):
+		return iter(self.values.tolist())
+
+	def __getitem__(self, i):
+		return self.values[i]
+
+	def __array__(self, dtype=None, copy=None):
+		return self.values.astype(dtype) if dtype else self.values.copy()
+
+	def __matmul__(self, other):
+		w1, x1, y1, z1 = self.values
+		w2, x2, y2, z2 = other.values
+		return Quaternion((
+			w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+			w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+			w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+			w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2
+		))
+
+	def inverted(self):
+		return Quaternion(self.values * (1, -1, -1, -1) / np.dot(self.values, self.values))
+
+	def normalized(self):
+		return Quaternion(self.values / np.linalg.norm(self.values))
+
+	def to_matrix(self):
+		w, x, y, z = self.values / np.linalg.norm(self.values)
+		return Matrix((
+			(1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)),
+			(2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)),
+			(2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y))
+		))
+
+	def to_euler(self, order='XYZ', compat=None):
+		return self.to_matrix().to_euler(order, compat)
+
+	def copy(self):
+		return Quaternion(self.values)
+
+	def __repr__(self):
+		return 'Quaternion(%r)' % (tuple(self),)
+
+
+class Matrix:
+	def __init__(self, rows=None):
+		self.values = np.identity(4) if rows is None else np.array(rows, dtype=np.float64)
+
+	@staticmethod
+	def Identity(size):
+		return Matrix(np.identity(size))
+
+	@staticmethod
+	def Translation(vector):
+		mat = np.identity(4)
+		mat[:3, 3] = tuple(vector)[:3]
+		return Matrix(mat)
+
+	@staticmethod
+	def Diagonal(vector):
+		return Matrix(np.diag(tuple(vector)))
+
+	@staticmethod
+	def LocRotScale(location, rotation, scale):
+		mat = np.identity(4)
+
+		if rotation is not None:
+			mat[:3, :3] = (rotation.to_matrix() if isinstance(rotation, (Quaternion, Euler)) else rotation).values[:3, :3]
+
+		if scale is not None:
+			mat[:3, :3] *= tuple(scale)
+
+		if location is not None:
+			mat[:3, 3] = tuple(location)
+
+		return Matrix(mat)
+
+	def __len__(self):
+		return len(self.values)
+
+	def __iter__(self):
+		return iter(self.values)
+
+	def __getitem__(self, i):
+		return self.values[i]
+
+	def __setitem__(self, i, row):
+		self.values[i] = row
+
+	def __array__(self, dtype=None, copy=None):
+		return self.values.astype(dtype) if dtype else self.values.copy()
+
+	def __matmul__(self, other):
+		if isinstance(other, Matrix):
+			return Matrix(self.values @ other.values)
+
+		vector = np.asarray(other, dtype=np.float64)
+
+		if len(vector) == 3 and len(self.values) == 4:
+			return Vector(self.values[:3, :3] @ vector + self.values[:3, 3])
+
+		return Vector(self.values @ vector)
+
+	def inverted(self):
+		return Matrix(np.linalg.inv(self.values))
+
+	def copy(self):
+		return Matrix(self.values)
+
+	def to_3x3(self):
+		return Matrix(self.values[:3, :3])
+
+	def to_4x4(self):
+		mat = np.identity(4)
+		size = min(len(self.values), 4)
+		mat[:size, :size] = self.values[:size, :size]
+		return Matrix(mat)
+
+	def to_translation(self):
+		return Vector(self.values[:3, 3])
+
+	def to_scale(self):
+		return Vector(np.linalg.norm(self.values[:3, :3], axis=0))
+
+	def to_quaternion(self):
+		m = self.values[:3, :3] / np.linalg.norm(self.values[:3, :3], axis=0)
+		trace = m[0, 0] + m[1, 1] + m[2, 2]
+
+		if trace > 0:
+			s = 0.5 / math.sqrt(trace + 1.0)
+			q = (0.25 / s, (m[2, 1] - m[1, 2]) * s, (m[0, 2] - m[2, 0]) * s, (m[1, 0] - m[0, 1]) * s)
+		elif m[0, 0] > m[1, 1] and m[0, 0] > m[2, 2]:
+			s = 2.0 * math.sqrt(1.0 + m[0, 0] - m[1, 1] - m[2, 2])
+			q = ((m[2, 1] - m[1, 2]) / s, 0.25 * s, (m[0, 1] + m[1, 0]) / s, (m[0, 2] + m[2, 0]) / s)
+		elif m[1, 1] > m[2, 2]:
+			s = 2.0 * math.sqrt(1.0 + m[1, 1] - m[0, 0] - m[2, 2])
+			q = ((m[0, 2] - m[2, 0]) / s, (m[0, 1] + m[1, 0]) / s, 0.25 * s, (m[1, 2] + m[2, 1]) / s)
+		else:
+			s = 2.0 * math.sqrt(1.0 + m[2, 2] - m[0, 0] - m[1, 1])
+			q = ((m[1, 0] - m[0, 1]) / s, (m[0, 2] + m[2, 0]) / s, (m[1, 2] + m[2, 1]) / s, 0.25 * s)
+
+		return Quaternion(q if q[0] >= 0 else tuple(-v for v in q))
+
+	def to_euler(self, order='XYZ', compat=None):
+		# only the XYZ order, the one the addon drives target bones with
+		m = self.values[:3, :3] / np.linalg.norm(self.values[:3, :3], axis=0)
+		cy = math.hypot(m[0, 0], m[1, 0])
+
+		if cy > 1e-6:
+			return Euler((math.atan2(m[2, 1], m[2, 2]), math.atan2(-m[2, 0], cy), math.atan2(m[1, 0], m[0, 0])))
+
+		return Euler((math.atan2(-m[1, 2], m[1, 1]), math.atan2(-m[2, 0], cy), 0.0))
+
+	@property
+	def translation(self):
+		return self.to_translation()
+
+	@translation.setter
+	def translation(self, vector):
+		self.values[:3, 3] = tuple(vector)
+
+	def __repr__(self):
+		return 'Matrix(%r)' % (self.values.tolist(),)
+
+
+
+### PROPERTIES
+
+
+class Property:
+	def __init__(self, kind, **options):
+		self.kind = kind
+		self.options = options
+
+	def get_default(self, owner):
+		default = self.options.get('default')
+
+		if self.kind == 'COLLECTION':
+			return PropCollection(self.options['type'], owner.id_data)
+		elif self.kind == 'POINTER':
+			return None
+		elif self.kind == 'ENUM':
+			return default if default is not None else self.options['items'][0][0]
+		elif self.kind == 'FLOAT_VECTOR':
+			return tuple(default) if default is not None else (0.0,) * self.options.get('size', 3)
+
+		return default if default is not None else {'STRING': '', 'BOOL': False, 'INT': 0, 'FLOAT': 0.0}[self.kind]
+
+
+def make_property(kind):
+	return lambda **options: Property(kind, **options)
+
+
+class PropertyGroup:
+	def __init__(self, id_data=None):
+		object.__setattr__(self, 'id_data', id_data)
+
+		for name, prop in get_properties(type(self)).items():
+			object.__setattr__(self, name, prop.get_default(self))
+
+	def __setattr__(self, name, value):
+		object.__setattr__(self, name, value)
+		prop = get_properties(type(self)).get(name)
+
+		# setting a property from Python runs its update callback, like in Blender
+		if prop is not None and 'update' in prop.options:
+			prop.options['update'](self, bpy_context)
+
+
+def get_properties(cls):
+	if '_properties' not in cls.__dict__:
+		properties = {}
+
+		for base in reversed(cls.__mro__):
+			for name, prop in base.__dict__.get('__annotations__', {}).items():
+				if isinstance(prop, Property):
+					properties[name] = prop
+
+		cls._properties = properties
+
+	return cls._properties
+
+
+class PropCollection:
+	def __init__(self, item_type=None, id_data=None, items=()):
+		self.item_type = item_type
+		self.id_data = id_data
+		self.items = list(items)
+		self.names = None
+
+	def __len__(self):
+		return len(self.items)
+
+	def __iter__(self):
+		return iter(self.items)
+
+	def __bool__(self):
+		return True
+
+	def __getitem__(self, key):
+		if isinstance(key, str):
+			item = self.get(key)
+
+			if item is None:
+				raise KeyError('bpy_prop_collection[key]: key "%s" not found' % key)
+
+			return item
+
+		return self.items[key]
+
+	def __contains__(self, key):
+		return self.get(key) is not None if isinstance(key, str) else key in self.items
+
+	def get(self, name, default=None):
+		if self.names is None or len(self.names) != len(self.items):
+			self.names = {}
+
+			for item in reversed(self.items):
+				self.names[item.name] = item
+
+		item = self.names.get(name)
+
+		# renamed since the index was built
+		if item is not None and item.name != name:
+			self.names = None
+			return self.get(name, default)
+
+		return item if item is not None else default
+
+	def find(self, name):
+		item = self.get(name)
+		return self.items.index(item) if item is not None else -1
+
+	def keys(self):
+		return [item.name for item in self.items]
+
+	def values(self):
+		return list(self.items)
+
+	def append(self, item):
+		self.items.append(item)
+		return item
+
+	def add(self):
+		return self.append(self.item_type(id_data=self.id_data))
+
+	def new(self, *args):
+		return self.append(self.item_type(*args))
+
+	def remove(self, item):
+		self.items.pop(item if isinstance(item, int) else self.items.index(item))
+		self.names = None
+
+	def move(self, source, target):
+		self.items.insert(target, self.items.pop(source))
+
+	def clear(self):
+		self.items.clear()
+		self.names = None
+
+	def foreach_get(self, attr, buffer):
+		if len(self.items) > 0:
+			buffer[:] = np.ravel([flatten_value(getattr(item, attr)) for item in self.items])
+
+	def foreach_set(self, attr, buffer):
+		if len(self.items) == 0:
+			return
+
+		values = np.asarray(buffer).reshape(len(self.items), -1)
+
+		for item, value in zip(self.items, values):
+			object.__setattr__(item, attr, unflatten_value(getattr(item, attr), value))
+
+
+def flatten_value(value):
+	# matrices are flattened column-major, like Blender does
+	if isinstance(value, Matrix):
+		return value.values.T.ravel()
+
+	return np.asarray(value, dtype=np.float64).ravel()
+
+
+def unflatten_value(current, value):
+	if isinstance(current, Matrix):
+		return Matrix(value.reshape(len(current), -1).T)
+	elif isinstance(current, tuple):
+		return tuple(value.tolist())
+
+	return type(current)(value)
+
+
+
+### DATA BLOCKS
+
+
+class ID:
+	def __init__(self, name):
+		self.name = name
+		self.use_fake_user = False
+
+	@property
+	def original(self):
+		return self
+
+	def as_pointer(self):
+		return id(self)
+
+
+class DriverTarget:
+	def __init__(self):
+		self.id = None
+		self.bone_target = ''
+		self.data_path = ''
+		self.rotation_mode = 'AUTO'
+		self.transform_space = 'WORLD_SPACE'
+		self.transform_type = 'LOC_X'
+
+
+class DriverVariable:
+	def __init__(self):
+		self.name = 'var'
+		self.type = 'SINGLE_PROP'
+		self.targets = [DriverTarget(), DriverTarget()]
+
+
+class Driver:
+	def __init__(self):
+		self.type = 'SCRIPTED'
+		self.expression = ''
+		self.variables = PropCollection(DriverVariable)
+		self.use_self = False
+
+
+class KeyframePoints:
+	def __init__(self):
+		self.co = np.empty((0, 2))
+		self.interpolation = np.empty(0, dtype=np.int32)
+		self.samples = None
+
+	def __len__(self):
+		return len(self.co)
+
+	def add(self, count=1):
+		self.co = np.concatenate((self.co, np.zeros((count, 2))))
+		self.interpolation = np.concatenate((self.interpolation, np.zeros(count, dtype=np.int32)))
+		self.samples = None
+
+	def foreach_get(self, attr, buffer):
+		buffer[:] = getattr(self, attr).ravel()
+
+	def foreach_set(self, attr, buffer):
+		setattr(self, attr, np.array(buffer).reshape(getattr(self, attr).shape))
+		self.samples = None
+
+
+class FCurve:
+	def __init__(self, data_path, index=0, group=None):
+		self.data_path = data_path
+		self.array_index = index
+		self.group = group
+		self.keyframe_points = KeyframePoints()
+		self.driver = Driver()
+		self.mute = False
+
+	def evaluate(self, frame):
+		# linear interpolation, which is what the synthetic clips are keyed with
+		if self.keyframe_points.samples is None:
+			co = self.keyframe_points.co
+			self.keyframe_points.samples = (co[:, 0].tolist(), co[:, 1].tolist())
+
+		frames, values = self.keyframe_points.samples
+
+		if len(frames) == 0:
+			return 0.0
+
+		i = bisect.bisect_right(frames, frame)
+
+		if i == 0:
+			return values[0]
+		elif i == len(frames):
+			return values[-1]
+
+		t = (frame - frames[i - 1]) / (frames[i] - frames[i - 1])
+		return values[i - 1] + (values[i] - values[i - 1]) * t
+
+	def update(self):
+		pass
+
+
+class FCurves(PropCollection):
+	def __init__(self):
+		super().__init__(FCurve)
+		self.paths = {}
+
+	def new(self, data_path, index=0, action_group=''):
+		if (data_path, index) in self.paths:
+			raise RuntimeError('F-Curve "%s[%i]" already exists' % (data_path, index))
+
+		fc = self.append(FCurve(data_path, index, action_group))
+		self.paths[(data_path, index)] = fc
+		return fc
+
+	def find(self, data_path, index=0):
+		return self.paths.get((data_path, index))
+
+	def remove(self, fc):
+		self.paths.pop((fc.data_path, fc.array_index), None)
+		super().remove(fc)
+
+	def clear(self):
+		self.paths.clear()
+		super().clear()
+
+
+class Drivers:
+	# insertion ordered per data path, so removing a bone's drivers does not scan all of them
+	def __init__(self):
+		self.paths = {}
+
+	def __len__(self):
+		return sum(len(fcurves) for fcurves in self.paths.values())
+
+	def __iter__(self):
+		return (fc for fcurves in list(self.paths.values()) for fc in fcurves)
+
+	def add(self, data_path, size):
+		if data_path not in self.paths:
+			self.paths[data_path] = [FCurve(data_path, index) for index in range(size)]
+
+		return list(self.paths[data_path])
+
+	def remove_path(self, data_path):
+		return self.paths.pop(data_path, None) is not None
+
+	def find(self, data_path, index=0):
+		fcurves = self.paths.get(data_path, ())
+		return fcurves[index] if index < len(fcurves) else None
+
+
+class Action(ID):
+	def __init__(self, name):
+		super().__init__(name)
+		self.fcurves = FCurves()
+		self.use_frame_range = False
+
+	@property
+	def frame_range(self):
+		keys = [fc.keyframe_points.co[:, 0] for fc in self.fcurves if len(fc.keyframe_points) > 0]
+
+		if len(keys) == 0:
+			return (0.0, 1.0)
+
+		keys = np.concatenate(keys)
+		return (float(keys.min()), float(max(keys.max(), keys.min() + 1)))
+
+
+class AnimData:
+	def __init__(self):
+		self.action = None
+		self.drivers = Drivers()
+
+
+class DriverOwner:
+	def get_driver_prefix(self):
+		return ''
+
+	def get_driver_id(self):
+		return self
+
+	def driver_add(self, path, index=-1):
+		owner = self.get_driver_id()
+
+		if owner.animation_data is None:
+			owner.animation_data_create()
+
+		fcurves = owner.animation_data.drivers.add(self.get_driver_prefix() + path, len(getattr(self, path)))
+		return fcurves if index == -1 else fcurves[index]
+
+	def driver_remove(self, path, index=-1):
+		anim = self.get_driver_id().animation_data
+		return anim is not None and anim.drivers.remove_path(self.get_driver_prefix() + path)
+
+
+class Constraint:
+	def __init__(self, type):
+		self.type = type
+		self.name = type.replace('_', ' ').title()
+		self.target = None
+		self.subtarget = ''
+		self.target_space = 'WORLD'
+		self.owner_space = 'WORLD'
+		self.enabled = True
+		self.influence = 1.0
+
+
+class Constraints(PropCollection):
+	def __init__(self):
+		super().__init__(Constraint)
+
+	def new(self, type):
+		return self.append(Constraint(type))
+
+
+class Bone:
+	def __init__(self, name, parent, head_local, tail_local, matrix_local):
+		self.name = name
+		self.parent = parent
+		self.children = []
+		self.head_local = Vector(head_local)
+		self.tail_local = Vector(tail_local)
+		self.matrix_local = matrix_local
+		self.length = (self.tail_local - self.head_local).length
+		self.use_connect = False
+
+		if parent is None:
+			self.matrix = matrix_local.to_3x3()
+		else:
+			parent.children.append(self)
+			self.matrix = (parent.matrix_local.inverted() @ matrix_local).to_3x3()
+
+
+pose_channels = {'location', 'rotation_quaternion', 'rotation_euler', 'rotation_axis_angle', 'rotation_mode', 'scale'}
+
+
+class PoseBone(DriverOwner):
+	def __init__(self, obj, bone, parent):
+		self.id_data = obj
+		self.name = bone.name
+		self.bone = bone
+		self.parent = parent
+		self.location = Vector((0.0, 0.0, 0.0))
+		self.rotation_quaternion = Quaternion()
+		self.rotation_euler = Euler()
+		self.rotation_axis_angle = (0.0, 0.0, 1.0, 0.0)
+		self.rotation_mode = 'QUATERNION'
+		self.scale = Vector((1.0, 1.0, 1.0))
+		self.constraints = Constraints()
+		self.lock_rotation = (False, False, False)
+		self.pose_matrix = (-1, None)
+
+	def get_driver_prefix(self):
+		return 'pose.bones["%s"].' % escape_identifier(self.name)
+
+	def get_driver_id(self):
+		return self.id_data
+
+	@property
+	def matrix_basis(self):
+		rotation = self.rotation_quaternion if self.rotation_mode == 'QUATERNION' else self.rotation_euler
+		return Matrix.LocRotScale(self.location, rotation, self.scale)
+
+	@matrix_basis.setter
+	def matrix_basis(self, mat):
+		mat = mat if isinstance(mat, Matrix) else Matrix(mat)
+		self.location = mat.to_translation()
+		self.rotation_quaternion = mat.to_quaternion()
+		self.rotation_euler = mat.to_euler()
+		self.scale = mat.to_scale()
+
+	def __setattr__(self, name, value):
+		object.__setattr__(self, name, value)
+
+		if name in pose_channels and hasattr(self, 'pose_matrix'):
+			self.id_data.pose.revision += 1
+
+	@property
+	def matrix(self):
+		# evaluated once per pose change, like the depsgraph does
+		revision, mat = self.pose_matrix
+
+		if revision != self.id_data.pose.revision:
+			if self.parent is None:
+				mat = self.bone.matrix_local @ self.matrix_basis
+			else:
+				rel_mat = self.parent.bone.matrix_local.inverted() @ self.bone.matrix_local
+				mat = self.parent.matrix @ rel_mat @ self.matrix_basis
+
+			self.pose_matrix = (self.id_data.pose.revision, mat)
+
+		return mat
+
+	@property
+	def head(self):
+		return self.matrix.to_translation()
+
+
+class Pose:
+	def __init__(self, obj):
+		self.revision = 0
+		self.bones = PropCollection(PoseBone)
+		pose_bones = {}
+
+		for bone in obj.data.bones:
+			pose_bones[bone.name] = self.bones.append(PoseBone(obj, bone, pose_bones.get(bone.parent.name) if bone.parent else None))
+
+
+class Armature(ID):
+	def __init__(self, name):
+		super().__init__(name)
+		self.bones = PropCollection(Bone)
+		self.pose_position = 'POSE'
+
+
+class Object(ID, DriverOwner):
+	def __init__(self, name, data=None):
+		super().__init__(name)
+		self.data = data
+		self.type = 'ARMATURE' if isinstance(data, Armature) else 'EMPTY'
+		self.matrix_world = Matrix()
+		self.matrix_basis = Matrix()
+		self.location = Vector((0.0, 0.0, 0.0))
+		self.rotation_euler = Euler()
+		self.scale = Vector((1.0, 1.0, 1.0))
+		self.parent = None
+		self.pose = Pose(self) if self.type == 'ARMATURE' else None
+		self.animation_data = None
+		self.constraints = Constraints()
+		self.mode = 'OBJECT'
+		self.hide_select = False
+		self.hide_viewport = False
+		self.empty_display_size = 1.0
+		self.selected = False
+
+	def animation_data_create(self):
+		self.animation_data = AnimData()
+		return self.animation_data
+
+	def select_set(self, state):
+		self.selected = state
+
+	def select_get(self):
+		return self.selected
+
+	def evaluated_get(self, depsgraph):
+		return self
+
+	def update_tag(self, refresh=set()):
+		pass
+
+
+class Collection(ID):
+	def __init__(self, name):
+		super().__init__(name)
+		self.objects = Links()
+		self.children = Links()
+
+
+class Links(PropCollection):
+	def link(self, item):
+		self.append(item)
+
+	def unlink(self, item):
+		self.remove(item)
+
+
+class IDCollection(PropCollection):
+	def __init__(self, factory):
+		super().__init__()
+		self.factory = factory
+
+	def new(self, name, *args):
+		return self.append(self.factory(name, *args))
+
+	def remove(self, item, do_unlink=True):
+		super().remove(item)
+
+
+
+### BPY
+
+
+def escape_identifier(name):
+	return name.replace('\\', '\\\\').replace('"', '\\"')
+
+
+class Operators:
+	def __init__(self, path=()):
+		self.path = path
+
+	def __getattr__(self, name):
+		return Operators(self.path + (name,))
+
+	def __call__(self, *args, **kwargs):
+		raise RuntimeError('bpy.ops.%s is not available outside of Blender' % '.'.join(self.path))
+
+
+class Handlers:
+	def __init__(self):
+		for name in ('load_post', 'depsgraph_update_pre', 'depsgraph_update_post', 'frame_change_pre', 'frame_change_post', 'undo_post', 'redo_post'):
+			setattr(self, name, [])
+
+	@staticmethod
+	def persistent(func):
+		return func
+
+
+class Depsgraph:
+	def __init__(self):
+		self.updates = []
+
+
+bpy_context = types.SimpleNamespace(
+	object=None,
+	selected_objects=[],
+	selected_pose_bones=[],
+	scene=types.SimpleNamespace(collection=Collection('Scene Collection'), frame_current=1),
+	view_layer=types.SimpleNamespace(objects=types.SimpleNamespace(active=None)),
+	window_manager=types.SimpleNamespace(popup_menu=lambda *args, **kwargs: None, windows=[]),
+	evaluated_depsgraph_get=lambda: Depsgraph()
+)
+
+
+def install():
+	if isinstance(sys.modules.get('bpy'), types.ModuleType) and not hasattr(sys.modules['bpy'], 'standin'):
+		raise RuntimeError('running inside Blender, the stand-ins would shadow the real bpy')
+
+	mathutils = types.ModuleType('mathutils')
+	mathutils.Matrix = Matrix
+	mathutils.Vector = Vector
+	mathutils.Quaternion = Quaternion
+	mathutils.Euler = Euler
+
+	bpy = types.ModuleType('bpy')
+	bpy.standin = True
+	bpy.types = types.SimpleNamespace(
+		ID=ID,
+		Object=Object,
+		Armature=Armature,
+		Action=Action,
+		Bone=Bone,
+		PoseBone=PoseBone,
+		PropertyGroup=PropertyGroup,
+		Operator=type('Operator', (), {}),
+		Panel=type('Panel', (), {}),
+		UIList=type('UIList', (), {}),
+		OperatorFileListElement=type('OperatorFileListElement', (PropertyGroup,), {})
+	)
+	bpy.props = types.SimpleNamespace(
+		StringProperty=make_property('STRING'),
+		BoolProperty=make_property('BOOL'),
+		IntProperty=make_property('INT'),
+		FloatProperty=make_property('FLOAT'),
+		FloatVectorProperty=make_property('FLOAT_VECTOR'),
+		EnumProperty=make_property('ENUM'),
+		PointerProperty=make_property('POINTER'),
+		CollectionProperty=make_property('COLLECTION')
+	)
+	bpy.app = types.SimpleNamespace(handlers=Handlers(), driver_namespace={}, binary_path='blender', version=(3, 0, 0))
+	bpy.data = types.SimpleNamespace(
+		objects=IDCollection(Object),
+		actions=IDCollection(Action),
+		collections=IDCollection(Collection),
+		filepath=''
+	)
+	bpy.context = bpy_context
+	bpy.ops = Operators()
+	bpy.utils = types.SimpleNamespace(
+		register_class=lambda cls: None,
+		unregister_class=lambda cls: None,
+		escape_identifier=escape_identifier
+	)
+
+	bpy_extras = types.ModuleType('bpy_extras')
+	bpy_extras.io_utils = types.ModuleType('bpy_extras.io_utils')
+	bpy_extras.io_utils.ImportHelper = type('ImportHelper', (), {})
+	bpy_extras.io_utils.ExportHelper = type('ExportHelper', (), {})
+
+	sys.modules.update({
+		'bpy': bpy,
+		'mathutils': mathutils,
+		'bpy_extras': bpy_extras,
+		'bpy_extras.io_utils': bpy_extras.io_utils
+	})
+
+	return bpy
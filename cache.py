@@ -0,0 +1,24 @@
+class FrameCache:
+	def __init__(self):
+		self.frame = None
+		self.entries = {}
+
+	def get(self, frame, key):
+		if frame != self.frame:
+			self.entries.clear()
+			self.frame = frame
+			return None
+
+		return self.entries.get(key)
+
+	def put(self, frame, key, value):
+		if frame != self.frame:
+			self.entries.clear()
+			self.frame = frame
+
+		self.entries[key] = value
+		return value
+
+	def clear(self):
+		self.frame = None
+		self.entries.clear()
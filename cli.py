@@ -0,0 +1,118 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import bpy
+from . import batch
+from . import savefile
+from .log import info
+
+
+# Headless entry point, e.g.
+#
+#   blender -b character.blend --addons <addon> \
+#     --python-expr "import importlib; importlib.import_module('<addon>.cli').main()" \
+#     -- --config character.blend-retarget --sources "clips/*.fbx" --workers 4
+#
+# Prints one JSON summary line (prefixed with RETARGET_SUMMARY) and exits non-zero
+# when any file failed.
+
+
+summary_prefix = 'RETARGET_SUMMARY '
+
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(prog='retarget', description='Retarget and bake animation files onto an armature')
+	parser.add_argument('--config', required=True, help='.blend-retarget config to apply to the target armature')
+	parser.add_argument('--sources', required=True, action='append', help='glob of FBX/BVH files to bake, can be repeated')
+	parser.add_argument('--target', help='name of the target armature object (default: the only retargeted armature)')
+	parser.add_argument('--output', help='.blend file to save the baked actions into (default: <input>.retargeted.blend)')
+	parser.add_argument('--workers', type=int, default=1, help='number of parallel background Blender processes')
+	parser.add_argument('--summary', help='also write the JSON summary to this file')
+	parser.add_argument('--ignore-leaf-bones', action='store_true')
+	parser.add_argument('--automatic-bone-orientation', action='store_true')
+
+	return parser.parse_args(argv)
+
+
+def find_target(name):
+	if name != None:
+		return bpy.data.objects[name]
+
+	armatures = [
+		obj for obj in bpy.data.objects
+		if obj.type == 'ARMATURE' and obj.retargeting_context.source != None
+	]
+
+	if len(armatures) != 1:
+		raise Exception('%i retargeted armatures in file, choose one with --target' % len(armatures))
+
+	return armatures[0]
+
+
+def run(args):
+	filepaths = sorted(set(path for pattern in args.sources for path in glob.glob(pattern)))
+	target = find_target(args.target)
+	ctx = target.retargeting_context
+	options = {
+		'ignore_leaf_bones': args.ignore_leaf_bones,
+		'automatic_bone_orientation': args.automatic_bone_orientation
+	}
+
+	bpy.context.view_layer.objects.active = target
+
+	if ctx.target == None:
+		ctx.target = target
+
+	savefile.load_serialized_state(ctx, savefile.read_state(args.config))
+
+	if args.workers > 1:
+		results = batch.run_batch(ctx, filepaths, args.workers, options)
+	else:
+		results = []
+
+		for index, filepath in enumerate(filepaths):
+			result = batch.bake_file(ctx, index, filepath, options)
+			results.append(result)
+			batch.report_result(result, len(results), len(filepaths))
+
+	output = args.output or os.path.splitext(bpy.data.filepath)[0] + '.retargeted.blend'
+	bpy.ops.wm.save_as_mainfile(filepath=output, copy=True)
+	info('saved baked actions to %s' % output)
+
+	return results, output
+
+
+def main(argv=None):
+	if argv == None:
+		argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+
+	args = parse_args(argv)
+	start = time.perf_counter()
+	output = None
+
+	try:
+		results, output = run(args)
+		error = None
+	except Exception as e:
+		results = []
+		error = str(e)
+
+	summary = {
+		'output': output,
+		'error': error,
+		'seconds': time.perf_counter() - start,
+		'files': sorted(results, key=lambda result: result['index']),
+		'ok': sum(1 for result in results if result['status'] == 'ok'),
+		'failed': sum(1 for result in results if result['status'] != 'ok')
+	}
+
+	print(summary_prefix + json.dumps(summary), flush=True)
+
+	if args.summary != None:
+		with open(args.summary, 'w') as f:
+			json.dump(summary, f, indent=4)
+
+	sys.exit(0 if error == None and summary['failed'] == 0 else 1)
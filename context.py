@@ -1,21 +1,22 @@
 import bpy
-from .mapping import count_incompatible_mappings, warn_incompatible_source_armature
+import numpy as np
+from .mapping import get_compatibility_report, warn_incompatible_source_armature
 from .drivers import update_drivers, clear_drivers
 from .ik import update_ik_limbs
 from .log import info
 
 
-class BonePose(bpy.types.PropertyGroup):
-	bone: bpy.props.StringProperty()
-	matrix: bpy.props.FloatVectorProperty(size=16, default=(1,0,0,0,0,1,0,0,0,0,1,0,0,0,0,1))
-
+lookup_indexes = {}
+alignment_counts = {}
+mapping_matrices = {}
 
 
 class BoneMapping(bpy.types.PropertyGroup):
-	source: bpy.props.StringProperty()
-	target: bpy.props.StringProperty()
-	rest: bpy.props.FloatVectorProperty(size=16, default=(1,0,0,0,0,1,0,0,0,0,1,0,0,0,0,1))
-	offset: bpy.props.FloatVectorProperty(size=16, default=(1,0,0,0,0,1,0,0,0,0,1,0,0,0,0,1))
+	source: bpy.props.StringProperty(update=lambda self, ctx: invalidate_lookup_index(self.id_data))
+	target: bpy.props.StringProperty(update=lambda self, ctx: invalidate_lookup_index(self.id_data))
+	rest: bpy.props.FloatVectorProperty(size=16, default=(1,0,0,0,0,1,0,0,0,0,1,0,0,0,0,1), update=lambda self, ctx: invalidate_mapping_matrices(self.id_data))
+	offset: bpy.props.FloatVectorProperty(size=16, default=(1,0,0,0,0,1,0,0,0,0,1,0,0,0,0,1), update=lambda self, ctx: invalidate_mapping_matrices(self.id_data))
+	driver_fingerprint: bpy.props.StringProperty()
 
 	def is_valid(self):
 		return (self.source != None 
@@ -32,14 +33,16 @@ class BoneMapping(bpy.types.PropertyGroup):
 class IKLimb(bpy.types.PropertyGroup):
 	name: bpy.props.StringProperty()
 	enabled: bpy.props.BoolProperty(default=False)
-	target_bone: bpy.props.StringProperty(update=lambda self, ctx: update_ik_limbs(bpy.ctx.object.retargeting_context))
-	origin_bone: bpy.props.StringProperty(update=lambda self, ctx: update_ik_limbs(bpy.ctx.object.retargeting_context))
+	target_bone: bpy.props.StringProperty(update=lambda self, ctx: update_ik_limbs(bpy.context.object.retargeting_context))
+	origin_bone: bpy.props.StringProperty(update=lambda self, ctx: update_ik_limbs(bpy.context.object.retargeting_context))
 	target_empty: bpy.props.PointerProperty(type=bpy.types.Object)
 	target_empty_child: bpy.props.PointerProperty(type=bpy.types.Object)
 	pole_empty: bpy.props.PointerProperty(type=bpy.types.Object)
 	control_holder: bpy.props.PointerProperty(type=bpy.types.Object)
 	control_cube: bpy.props.PointerProperty(type=bpy.types.Object)
 	control_transform: bpy.props.FloatVectorProperty(size=16, default=(1,0,0,0,0,1,0,0,0,0,1,0,0,0,0,1))
+	control_fingerprint: bpy.props.StringProperty()
+	driver_fingerprint: bpy.props.StringProperty()
 
 
 
@@ -51,22 +54,48 @@ class Context(bpy.types.PropertyGroup):
 	)
 	source: bpy.props.PointerProperty(type=bpy.types.Object)
 	target: bpy.props.PointerProperty(type=bpy.types.Object)
-	target_pose_backup: bpy.props.CollectionProperty(type=BonePose)
+	target_pose_backup: bpy.props.StringProperty()
+	target_pose_backup_bones: bpy.props.StringProperty()
 	mappings: bpy.props.CollectionProperty(type=BoneMapping)
 	did_setup_empty_alignment: bpy.props.BoolProperty(default=False)
 	active_mapping: bpy.props.IntProperty()
 	ik_limbs: bpy.props.CollectionProperty(type=IKLimb)
 	is_importing: bpy.props.BoolProperty(default=False)
+	driver_stamp: bpy.props.StringProperty()
 
 	setting_correct_feet: bpy.props.BoolProperty(default=False, update=lambda self, ctx: self.handle_ik_change())
 	setting_correct_hands: bpy.props.BoolProperty(default=False, update=lambda self, ctx: self.handle_ik_change())
 	setting_disable_drivers: bpy.props.BoolProperty(default=False)
+	setting_engine: bpy.props.EnumProperty(
+		items=(
+			('DRIVERS', 'Drivers', 'Drive every target bone with per-axis Python drivers'),
+			('SOLVER', 'Solver', 'Retarget all bones at once from a frame change handler. Faster on large rigs'),
+			('CONSTRAINTS', 'Constraints', 'Retarget with native constraints on helper empties, without Python during playback. Bones with unmapped bones in between their mapped parent still use drivers')
+		),
+		default='DRIVERS',
+		update=lambda self, ctx: update_drivers(self)
+	)
+	setting_guess_method: bpy.props.EnumProperty(
+		items=(
+			('NAME', 'By Name', 'Pair bones with similar names'),
+			('TOPOLOGY', 'By Topology', 'Pair bones by their place in the hierarchy and rest position. Works with meaningless bone names')
+		),
+		default='NAME'
+	)
 	setting_bake_step: bpy.props.FloatProperty(default=1.0)
 	setting_bake_linear: bpy.props.BoolProperty(default=False)
+	setting_bake_method: bpy.props.EnumProperty(
+		items=(
+			('VISUAL', 'Visual Keying', 'Bake by stepping through the scene and keying the driven pose'),
+			('DIRECT', 'Direct', 'Compute the keyframes directly from the source action, without evaluating the scene. Falls back to visual keying when IK corrections are enabled')
+		),
+		default='VISUAL'
+	)
 
 	ui_editing_mappings: bpy.props.BoolProperty(default=False)
 	ui_guessing_mappings: bpy.props.BoolProperty(default=False)
 	ui_editing_alignment: bpy.props.BoolProperty(default=False)
+	ui_show_profiling: bpy.props.BoolProperty(default=False)
 
 
 	def update_drivers(self):
@@ -81,10 +110,10 @@ class Context(bpy.types.PropertyGroup):
 			return
 
 		if len(self.mappings) > 0 and not ignore_incompat:
-			incompat_n = count_incompatible_mappings(self, self.selected_source)
+			report = get_compatibility_report(self, self.selected_source)
 
-			if incompat_n > 0:
-				warn_incompatible_source_armature(incompat_n)
+			if len(report.missing) > 0:
+				warn_incompatible_source_armature(report)
 				return
 		
 		info('set source armature to %s' % self.selected_source.name)
@@ -106,25 +135,66 @@ class Context(bpy.types.PropertyGroup):
 		return self.target.data
 	
 
+	def get_mapping_matrices(self):
+		# (mappings, 2, 4, 4) array of every mapping's rest and offset matrix, row-major like list_to_matrix
+		# dropped when rest/offset are edited, through set_mapping_matrices, and on undo/redo
+		matrices = mapping_matrices.get(self.id_data.name)
+
+		if matrices is None or len(matrices) != len(self.mappings):
+			matrices = build_mapping_matrices(self)
+
+		return matrices
+
+
+	def set_mapping_matrices(self, matrices):
+		matrices = np.asarray(matrices, dtype=np.float32).reshape(-1, 2, 4, 4)
+		self.mappings.foreach_set('rest', matrices[:, 0].ravel())
+		self.mappings.foreach_set('offset', matrices[:, 1].ravel())
+
+		# foreach_set does not run the update callbacks
+		invalidate_mapping_matrices(self.id_data)
+
+
 	def get_bone_alignments_count(self):
-		return sum([
-			1 if any(a!=b for a,b in zip(m.offset, (1,0,0,0,0,1,0,0,0,0,1,0,0,0,0,1))) else 0
-			for m in self.mappings
-		])
+		# called on every redraw, only recounted after offsets were stored or mappings added/removed
+		cached = alignment_counts.get(self.id_data.name)
+
+		if cached is None or cached[0] != len(self.mappings):
+			cached = (len(self.mappings), count_bone_alignments(self))
+			alignment_counts[self.id_data.name] = cached
+
+		return cached[1]
 	
 
+	def get_lookup_index(self):
+		index = lookup_indexes.get(self.id_data.name)
+
+		if index is None or index['mappings_n'] != len(self.mappings) or index['ik_limbs_n'] != len(self.ik_limbs):
+			index = build_lookup_index(self)
+
+		return index
+
+
+	def lookup(self, collection, key, attr, name):
+		i = self.get_lookup_index()[key].get(name)
+
+		# renames and undo keep the counts, a miss or mismatch is checked against a fresh index
+		if i is None or getattr(collection[i], attr) != name:
+			i = build_lookup_index(self)[key].get(name)
+
+		return collection[i] if i is not None else None
+
+
 	def get_mapping_for_target(self, name):
-		for mapping in self.mappings:
-			if mapping.target == name:
-				return mapping
+		return self.lookup(self.mappings, 'mapping_target', 'target', name)
 
 
-	def get_ik_limb_by_name(self, name):
-		for limb in self.ik_limbs:
-			if limb.name == name:
-				return limb
+	def get_mapping_for_source(self, name):
+		return self.lookup(self.mappings, 'mapping_source', 'source', name)
 
-		return None
+
+	def get_ik_limb_by_name(self, name):
+		return self.lookup(self.ik_limbs, 'ik_limb_name', 'name', name)
 	
 
 	def get_guessing_bones(self):
@@ -134,14 +204,71 @@ class Context(bpy.types.PropertyGroup):
 	def reset(self):
 		self.mappings.clear()
 		self.ik_limbs.clear()
+		invalidate_lookup_index(self.id_data)
+		invalidate_mapping_matrices(self.id_data)
 		self.setting_correct_feet = False
 		self.setting_correct_hands = False
 		self.did_setup_empty_alignment = True
 
 
 
+def build_lookup_index(ctx):
+	index = {
+		'mappings_n': len(ctx.mappings),
+		'ik_limbs_n': len(ctx.ik_limbs),
+		'mapping_target': {},
+		'mapping_source': {},
+		'ik_limb_name': {}
+	}
+
+	# reversed, so that the first of duplicate entries wins like in a linear scan
+	for i in reversed(range(len(ctx.mappings))):
+		mapping = ctx.mappings[i]
+		index['mapping_target'][mapping.target] = i
+		index['mapping_source'][mapping.source] = i
+
+	for i in reversed(range(len(ctx.ik_limbs))):
+		index['ik_limb_name'][ctx.ik_limbs[i].name] = i
+
+	lookup_indexes[ctx.id_data.name] = index
+
+	return index
+
+
+def invalidate_lookup_index(obj):
+	lookup_indexes.pop(obj.name, None)
+
+
+def build_mapping_matrices(ctx):
+	n = len(ctx.mappings)
+	buffer = np.empty((2, n * 16), dtype=np.float32)
+	ctx.mappings.foreach_get('rest', buffer[0])
+	ctx.mappings.foreach_get('offset', buffer[1])
+
+	matrices = np.ascontiguousarray(buffer.reshape(2, n, 4, 4).transpose(1, 0, 2, 3), dtype=np.float64)
+	mapping_matrices[ctx.id_data.name] = matrices
+
+	return matrices
+
+
+def invalidate_mapping_matrices(obj):
+	mapping_matrices.pop(obj.name, None)
+	alignment_counts.pop(obj.name, None)
+
+
+def count_bone_alignments(ctx):
+	offsets = ctx.get_mapping_matrices()[:, 1]
+	return int(np.any(offsets != np.identity(4), axis=(1, 2)).sum())
+
+
+def invalidate_caches():
+	lookup_indexes.clear()
+	alignment_counts.clear()
+	mapping_matrices.clear()
+
+
+
 classes = (
-	BonePose,
 	BoneMapping,
 	IKLimb,
 	Context,
@@ -1,13 +1,26 @@
+import re
 import bpy
 from mathutils import Matrix, Vector, Quaternion
-from .mapping import get_intermediate_bones
 from .ik import update_ik_controls, clear_ik_controls
-from .util import rot_mat, loc_mat, list_to_matrix, extract_loc_axis_from_mat, extract_rot_axis_from_mat
+from .util import extract_loc_axis_from_mat, extract_rot_axis_from_mat, fingerprint
+from .cache import FrameCache
+from .plan import compile_plan, get_plan, invalidate_plan
+from .solver import enable_solver, disable_solver, resume_solver
+from .native import get_native_bones, build_native_constraints, clear_native_constraints, resume_native_constraints
+from .profiling import timed
 from .log import info
 
 
+bone_mat_cache = FrameCache()
+pending_restores = set()
+requested_restores = set()
+driver_version = 2
+driven_bone_path = re.compile(r'^pose\.bones\["((?:[^"\\]|\\.)*)"\]\.(location|rotation_euler)$')
+
+
 def draw_panel(ctx, layout):
 	layout.enabled = not ctx.ui_editing_mappings and not ctx.ui_editing_alignment
+	layout.row().prop(ctx, 'setting_engine', expand=True)
 	
 	if ctx.setting_disable_drivers:
 		split = layout.split(factor=0.63)
@@ -18,7 +31,13 @@ def draw_panel(ctx, layout):
 		status = split.column()
 		actions = split.row()
 
-		status.label(text='%i Bone Drivers' % len(ctx.mappings), icon='DRIVER')
+		if ctx.setting_engine == 'SOLVER':
+			status.label(text='%i Bones solved' % len(ctx.mappings), icon='SETTINGS')
+		elif ctx.setting_engine == 'CONSTRAINTS':
+			status.label(text='%i Bones constrained' % len(ctx.mappings), icon='CONSTRAINT_BONE')
+		else:
+			status.label(text='%i Bone Drivers' % len(ctx.mappings), icon='DRIVER')
+
 		actions.operator(DriversRebuildOperator.bl_idname, text='Rebuild', icon='FILE_REFRESH')
 		actions.operator(DriversDisableOperator.bl_idname, text='Disable', icon='X')
 
@@ -30,34 +49,120 @@ def draw_panel(ctx, layout):
 
 
 
-def update_drivers(ctx):
-	if ctx.is_importing:
+def update_drivers(ctx, force=False):
+	if ctx.is_importing or ctx.source == None:
 		return
 
 	if not ctx.setting_disable_drivers and (ctx.get_bone_alignments_count() > 0 or ctx.did_setup_empty_alignment):
+		if force:
+			clear_ik_controls(ctx)
+			clear_drivers(ctx)
+
 		update_ik_controls(ctx)
-		clear_drivers(ctx)
 		build_drivers(ctx)
 	else:
 		clear_ik_controls(ctx)
 		clear_drivers(ctx)
 
 
+@timed('clear_drivers')
 def clear_drivers(ctx):
+	bone_mat_cache.clear()
+	invalidate_plan(ctx)
+	disable_solver(ctx)
+	clear_native_constraints(ctx)
+
+	for bone_name in get_driven_bones(ctx) | set(mapping.target for mapping in ctx.mappings):
+		clear_bone_drivers(ctx, bone_name)
+
 	for mapping in ctx.mappings:
-		dest_pose = ctx.target.pose.bones[mapping.target]
-		dest_pose.driver_remove('location')
-		dest_pose.driver_remove('rotation_euler')
-		dest_pose.matrix_basis = Matrix()
+		mapping.driver_fingerprint = ''
 
 	for limb in ctx.ik_limbs:
-		if limb.target_empty != None:
-			limb.target_empty.driver_remove('location')
-			limb.target_empty.driver_remove('rotation_euler')
+		clear_ik_drivers(limb)
+
+	ctx.driver_stamp = ''
 
 	info('cleared drivers')
 
 
+def clear_bone_drivers(ctx, bone_name):
+	dest_pose = ctx.target.pose.bones.get(bone_name)
+
+	if dest_pose == None:
+		return
+
+	dest_pose.driver_remove('location')
+	dest_pose.driver_remove('rotation_euler')
+	dest_pose.matrix_basis = Matrix()
+
+
+def clear_ik_drivers(limb):
+	if limb.target_empty != None:
+		limb.target_empty.driver_remove('location')
+		limb.target_empty.driver_remove('rotation_euler')
+
+	limb.driver_fingerprint = ''
+
+
+def get_driven_bones(ctx):
+	anim = ctx.target.animation_data
+	bones = set()
+
+	if anim == None:
+		return bones
+
+	for fc in anim.drivers:
+		match = driven_bone_path.match(fc.data_path)
+
+		if match and fc.driver.expression.startswith('retarget_bone_'):
+			bones.add(match.group(1).replace('\\"', '"').replace('\\\\', '\\'))
+
+	return bones
+
+
+def get_mapping_fingerprint(ctx, mapping, matrices):
+	return fingerprint(ctx.target.name, ctx.source.name, mapping.source, mapping.target, matrices.tobytes())
+
+
+def get_driver_stamp(ctx):
+	# bump driver_version whenever the driver expressions change, so files saved
+	# by an older version get their drivers rebuilt
+	return fingerprint(
+		driver_version,
+		ctx.setting_engine,
+		[get_mapping_fingerprint(ctx, mapping, matrices) for mapping, matrices in zip(ctx.mappings, ctx.get_mapping_matrices())],
+		[(limb.enabled, limb.target_bone, limb.origin_bone) for limb in ctx.ik_limbs]
+	)
+
+
+def restore_drivers(ctx):
+	# returns False when the drivers stored in the file are outdated and need a rebuild
+	if ctx.source == None or ctx.target == None or ctx.setting_disable_drivers:
+		return True
+
+	if ctx.driver_stamp != get_driver_stamp(ctx):
+		return False
+
+	if ctx.setting_engine == 'SOLVER':
+		resume_solver(ctx)
+	elif ctx.setting_engine == 'CONSTRAINTS':
+		resume_native_constraints(ctx)
+
+	return True
+
+
+def defer_restore(ctx):
+	if not restore_drivers(ctx):
+		pending_restores.add(ctx.target.name)
+
+
+def request_restore(armature_name):
+	# driver expressions must not change data, the rebuild waits for the next depsgraph update
+	if armature_name in pending_restores:
+		requested_restores.add(armature_name)
+
+
 def create_vars(loc_driver, rot_driver, t, s_source, mapping_source, space, offset=0):
 	src_vars = []
 
@@ -78,48 +183,115 @@ def create_vars(loc_driver, rot_driver, t, s_source, mapping_source, space, offs
 	return src_vars
 
 
-def build_drivers(ctx):
+def register_driver_namespace():
+	bpy.app.driver_namespace['retarget_cache'] = bone_mat_cache
 	bpy.app.driver_namespace['retarget_bone_rot'] = drive_bone_rot
 	bpy.app.driver_namespace['retarget_bone_loc'] = drive_bone_loc
 	bpy.app.driver_namespace['retarget_ik_rot'] = drive_ik_target_rot
 	bpy.app.driver_namespace['retarget_ik_loc'] = drive_ik_target_loc
 
-	for mapping in ctx.mappings:
-		dest_pose = ctx.target.pose.bones[mapping.target]
-		intermediate_bones = get_intermediate_bones(ctx, mapping)
 
-		dest_pose.rotation_mode = 'XYZ'
+@timed('build_drivers')
+def build_drivers(ctx):
+	bone_mat_cache.clear()
+	register_driver_namespace()
+	pending_restores.discard(ctx.target.name)
+	compile_plan(ctx)
 
-		loc_drivers = dest_pose.driver_add('location')
-		rot_drivers = dest_pose.driver_add('rotation_euler')
+	if ctx.setting_engine == 'SOLVER':
+		for bone_name in get_driven_bones(ctx):
+			clear_bone_drivers(ctx, bone_name)
 
+		for mapping in ctx.mappings:
+			mapping.driver_fingerprint = ''
 
-		for axis, lfc, rfc in zip(('x','y','z'), loc_drivers, rot_drivers):
-			loc_driver = lfc.driver
-			rot_driver = rfc.driver
+		clear_native_constraints(ctx)
+		enable_solver(ctx)
+	else:
+		native_bones = get_native_bones(ctx) if ctx.setting_engine == 'CONSTRAINTS' else set()
 
-			src_vars = create_vars(loc_driver, rot_driver, ('LOC', 'ROT'), ctx.source, mapping.source, 'LOCAL_SPACE')
-
-			loc_driver.expression = "retarget_bone_loc('%s','%s','%s',[%s])" % (
-				ctx.target.name, 
-				mapping.target, 
-				axis, 
-				','.join(src_vars)
-			)
-			rot_driver.expression = "retarget_bone_rot('%s','%s','%s',[%s],[%s])" % (
-				ctx.target.name, 
-				mapping.target, 
-				axis, 
-				','.join(src_vars),
-				','.join(['"%s"' % bone for bone in intermediate_bones])
-			)
+		disable_solver(ctx)
+		build_bone_drivers(ctx, native_bones)
+		build_native_constraints(ctx, native_bones)
 
-	
+	build_ik_drivers(ctx)
+
+	ctx.driver_stamp = get_driver_stamp(ctx)
+
+	info('built drivers')
+
+
+def build_bone_drivers(ctx, native_bones):
+	driven_bones = get_driven_bones(ctx)
+	mapped_bones = set()
+	rebuilt_n = 0
+
+	for mapping, matrices in zip(ctx.mappings, ctx.get_mapping_matrices()):
+		# bones handled by native constraints have their drivers removed below
+		if mapping.target in native_bones:
+			mapping.driver_fingerprint = ''
+			continue
+
+		mapped_bones.add(mapping.target)
+		mapping_fingerprint = get_mapping_fingerprint(ctx, mapping, matrices)
+
+		if mapping.target in driven_bones and mapping.driver_fingerprint == mapping_fingerprint:
+			continue
+
+		clear_bone_drivers(ctx, mapping.target)
+		build_mapping_drivers(ctx, mapping)
+		mapping.driver_fingerprint = mapping_fingerprint
+		rebuilt_n += 1
+
+	for bone_name in driven_bones - mapped_bones:
+		clear_bone_drivers(ctx, bone_name)
+
+	info('rebuilt drivers of %i/%i bones' % (rebuilt_n, len(ctx.mappings)))
+
+
+def build_mapping_drivers(ctx, mapping):
+	dest_pose = ctx.target.pose.bones[mapping.target]
+
+	dest_pose.rotation_mode = 'XYZ'
+
+	loc_drivers = dest_pose.driver_add('location')
+	rot_drivers = dest_pose.driver_add('rotation_euler')
+
+
+	for axis, lfc, rfc in zip(('x','y','z'), loc_drivers, rot_drivers):
+		loc_driver = lfc.driver
+		rot_driver = rfc.driver
+
+		src_vars = create_vars(loc_driver, rot_driver, ('LOC', 'ROT'), ctx.source, mapping.source, 'LOCAL_SPACE')
+
+		loc_driver.expression = "retarget_bone_loc('%s','%s','%s',[%s],frame)" % (
+			ctx.target.name, 
+			mapping.target, 
+			axis, 
+			','.join(src_vars)
+		)
+		rot_driver.expression = "retarget_bone_rot('%s','%s','%s',[%s],frame)" % (
+			ctx.target.name, 
+			mapping.target, 
+			axis, 
+			','.join(src_vars)
+		)
+
+
+def build_ik_drivers(ctx):
 	for i, limb in enumerate(ctx.ik_limbs):
 		if not limb.enabled:
 			continue
 
 		mapping = ctx.get_mapping_for_target(limb.target_bone)
+		limb_fingerprint = fingerprint(driver_version, ctx.target.name, ctx.source.name, i, mapping.source, limb.target_empty.name, limb.control_cube.name)
+		anim = limb.target_empty.animation_data
+
+		if anim != None and len(anim.drivers) > 0 and limb.driver_fingerprint == limb_fingerprint:
+			continue
+
+		clear_ik_drivers(limb)
+		limb.driver_fingerprint = limb_fingerprint
 
 		loc_drivers = limb.target_empty.driver_add('location')
 		rot_drivers = limb.target_empty.driver_add('rotation_euler')
@@ -131,10 +303,8 @@ def build_drivers(ctx):
 			src_vars = create_vars(loc_driver, rot_driver, ('LOC', 'ROT'), ctx.source, mapping.source, 'WORLD_SPACE')
 			ctl_vars = create_vars(loc_driver, rot_driver, ('LOC', 'ROT', 'SCALE'), limb.control_cube, '', 'LOCAL_SPACE', offset=len(src_vars))
 
-			loc_driver.expression = "retarget_ik_loc('%s',%i,'%s',[%s])" % (ctx.target.name, i, axis, ','.join(src_vars + ctl_vars))
-			rot_driver.expression = "retarget_ik_rot('%s',%i,'%s',[%s])" % (ctx.target.name, i, axis, ','.join(src_vars + ctl_vars))
-
-	info('built drivers')
+			loc_driver.expression = "retarget_ik_loc('%s',%i,'%s',[%s],frame)" % (ctx.target.name, i, axis, ','.join(src_vars + ctl_vars))
+			rot_driver.expression = "retarget_ik_rot('%s',%i,'%s',[%s],frame)" % (ctx.target.name, i, axis, ','.join(src_vars + ctl_vars))
 
 
 
@@ -156,7 +326,7 @@ class DriversRebuildOperator(bpy.types.Operator):
 	bl_description = 'Rebuild and apply all bone drivers. This is useful when there was a change that the addon missed'
 
 	def execute(self, context):
-		update_drivers(context.object.retargeting_context)
+		update_drivers(context.object.retargeting_context, force=True)
 		return {'FINISHED'}
 	
 
@@ -176,111 +346,90 @@ class DriversDisableOperator(bpy.types.Operator):
 ### DRIVER EXPRESSIONS 
 
 
-def drive_bone_mat(armature_name, bone_name, src_vars, intermediate_bones):
-	armature = bpy.data.objects[armature_name]
-	ctx = armature.retargeting_context
-	mapping = ctx.get_mapping_for_target(bone_name)
+@timed('drive_bone_mat')
+def drive_bone_mat(armature_name, bone_name, src_vars):
+	ctx = bpy.data.objects[armature_name].retargeting_context
+	bone_plan = get_plan(ctx).bones[bone_name]
 	bone_loc = Vector(src_vars[0:3])
 	bone_rot = Quaternion(src_vars[3:])
 
-	if len(intermediate_bones) > 0:
-		src_bone = ctx.source.pose.bones[mapping.source]
-		head_bone = ctx.source.pose.bones[intermediate_bones[0]]
-		tail_bone = ctx.source.pose.bones[intermediate_bones[-1]]
+	return bone_plan.evaluate(bone_loc, bone_rot)
 
-		if tail_bone.parent:
-			base_bone = tail_bone.parent
-			base_rest = base_bone.bone.matrix_local.to_quaternion()
-			base_pose = base_bone.matrix.to_quaternion()
-		else:
-			base_rest = Quaternion()
-			base_pose = Quaternion()
 
-		head_rest = head_bone.bone.matrix_local.to_quaternion()
-		head_pose = head_bone.matrix.to_quaternion()
+def drive_bone_mat_cached(armature_name, bone_name, src_vars, frame):
+	# all six axis drivers of a bone share one evaluation per frame
+	key = (armature_name, bone_name, tuple(src_vars))
+	mat = bone_mat_cache.get(frame, key)
 
-		based_pose = base_pose.inverted() @ head_pose
-		based_rest = base_rest.inverted() @ head_rest
+	if mat is None:
+		request_restore(armature_name)
+		mat = bone_mat_cache.put(frame, key, drive_bone_mat(armature_name, bone_name, src_vars))
 
-		based_delta = based_rest.inverted() @ based_pose
-		mapped_delta = src_bone.bone.matrix.to_quaternion().inverted() @ based_delta @ src_bone.bone.matrix.to_quaternion()
+	return mat
 
-		bone_rot @= mapped_delta
 
-	rest_mat = list_to_matrix(mapping.rest)
-	offset_mat = list_to_matrix(mapping.offset)
+def drive_bone_rot(armature_name, bone_name, axis, src_vars, frame=None):
+	mat = drive_bone_mat_cached(armature_name, bone_name, src_vars, frame)
+	return extract_rot_axis_from_mat(mat, axis)
 
-	src_data = ctx.source.data.bones[mapping.source]
-	src_ref_mat = rot_mat(ctx.source.matrix_world) @ rot_mat(src_data.matrix_local)
-	dest_ref_mat = rot_mat(ctx.target.matrix_world) @ rot_mat(rest_mat)
-	diff_mat = src_ref_mat.inverted() @ dest_ref_mat
 
-	scale = ctx.source.matrix_world.to_scale()
-	scale_mat = Matrix.Identity(4)
-	scale_mat[0][0] = scale.x
-	scale_mat[1][1] = scale.y
-	scale_mat[2][2] = scale.z
+def drive_bone_loc(armature_name, bone_name, axis, src_vars, frame=None):
+	mat = drive_bone_mat_cached(armature_name, bone_name, src_vars, frame)
+	return extract_loc_axis_from_mat(mat, axis)
 
-	mat = Matrix.Translation(bone_loc) @ bone_rot.to_matrix().to_4x4()
-	mat = scale_mat @ mat
-	mat = diff_mat.inverted() @ mat @ diff_mat
-	mat = offset_mat @ mat
-	mat = mat
+
+@timed('drive_ik_target_mat')
+def drive_ik_target_mat(armature_name, index, src_vars):
+	ctx = bpy.data.objects[armature_name].retargeting_context
+	return get_plan(ctx).ik_limbs[index].evaluate(src_vars)
+
+
+def drive_ik_target_mat_cached(armature_name, index, src_vars, frame):
+	# all six channels of a limb's target share one solve per frame
+	key = ('ik', armature_name, index, tuple(src_vars))
+	mat = bone_mat_cache.get(frame, key)
+
+	if mat is None:
+		request_restore(armature_name)
+		mat = bone_mat_cache.put(frame, key, drive_ik_target_mat(armature_name, index, src_vars))
 
 	return mat
 
 
-def drive_bone_rot(armature_name, bone_name, axis, src_vars, intermediate_bones):
-	mat = drive_bone_mat(armature_name, bone_name, src_vars, intermediate_bones)
+def drive_ik_target_rot(armature_name, index, axis, src_vars, frame=None):
+	mat = drive_ik_target_mat_cached(armature_name, index, src_vars, frame)
 	return extract_rot_axis_from_mat(mat, axis)
 
 
-def drive_bone_loc(armature_name, bone_name, axis, src_vars):
-	mat = drive_bone_mat(armature_name, bone_name, src_vars, [])
+def drive_ik_target_loc(armature_name, index, axis, src_vars, frame=None):
+	mat = drive_ik_target_mat_cached(armature_name, index, src_vars, frame)
 	return extract_loc_axis_from_mat(mat, axis)
 
 
-def drive_ik_target_mat(armature_name, index, src_vars):
-	mat = Matrix.Translation(Vector(src_vars[0:3]))
-	quat = Quaternion(src_vars[3:7])
-	mat = mat @ quat.to_matrix().to_4x4()
-
-	src_vars = src_vars[7:]
-
-	ctl_mat = Matrix.Translation(Vector(src_vars[0:3]))
-	ctl_quat = Quaternion(src_vars[3:7])
-	ctl_mat = ctl_mat @ ctl_quat.to_matrix().to_4x4()
-	ctl_scale = Matrix.Scale(src_vars[7], 4, (1, 0, 0))
-	ctl_scale @= Matrix.Scale(src_vars[8], 4, (0, 1, 0))
-	ctl_scale @= Matrix.Scale(src_vars[9], 4, (0, 0, 1))
-	ctl_mat = ctl_mat @ ctl_scale
-
-	obj = bpy.data.objects[armature_name]
-	ctx = obj.retargeting_context
-	limb = ctx.ik_limbs[index]
-	mapping = ctx.get_mapping_for_target(limb.target_bone)
-	src_data = ctx.source.data.bones[mapping.source]
-
-	src_world_mat = loc_mat(ctx.source.matrix_world).inverted() @ ctx.source.matrix_world
-	src_ref_mat = ctx.source.matrix_world @ loc_mat(src_data.matrix_local)
-	src_rot_mat = rot_mat(ctx.source.matrix_world) @ rot_mat(src_data.matrix_local)
-	dest_rest_mat = list_to_matrix(mapping.rest)
-	dest_rot_mat = rot_mat(ctx.target.matrix_world) @ rot_mat(dest_rest_mat)
-	diff_rot_mat = src_rot_mat.inverted() @ dest_rot_mat
-
-	mat = src_world_mat @ src_ref_mat.inverted() @ loc_mat(dest_rest_mat) @ ctl_mat @ mat @ diff_rot_mat
 
-	return mat
+@bpy.app.handlers.persistent
+def handle_depsgraph_update_pre(*_):
+	# edits to the source pose (e.g. intermediate bones) do not change the frame
+	bone_mat_cache.clear()
 
 
-def drive_ik_target_rot(armature_name, index, axis, src_vars):
-	mat = drive_ik_target_mat(armature_name, index, src_vars)
-	return extract_rot_axis_from_mat(mat, axis)
+@bpy.app.handlers.persistent
+def handle_depsgraph_update_post(scene, depsgraph):
+	if len(pending_restores) == 0:
+		return
 
+	# armatures with outdated drivers are only rebuilt once one of their drivers is
+	# evaluated, or once they are selected, as the solver and constraints have none
+	for name in list(pending_restores):
+		obj = bpy.data.objects.get(name)
 
-def drive_ik_target_loc(armature_name, index, axis, src_vars):
-	mat = drive_ik_target_mat(armature_name, index, src_vars)
-	return extract_loc_axis_from_mat(mat, axis)
+		if obj == None or obj.type != 'ARMATURE':
+			pending_restores.discard(name)
+		elif name in requested_restores or obj.select_get():
+			pending_restores.discard(name)
+			update_drivers(obj.retargeting_context)
+
+	requested_restores.clear()
 
 
 
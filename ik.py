@@ -1,7 +1,8 @@
 
 import bpy
 from mathutils import Vector
-from .util import loc_mat, list_to_matrix, matrix_to_list
+from .util import loc_mat, list_to_matrix, matrix_to_list, fingerprint
+from .profiling import timed
 from .log import info
 
 
@@ -40,47 +41,60 @@ def create_ik_limb(ctx, name):
 	return limb
 
 
+@timed('update_ik_controls')
 def update_ik_controls(ctx):
-	clear_ik_controls(ctx)
-	build_ik_controls(ctx)
+	collections = None
 
-
-def clear_ik_controls(ctx):
 	for limb in ctx.ik_limbs:
+		limb_fingerprint = get_limb_control_fingerprint(ctx, limb) if limb.enabled else ''
 
-		if limb.target_bone in ctx.target.pose.bones:
-			target_bone = ctx.target.pose.bones[limb.target_bone]
+		# keep controls whose rig setup did not change, so user edits and drivers on them survive
+		if limb_fingerprint == limb.control_fingerprint and has_limb_controls(limb) == limb.enabled:
+			continue
 
-			for con in target_bone.constraints:
-				if con.name == 'Retarget IK':
-					target_bone.constraints.remove(con)
-					break
+		clear_limb_controls(ctx, limb)
 
-		if limb.target_empty_child != None:
-			bpy.data.objects.remove(limb.target_empty_child, do_unlink=True)
-			limb.target_empty_child = None
+		if limb.enabled:
+			if collections == None:
+				collections = get_control_collections()
 
-		if limb.target_empty != None:
-			bpy.data.objects.remove(limb.target_empty, do_unlink=True)
-			limb.target_empty = None
+			build_limb_controls(ctx, limb, *collections)
 
-		#if limb.pole_empty != None:
-		#	bpy.data.objects.remove(limb.pole_empty, do_unlink=True)
-		#	limb.pole_empty = None
+		limb.control_fingerprint = limb_fingerprint
 
-		if limb.control_cube != None:
-			limb.control_transform = matrix_to_list(limb.control_cube.matrix_local)
-			bpy.data.objects.remove(limb.control_cube, do_unlink=True)
-			limb.control_cube = None
 
-		if limb.control_holder != None:
-			bpy.data.objects.remove(limb.control_holder, do_unlink=True)
-			limb.control_holder = None
+def clear_ik_controls(ctx):
+	for limb in ctx.ik_limbs:
+		clear_limb_controls(ctx, limb)
 
 	info('cleared IK controls')
 
 
-def build_ik_controls(ctx):
+def has_limb_controls(limb):
+	return (
+		limb.target_empty != None
+		and limb.target_empty_child != None
+		and limb.control_holder != None
+		and limb.control_cube != None
+	)
+
+
+def get_limb_control_fingerprint(ctx, limb):
+	target_data_bone = ctx.target.data.bones.get(limb.target_bone)
+
+	if target_data_bone == None:
+		return ''
+
+	return fingerprint(
+		ctx.target.name,
+		limb.target_bone,
+		limb.origin_bone,
+		tuple(matrix_to_list(target_data_bone.matrix_local)),
+		target_data_bone.length
+	)
+
+
+def get_control_collections():
 	aux_collection = next((c for c in bpy.data.collections if c.name == 'Retargeting Auxiliary'), None)
 	ctl_collection = next((c for c in bpy.data.collections if c.name == 'Retargeting Control'), None)
 
@@ -93,83 +107,115 @@ def build_ik_controls(ctx):
 		ctl_collection = bpy.data.collections.new('Retargeting Control')
 		bpy.context.scene.collection.children.link(ctl_collection)
 
-	h = ctx.target.dimensions.z
+	return aux_collection, ctl_collection
 
-	for limb in ctx.ik_limbs:
-		if not limb.enabled:
-			continue
 
-		target_data_bone = ctx.target.data.bones[limb.target_bone]
+def clear_limb_controls(ctx, limb):
+	if limb.target_bone in ctx.target.pose.bones:
 		target_bone = ctx.target.pose.bones[limb.target_bone]
 
-		te = bpy.data.objects.new(limb.target_bone + '-target', None)
-		tec = bpy.data.objects.new(limb.target_bone + '-target-child', None)
-		te.empty_display_size = h * 0.1
-		te.empty_display_type = 'PLAIN_AXES'
-		tec.empty_display_size = 0
-		tec.empty_display_type = 'PLAIN_AXES'
-		aux_collection.objects.link(te)
-		aux_collection.objects.link(tec)
-		te.parent = ctx.target
-		tec.parent = te
-
-		head = Vector(target_data_bone.head_local)
-		tail = Vector(target_data_bone.tail_local)
-		offset = head - tail
-
-		tec.location.x = 0
-		tec.location.y = target_data_bone.length
-		tec.location.z = 0
-
-		#pe = bpy.data.objects.new(limb.target_bone + '-pole', None)
-		#pe.empty_display_size = h * 0.1
-		#pe.empty_display_type = 'PLAIN_AXES'
-		#aux_collection.objects.link(pe)
-		#pe.parent = s.target
-
-		ch = bpy.data.objects.new(limb.target_bone + '-transform-holder', None)
-		ch.empty_display_size = 0
-		ctl_collection.objects.link(ch)
-		ch.parent = ctx.target
-		ch.matrix_local = loc_mat(target_data_bone.matrix_local)
-
-		cc = bpy.data.objects.new(limb.target_bone + '-transform', None)
-		cc.empty_display_size = h * 0.1
-		cc.empty_display_type = 'CUBE'
-		ctl_collection.objects.link(cc)
-		cc.parent = ch
-		cc.matrix_local = list_to_matrix(limb.control_transform)
-		#ce.location.x, ce.location.y, ce.location.z = target_data_bone.matrix_local.translation
-
-		con = target_bone.constraints.new('IK')
-		con.name = 'Retarget IK'
-		con.target = tec
-		#con.pole_target = pe
-		con.use_rotation = True
-
-		tb = target_bone.parent
-		tbn = 0
-
-		while tb != None:
-			tbn += 1
-
-			tb.lock_ik_x, tb.lock_ik_y, tb.lock_ik_z = tb.lock_rotation
-
-			if tb.name == limb.origin_bone:
+		for con in target_bone.constraints:
+			if con.name == 'Retarget IK':
+				target_bone.constraints.remove(con)
 				break
 
-			tb = tb.parent
+	if limb.target_empty_child != None:
+		bpy.data.objects.remove(limb.target_empty_child, do_unlink=True)
+		limb.target_empty_child = None
+
+	if limb.target_empty != None:
+		bpy.data.objects.remove(limb.target_empty, do_unlink=True)
+		limb.target_empty = None
 
-		con.chain_count = tbn + 1
+	#if limb.pole_empty != None:
+	#	bpy.data.objects.remove(limb.pole_empty, do_unlink=True)
+	#	limb.pole_empty = None
 
-		limb.target_empty = te
-		limb.target_empty_child = tec
-		#limb.pole_empty = pe
-		limb.control_holder = ch
-		limb.control_cube = cc
+	if limb.control_cube != None:
+		limb.control_transform = matrix_to_list(limb.control_cube.matrix_local)
+		bpy.data.objects.remove(limb.control_cube, do_unlink=True)
+		limb.control_cube = None
 
-	info('built IK controls')
+	if limb.control_holder != None:
+		bpy.data.objects.remove(limb.control_holder, do_unlink=True)
+		limb.control_holder = None
+
+	limb.control_fingerprint = ''
+	limb.driver_fingerprint = ''
+
+
+@timed('build_limb_controls')
+def build_limb_controls(ctx, limb, aux_collection, ctl_collection):
+	h = ctx.target.dimensions.z
 
+	target_data_bone = ctx.target.data.bones[limb.target_bone]
+	target_bone = ctx.target.pose.bones[limb.target_bone]
+
+	te = bpy.data.objects.new(limb.target_bone + '-target', None)
+	tec = bpy.data.objects.new(limb.target_bone + '-target-child', None)
+	te.empty_display_size = h * 0.1
+	te.empty_display_type = 'PLAIN_AXES'
+	tec.empty_display_size = 0
+	tec.empty_display_type = 'PLAIN_AXES'
+	aux_collection.objects.link(te)
+	aux_collection.objects.link(tec)
+	te.parent = ctx.target
+	tec.parent = te
+
+	head = Vector(target_data_bone.head_local)
+	tail = Vector(target_data_bone.tail_local)
+	offset = head - tail
+
+	tec.location.x = 0
+	tec.location.y = target_data_bone.length
+	tec.location.z = 0
+
+	#pe = bpy.data.objects.new(limb.target_bone + '-pole', None)
+	#pe.empty_display_size = h * 0.1
+	#pe.empty_display_type = 'PLAIN_AXES'
+	#aux_collection.objects.link(pe)
+	#pe.parent = s.target
+
+	ch = bpy.data.objects.new(limb.target_bone + '-transform-holder', None)
+	ch.empty_display_size = 0
+	ctl_collection.objects.link(ch)
+	ch.parent = ctx.target
+	ch.matrix_local = loc_mat(target_data_bone.matrix_local)
+
+	cc = bpy.data.objects.new(limb.target_bone + '-transform', None)
+	cc.empty_display_size = h * 0.1
+	cc.empty_display_type = 'CUBE'
+	ctl_collection.objects.link(cc)
+	cc.parent = ch
+	cc.matrix_local = list_to_matrix(limb.control_transform)
+	#ce.location.x, ce.location.y, ce.location.z = target_data_bone.matrix_local.translation
+
+	con = target_bone.constraints.new('IK')
+	con.name = 'Retarget IK'
+	con.target = tec
+	#con.pole_target = pe
+	con.use_rotation = True
+
+	tb = target_bone.parent
+	tbn = 0
+
+	while tb != None:
+		tbn += 1
+
+		tb.lock_ik_x, tb.lock_ik_y, tb.lock_ik_z = tb.lock_rotation
+
+		if tb.name == limb.origin_bone:
+			break
+
+		tb = tb.parent
+
+	con.chain_count = tbn + 1
+
+	limb.target_empty = te
+	limb.target_empty_child = tec
+	#limb.pole_empty = pe
+	limb.control_holder = ch
+	limb.control_cube = cc
 
 
 classes = []
\ No newline at end of file
@@ -0,0 +1,190 @@
+import numpy as np
+
+
+# Vectorized retarget math. Quaternions are (w, x, y, z) like mathutils, matrices
+# are row-major like mathutils.Matrix, so stacks built from list_to_matrix values
+# or Matrix rows can be passed in directly. Nothing in here depends on bpy.
+
+
+def quat_mul(a, b):
+	aw, ax, ay, az = np.moveaxis(a, -1, 0)
+	bw, bx, by, bz = np.moveaxis(b, -1, 0)
+
+	return np.stack((
+		aw * bw - ax * bx - ay * by - az * bz,
+		aw * bx + ax * bw + ay * bz - az * by,
+		aw * by - ax * bz + ay * bw + az * bx,
+		aw * bz + ax * by - ay * bx + az * bw
+	), axis=-1)
+
+
+def quat_conj(q):
+	return q * np.array((1.0, -1.0, -1.0, -1.0))
+
+
+def quat_normalize(q):
+	return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def quat_to_mat3(q):
+	w, x, y, z = np.moveaxis(quat_normalize(q), -1, 0)
+	mat = np.empty(q.shape[:-1] + (3, 3))
+
+	mat[..., 0, 0] = 1 - 2 * (y * y + z * z)
+	mat[..., 0, 1] = 2 * (x * y - w * z)
+	mat[..., 0, 2] = 2 * (x * z + w * y)
+	mat[..., 1, 0] = 2 * (x * y + w * z)
+	mat[..., 1, 1] = 1 - 2 * (x * x + z * z)
+	mat[..., 1, 2] = 2 * (y * z - w * x)
+	mat[..., 2, 0] = 2 * (x * z - w * y)
+	mat[..., 2, 1] = 2 * (y * z + w * x)
+	mat[..., 2, 2] = 1 - 2 * (x * x + y * y)
+
+	return mat
+
+
+def mat3_to_quat(mat):
+	m = mat[..., :3, :3] / np.linalg.norm(mat[..., :3, :3], axis=-2, keepdims=True)
+	m00, m01, m02 = m[..., 0, 0], m[..., 0, 1], m[..., 0, 2]
+	m10, m11, m12 = m[..., 1, 0], m[..., 1, 1], m[..., 1, 2]
+	m20, m21, m22 = m[..., 2, 0], m[..., 2, 1], m[..., 2, 2]
+
+	# one candidate per dominant component, pick the numerically stable one
+	s = np.sqrt(np.maximum(np.stack((
+		1 + m00 + m11 + m22,
+		1 + m00 - m11 - m22,
+		1 - m00 + m11 - m22,
+		1 - m00 - m11 + m22
+	), axis=-1), 1e-12)) * 2
+	sw, sx, sy, sz = np.moveaxis(s, -1, 0)
+
+	candidates = np.stack((
+		np.stack((0.25 * sw, (m21 - m12) / sw, (m02 - m20) / sw, (m10 - m01) / sw), axis=-1),
+		np.stack(((m21 - m12) / sx, 0.25 * sx, (m01 + m10) / sx, (m02 + m20) / sx), axis=-1),
+		np.stack(((m02 - m20) / sy, (m01 + m10) / sy, 0.25 * sy, (m12 + m21) / sy), axis=-1),
+		np.stack(((m10 - m01) / sz, (m02 + m20) / sz, (m12 + m21) / sz, 0.25 * sz), axis=-1)
+	), axis=-2)
+	choice = np.argmax(s, axis=-1)[..., None, None]
+	q = np.take_along_axis(candidates, choice, axis=-2)[..., 0, :]
+
+	return quat_normalize(np.where(q[..., :1] < 0, -q, q))
+
+
+def euler_to_quat(eulers, order='XYZ'):
+	eulers = np.asarray(eulers, dtype=np.float64)
+	half = eulers * 0.5
+	axes = {'X': (1.0, 0.0, 0.0), 'Y': (0.0, 1.0, 0.0), 'Z': (0.0, 0.0, 1.0)}
+	q = np.zeros(eulers.shape[:-1] + (4,))
+	q[..., 0] = 1.0
+
+	# the first axis in the order is applied first, so it ends up rightmost
+	for axis in order:
+		i = 'XYZ'.index(axis)
+		axis_q = np.zeros(eulers.shape[:-1] + (4,))
+		axis_q[..., 0] = np.cos(half[..., i])
+		axis_q[..., 1:] = np.array(axes[axis]) * np.sin(half[..., i])[..., None]
+		q = quat_mul(axis_q, q)
+
+	return q
+
+
+def axis_angle_to_quat(axis_angles):
+	axis_angles = np.asarray(axis_angles, dtype=np.float64)
+	axis = axis_angles[..., 1:]
+	norm = np.linalg.norm(axis, axis=-1, keepdims=True)
+	axis = np.where(norm > 0, axis / np.where(norm > 0, norm, 1.0), (0.0, 1.0, 0.0))
+	half = axis_angles[..., :1] * 0.5
+
+	return np.concatenate((np.cos(half), axis * np.sin(half)), axis=-1)
+
+
+def mat_to_euler_xyz_pair(mat):
+	m = mat[..., :3, :3] / np.linalg.norm(mat[..., :3, :3], axis=-2, keepdims=True)
+	cy = np.hypot(m[..., 0, 0], m[..., 1, 0])
+	singular = cy < 1e-6
+
+	eul1 = np.stack((
+		np.where(singular, np.arctan2(-m[..., 1, 2], m[..., 1, 1]), np.arctan2(m[..., 2, 1], m[..., 2, 2])),
+		np.arctan2(-m[..., 2, 0], cy),
+		np.where(singular, 0.0, np.arctan2(m[..., 1, 0], m[..., 0, 0]))
+	), axis=-1)
+	eul2 = np.stack((
+		np.arctan2(-m[..., 2, 1], -m[..., 2, 2]),
+		np.arctan2(-m[..., 2, 0], -cy),
+		np.arctan2(-m[..., 1, 0], -m[..., 0, 0])
+	), axis=-1)
+	eul2 = np.where(singular[..., None], eul1, eul2)
+
+	return eul1, eul2
+
+
+def mat_to_euler_xyz(mat):
+	# same two-solution pick as mathutils Matrix.to_euler('XYZ')
+	eul1, eul2 = mat_to_euler_xyz_pair(mat)
+	use_eul2 = np.abs(eul1).sum(axis=-1) > np.abs(eul2).sum(axis=-1)
+
+	return np.where(use_eul2[..., None], eul2, eul1)
+
+
+def euler_make_compatible(eul, prev):
+	# port of Blender's compatible_eul()
+	pi_x2 = 2.0 * np.pi
+	deul = eul - prev
+	eul = np.where(deul > 5.1, eul - np.floor(deul / pi_x2 + 0.5) * pi_x2, eul)
+	eul = np.where(deul < -5.1, eul + np.floor(-deul / pi_x2 + 0.5) * pi_x2, eul)
+	deul = np.abs(eul - prev)
+
+	for i, (j, k) in enumerate(((1, 2), (0, 2), (0, 1))):
+		flip = (deul[..., i] > 3.2) & (deul[..., j] < 1.6) & (deul[..., k] < 1.6)
+		eul[..., i] = np.where(flip, np.where(eul[..., i] > prev[..., i], eul[..., i] - pi_x2, eul[..., i] + pi_x2), eul[..., i])
+
+	return eul
+
+
+def mat_to_compatible_euler_xyz(mats, prev=None):
+	# mats is (frames, ...), each frame is made compatible with the one before,
+	# like Matrix.to_euler('XYZ', euler_prev) when baking frame by frame
+	eul1, eul2 = mat_to_euler_xyz_pair(mats)
+	eulers = np.empty(eul1.shape)
+
+	for f in range(len(mats)):
+		if prev is None:
+			eulers[f] = np.where((np.abs(eul1[f]).sum(axis=-1) > np.abs(eul2[f]).sum(axis=-1))[..., None], eul2[f], eul1[f])
+		else:
+			c1 = euler_make_compatible(eul1[f].copy(), prev)
+			c2 = euler_make_compatible(eul2[f].copy(), prev)
+			d1 = np.abs(c1 - prev).sum(axis=-1)
+			d2 = np.abs(c2 - prev).sum(axis=-1)
+			eulers[f] = np.where((d1 > d2)[..., None], c2, c1)
+
+		prev = eulers[f]
+
+	return eulers
+
+
+def chain_deltas(base_pose, head_pose, based_rest_inv, src_rest):
+	# mirrors BonePlan.evaluate: delta of the unmapped chain between the mapped
+	# bone and its nearest mapped ancestor, expressed in the source bone's rest frame
+	based_pose = quat_mul(quat_conj(base_pose), head_pose)
+	based_delta = quat_mul(based_rest_inv, based_pose)
+
+	return quat_mul(quat_mul(quat_conj(src_rest), based_delta), src_rest)
+
+
+def retarget_mats(locs, rots, pre_mats, post_mats, deltas=None):
+	locs = np.asarray(locs, dtype=np.float64)
+	rots = np.asarray(rots, dtype=np.float64)
+
+	if deltas is not None:
+		rots = quat_mul(rots, deltas)
+
+	mats = np.zeros(rots.shape[:-1] + (4, 4))
+	mats[..., :3, :3] = quat_to_mat3(rots)
+	mats[..., :3, 3] = locs
+	mats[..., 3, 3] = 1.0
+
+	return pre_mats @ mats @ post_mats
+
+
+def mats_to_loc_rot(mats):
+	return mats[..., :3, 3], mat3_to_quat(mats)
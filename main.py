@@ -5,6 +5,7 @@ from . import alignment
 from . import corrections
 from . import drivers
 from . import baking
+from . import profiling
 
 
 class MainPanel(bpy.types.Panel):
@@ -55,6 +56,13 @@ class MainPanel(bpy.types.Panel):
 						layout.separator()
 						layout.label(text='Baking')
 						baking.draw_panel(ctx, layout.box())
+
+			layout.separator()
+			row = layout.row()
+			row.prop(ctx, 'ui_show_profiling', text='Profiling', icon='TRIA_DOWN' if ctx.ui_show_profiling else 'TRIA_RIGHT', emboss=False)
+
+			if ctx.ui_show_profiling:
+				profiling.draw_panel(ctx, layout.box())
 						
 		else:
 			layout.label(text='Select target armature', icon='ERROR')
@@ -1,5 +1,12 @@
+import re
+import heapq
 import bpy
+import numpy as np
+from collections import Counter
 from difflib import SequenceMatcher
+from .plan import invalidate_plan
+from .util import fingerprint
+from .topology import match_skeletons
 
 
 bone_synonyms = (
@@ -14,6 +21,16 @@ bone_synonyms = (
 	('ball', 'toe'),
 )
 
+side_tokens = {'l', 'r', 'left', 'right'}
+side_word = re.compile(r'left|right', re.IGNORECASE)
+side_letter = re.compile(r'(?<![A-Za-z])[LRlr](?![a-z])|(?<=[a-z])[LR](?![A-Za-z])')
+camel_boundary = re.compile(r'([a-z0-9])([A-Z])')
+name_separator = re.compile(r'[^a-z0-9]+')
+guess_candidates_n = 12
+guess_common_key_n = 64
+compatibility_reports = {}
+compatibility_reports_max = 64
+
 
 def draw_panel(ctx, layout):
 	n = len(ctx.mappings)
@@ -39,6 +56,8 @@ def draw_panel(ctx, layout):
 			layout.label(text='Select all bones that should be guessed', icon='INFO')
 		else:
 			layout.label(text='%i Bones selected for guess' % bones_n, icon='BONE_DATA')
+
+		layout.row().prop(ctx, 'setting_guess_method', expand=True)
 		
 		row = layout.row()
 		row.operator(MappingsGuessCancelOperator.bl_idname, text='Cancel', icon='X')
@@ -72,20 +91,30 @@ def enter_mapping_mode(ctx):
 def guess_mappings(ctx):
 	source_bones = [bone.name for bone in ctx.source.pose.bones]
 	target_bones = [bone.name for bone in ctx.get_guessing_bones()]
-	source_sides = guess_group_by_side(source_bones)
-	target_sides = guess_group_by_side(target_bones)
 
-	mappings = []
+	if ctx.setting_guess_method == 'TOPOLOGY':
+		mappings = match_skeletons(
+			get_skeleton_bones(ctx.source, source_bones),
+			get_skeleton_bones(ctx.target, target_bones)
+		)
+	else:
+		source_sides = guess_group_by_side(source_bones)
+		target_sides = guess_group_by_side(target_bones)
+		mappings = []
+
+		for side in ('l', 'r', 'x'):
+			mappings += guess_map_by_name(source_sides[side], target_sides[side])
 
-	for side in ('l', 'r', 'x'):
-		mappings += guess_map_by_name(source_sides[side], target_sides[side])
+	# tracked here, a lookup that misses rebuilds the context's index
+	mapped_sources = set(mapping.source for mapping in ctx.mappings)
+	mapped_targets = set(mapping.target for mapping in ctx.mappings)
 
 	for sbone, tbone in mappings:
-		if sbone in [m.source for m in ctx.mappings]:
+		if sbone in mapped_sources or tbone in mapped_targets:
 			continue
 
-		if tbone in [m.target for m in ctx.mappings]:
-			continue
+		mapped_sources.add(sbone)
+		mapped_targets.add(tbone)
 
 		mapping = ctx.mappings.add()
 		mapping.source = sbone
@@ -98,30 +127,203 @@ def guess_mappings(ctx):
 
 
 def guess_map_by_name(source_bones, target_bones):
-	mappings_source = []
-	mappings_target = []
-	matches = []
+	mappings = []
+	index = {}
+
+	for si, keys in enumerate(get_name_keys(source_bones)):
+		for key in keys:
+			index.setdefault(key, []).append(si)
+
+	common_n = max(guess_common_key_n, len(source_bones) // 8)
+	source_lower = [bone.lower() for bone in source_bones]
+	alphabet = {c: i for i, c in enumerate(sorted(set(''.join(source_lower))))}
+	source_counts = get_char_counts(source_lower, alphabet)
+	source_lengths = np.array([len(bone) for bone in source_lower])
+	used = np.zeros(len(source_bones), dtype=bool)
+	ranked = []
+	scored = []
+	matchers = {}
+
+	def score(ti, candidates):
+		tbone = target_bones[ti].lower()
+		matches = []
+
+		for si in candidates:
+			sbone_lower, tbone_lower = guess_apply_synonym(source_lower[si], tbone)
+
+			# the matcher caches its analysis of the second sequence, so the target goes there
+			if tbone_lower not in matchers:
+				matchers[tbone_lower] = SequenceMatcher(None, '', tbone_lower)
+
+			matcher = matchers[tbone_lower]
+			matcher.set_seq1(sbone_lower)
+			blocks = matcher.get_matching_blocks()
+
+			if max(block.size for block in blocks) <= 1:
+				continue
 
-	for tbone in target_bones:
-		for sbone in source_bones:
-			sbone_lower, tbone_lower = guess_apply_synonym(sbone.lower(), tbone.lower())
-			matcher = SequenceMatcher(None, sbone_lower, tbone_lower)
+			matches.append((-2.0 * sum(block.size for block in blocks) / (len(sbone_lower) + len(tbone_lower)), ti, si))
 
-			if matcher.find_longest_match().size <= 1:
-				continue
+		scored[ti].update(candidates)
+		return matches
+
+	def get_best(ti, position):
+		# the best remaining pair of a target, once no source left unscored could beat
+		# or tie it, judged by the matcher's ratio bound on shared characters
+		matches = ranked[ti]
+
+		while position < len(matches) and used[matches[position][2]]:
+			position += 1
+
+		best = -matches[position][0] if position < len(matches) else 0.0
+		pending = []
+
+		if len(scored[ti]) < len(source_bones):
+			bounds = get_ratio_bounds(target_bones[ti].lower(), source_counts, source_lengths, alphabet)
+			bounds[used] = -1.0
+			bounds[list(scored[ti])] = -1.0
+			pending = np.flatnonzero(bounds >= best - 1e-9)
+
+		if len(pending) > 0:
+			# highest bounds first, a good match found early settles the rest
+			matches = matches[position:]
+			position = 0
+
+			for si in pending[np.argsort(-bounds[pending], kind='stable')].tolist():
+				if bounds[si] < best - 1e-9:
+					break
+
+				for match in score(ti, [si]):
+					matches.append(match)
+					best = max(best, -match[0])
+
+			matches.sort()
+			ranked[ti] = matches
+
+		return (matches[position], position) if position < len(matches) else None
+
+	# only score the sources that share the most name fragments with a target,
+	# instead of running the matcher on every pair
+	for ti, keys in enumerate(get_name_keys(target_bones)):
+		candidates = Counter()
+		postings = [index[key] for key in keys if key in index]
+
+		# fragments most sources share (e.g. "bone" in "bone.001") only add cost,
+		# they are used when there is nothing more specific
+		specific = [p for p in postings if len(p) <= common_n]
+
+		for p in specific or postings:
+			candidates.update(p)
+
+		if len(source_bones) <= guess_candidates_n:
+			shortlist = range(len(source_bones))
+		else:
+			shortlist = heapq.nsmallest(guess_candidates_n, candidates, key=lambda si: (-candidates[si], si))
+
+		scored.append(set())
+		ranked.append(sorted(score(ti, shortlist)))
+
+	# greedy assignment in the order of all pairs sorted by score, like scoring every
+	# pair would give, with one heap entry per target holding its best remaining pair
+	heap = [head for head in (get_best(ti, 0) for ti in range(len(target_bones))) if head != None]
+	heapq.heapify(heap)
+
+	while len(heap) > 0:
+		(neg_ratio, ti, si), position = heapq.heappop(heap)
+
+		if used[si]:
+			head = get_best(ti, position + 1)
+
+			if head != None:
+				heapq.heappush(heap, head)
+
+			continue
+
+		used[si] = True
+		mappings.append((source_bones[si], target_bones[ti]))
+
+	return mappings
+
+
+def get_char_counts(names, alphabet):
+	counts = np.zeros((len(names), len(alphabet)), dtype=np.int32)
+
+	for i, name in enumerate(names):
+		for c in name:
+			if c in alphabet:
+				counts[i, alphabet[c]] += 1
+
+	return counts
+
+
+def get_ratio_bounds(target_bone, source_counts, source_lengths, alphabet):
+	# SequenceMatcher.quick_ratio of the target against every source, an upper bound
+	# of ratio. Synonyms may rewrite the target, so the bound covers every rewrite
+	variants = {target_bone}
+
+	for synonyms in bone_synonyms:
+		for key in synonyms:
+			for o in synonyms:
+				if o != key and o in target_bone:
+					variants.add(target_bone.replace(o, key))
+
+	bounds = np.zeros(len(source_lengths))
 
-			matches.append((sbone, tbone, matcher.ratio()))
+	for variant in variants:
+		shared = np.minimum(source_counts, get_char_counts([variant], alphabet)).sum(axis=1)
+		np.maximum(bounds, 2.0 * shared / np.maximum(source_lengths + len(variant), 1), out=bounds)
 
-	matches = sorted(matches, key=lambda m: m[2], reverse=True)
+	return bounds
 
-	for sbone, tbone, _ in matches:
-		if sbone in mappings_source or tbone in mappings_target:
+
+def get_skeleton_bones(obj, names):
+	names = set(names)
+	bones = []
+
+	for bone in obj.data.bones:
+		if bone.name not in names:
 			continue
 
-		mappings_source.append(sbone)
-		mappings_target.append(tbone)
+		# unselected bones are skipped over, so the guess works on partial selections
+		parent = bone.parent
+
+		while parent != None and parent.name not in names:
+			parent = parent.parent
+
+		bones.append((
+			bone.name,
+			parent.name if parent else None,
+			tuple(obj.matrix_world @ bone.head_local),
+			tuple(obj.matrix_world @ bone.tail_local),
+			''.join(token for token in get_name_tokens(bone.name) if token not in side_tokens)
+		))
+
+	return bones
+
+
+def get_name_tokens(bone):
+	return [token for token in name_separator.split(camel_boundary.sub(r'\1 \2', bone).lower()) if token]
+
 
-	return list(zip(mappings_source, mappings_target))
+def get_name_keys(bones):
+	tokens = [get_name_tokens(bone) for bone in bones]
+	prefixes = Counter(name_tokens[0] for name_tokens in tokens if len(name_tokens) > 1)
+	keys = []
+
+	for name_tokens in tokens:
+		# rig prefixes like "mixamorig" or "Bip01" say nothing about the bone
+		if len(name_tokens) > 1 and prefixes[name_tokens[0]] > len(bones) / 2:
+			name_tokens = name_tokens[1:]
+
+		name_tokens = [token for token in name_tokens if token not in side_tokens]
+		name = ''.join(name_tokens)
+
+		# bigrams, mirroring the matcher's requirement of a match longer than one character
+		name_keys = set(token[i:i+2] for token in name_tokens for i in range(len(token) - 1))
+		name_keys.update(i for i, synonyms in enumerate(bone_synonyms) if any(s in name for s in synonyms))
+		keys.append(name_keys)
+
+	return keys
 
 
 def guess_apply_synonym(source_bone, target_bone):
@@ -146,45 +348,48 @@ def guess_group_by_side(bones):
 		'x': []
 	}
 
-	for bone in bones:
-		if bone in groups['l'] or bone in groups['r']:
-			continue
+	side_keys = [get_side_keys(bone) for bone in bones]
+	lefts = {}
+	paired = set()
 
-		found_match = False
+	for bone, keys in zip(bones, side_keys):
+		for side, key in keys:
+			if side == 'l':
+				lefts.setdefault(key, bone)
 
-		if 'right' in bone.lower():
-			for partner in bones:
-				if partner == bone:
-					continue
+	for bone, keys in zip(bones, side_keys):
+		for side, key in keys:
+			partner = lefts.get(key) if side == 'r' else None
 
-				if bone.lower() == partner.lower().replace('left', 'right'):
-					groups['r'].append(bone)
-					groups['l'].append(partner)
-					found_match = True
-					break
-		else:
-			potential_partners = [b for b in bones if b != bone and len(b) == len(bone)]
-			
-			for i, char in enumerate(bone):
-				if char.lower() != 'r':
-					continue
-
-				for partner in potential_partners:
-					if bone == partner[0:i] + char + partner[i+1:]:
-						groups['r'].append(bone)
-						groups['l'].append(partner)
-						found_match = True
-						break
-
-				if found_match:
-					break
+			if partner == None or partner == bone or partner in paired or bone in paired:
+				continue
+
+			groups['r'].append(bone)
+			groups['l'].append(partner)
+			paired.add(bone)
+			paired.add(partner)
+			break
 
-		if not found_match:
+	for bone in bones:
+		if bone not in paired:
 			groups['x'].append(bone)
 
 	return groups
 
 
+def get_side_keys(bone):
+	# the lower-cased name with its side token masked, so both bones of a pair share a
+	# key regardless of how each side is spelled, e.g. "HandL" and "HandR", "left_hand"
+	# and "Right_hand". A side letter stands alone or trails a camel-case name
+	keys = []
+
+	for kind, pattern in (('word', side_word), ('letter', side_letter)):
+		for match in pattern.finditer(bone):
+			keys.append((match.group(0)[0].lower(), (bone[:match.start()].lower(), kind, bone[match.end():].lower())))
+
+	return keys
+
+
 def leave_mapping_mode(ctx):
 	if handle_edit_change in bpy.app.handlers.depsgraph_update_post:
 		bpy.app.handlers.depsgraph_update_post.remove(handle_edit_change)
@@ -193,6 +398,7 @@ def leave_mapping_mode(ctx):
 	ctx.get_source_armature().pose_position = 'POSE'
 	ctx.get_target_armature().pose_position = 'POSE'
 	ctx.source.select_set(False)
+	invalidate_plan(ctx)
 
 	bpy.ops.object.mode_set(mode='OBJECT')
 	
@@ -202,35 +408,74 @@ def handle_edit_change(self, context):
 		leave_mapping_mode(bpy.context.object.retargeting_context)
 
 
-def get_intermediate_bones(ctx, mapping):
-	bone = ctx.source.pose.bones[mapping.source]
-	intermediate_bones = []
+class CompatibilityReport:
+	def __init__(self, mapped_bones, armature_bones):
+		bone_names = set(armature_bones)
+		mapped_names = set(mapped_bones)
+		extra_by_key = {}
+
+		self.missing = [bone for bone in mapped_bones if bone not in bone_names]
+		self.extra = [bone for bone in armature_bones if bone not in mapped_names]
+
+		for bone in self.extra:
+			extra_by_key.setdefault(get_rename_key(bone), bone)
+
+		self.renamed = {
+			bone: extra_by_key[get_rename_key(bone)]
+			for bone in self.missing
+			if get_rename_key(bone) in extra_by_key
+		}
 
-	while bone.parent and not any(m.source == bone.parent.name for m in ctx.mappings):
-		intermediate_bones.append(bone.parent.name)
-		bone = bone.parent
 
-	return intermediate_bones
+def get_rename_key(bone):
+	# same bone under another namespace or casing, e.g. "mixamorig:Hips" and "mixamorig1:hips"
+	return re.split(r'[:|]', bone)[-1].lower()
 
 
-def count_incompatible_mappings(ctx, target):
-	count = 0
+def get_compatibility_report(ctx, armature_obj):
+	armature = armature_obj.data
 
-	for mapping in ctx.mappings:
-		if all(bone.name != mapping.source for bone in target.data.bones):
-			count += 1
+	# the lookup index is rebuilt whenever the mappings change, so reports kept on it
+	# only need a cheap key for the armature. Names are read on a miss only
+	reports = ctx.get_lookup_index().setdefault('compatibility_reports', {})
+	armature_key = (armature.name, armature.as_pointer(), len(armature.bones))
+	report = reports.get(armature_key)
 
-	return count
+	if report != None:
+		return report
 
+	mapped_bones = [mapping.source for mapping in ctx.mappings]
+	armature_bones = [bone.name for bone in armature.bones]
+
+	# batches swap between sources of the same skeleton type, which only need checking once
+	key = (fingerprint(*mapped_bones), fingerprint(*armature_bones))
+	report = compatibility_reports.get(key)
+
+	if report == None:
+		if len(compatibility_reports) >= compatibility_reports_max:
+			compatibility_reports.clear()
+
+		report = CompatibilityReport(mapped_bones, armature_bones)
+		compatibility_reports[key] = report
+
+	reports[armature_key] = report
+
+	return report
+
+
+def warn_incompatible_source_armature(report):
+	def draw(self, _):
+		self.layout.label(text='Corresponding bones for %i mapping(s) not found.' % len(report.missing))
+
+		if len(report.renamed) > 0:
+			self.layout.label(text='%i of them appear to be renamed.' % len(report.renamed))
+
+		self.layout.operator('retarget.use_invalid_source_anyway')
 
-def warn_incompatible_source_armature(incompat_n):
 	bpy.context.window_manager.popup_menu(
 		title='Incompatible armature', 
 		icon='ERROR',
-		draw_func=lambda self, _: (
-			self.layout.label(text='Corresponding bones for %i mapping(s) not found.' % incompat_n) +
-			self.layout.operator('retarget.use_invalid_source_anyway')
-		)
+		draw_func=draw
 	)
 
 
@@ -0,0 +1,176 @@
+import bpy
+from .plan import get_plan
+from .log import info
+
+
+# Retargeting without Python during playback. For every mapped bone a chain of
+# three helper empties reproduces the plan's pre @ source @ post product:
+#
+#   offset  (unparented, matrix = pre_mat)
+#   source  (child, copies the source bone's local loc/rot)
+#   result  (child, matrix = post_mat)
+#
+# The target bone then copies the result's world loc/rot into its local space,
+# which is what the bone drivers write into location and rotation_euler.
+# Bones with unmapped bones in between still need the chain delta, which only
+# the Python drivers can compute.
+
+
+native_targets = set()
+native_constraint_names = ('Retarget Location', 'Retarget Rotation')
+
+
+def get_native_bones(ctx):
+	return set(name for name, bone_plan in get_plan(ctx).bones.items() if not bone_plan.has_chain)
+
+
+def build_native_constraints(ctx, bone_names):
+	plan = get_plan(ctx) if len(bone_names) > 0 else None
+	collection = None
+
+	for pose_bone in ctx.target.pose.bones:
+		if pose_bone.name not in bone_names:
+			clear_bone_constraints(pose_bone)
+
+	for bone_name in bone_names:
+		pose_bone = ctx.target.pose.bones[bone_name]
+		con = pose_bone.constraints.get(native_constraint_names[0])
+
+		if con == None or get_helpers(con.target) == None:
+			if collection == None:
+				collection = get_helper_collection()
+
+			clear_bone_constraints(pose_bone)
+			create_bone_constraints(ctx, pose_bone, collection)
+
+		update_bone_helpers(ctx, pose_bone, plan.bones[bone_name])
+
+	if len(bone_names) > 0:
+		native_targets.add(ctx.target.name)
+		info('built native constraints for %i bones' % len(bone_names))
+	else:
+		native_targets.discard(ctx.target.name)
+
+
+def clear_native_constraints(ctx):
+	build_native_constraints(ctx, set())
+
+
+def resume_native_constraints(ctx):
+	native_targets.add(ctx.target.name)
+
+
+def refresh_native_constraints(ctx):
+	# the helper matrices depend on both objects' world transforms
+	plan = get_plan(ctx)
+
+	for bone_name, bone_plan in plan.bones.items():
+		pose_bone = ctx.target.pose.bones.get(bone_name)
+		con = pose_bone.constraints.get(native_constraint_names[0]) if pose_bone else None
+
+		if con != None and get_helpers(con.target) != None:
+			update_bone_helpers(ctx, pose_bone, bone_plan)
+
+
+def get_helper_collection():
+	collection = next((c for c in bpy.data.collections if c.name == 'Retargeting Auxiliary'), None)
+
+	if collection == None:
+		collection = bpy.data.collections.new('Retargeting Auxiliary')
+		bpy.context.scene.collection.children.link(collection)
+
+	return collection
+
+
+def get_helpers(result):
+	if result == None or result.parent == None or result.parent.parent == None:
+		return None
+
+	return result.parent.parent, result.parent, result
+
+
+def create_bone_constraints(ctx, pose_bone, collection):
+	offset = bpy.data.objects.new(pose_bone.name + '-offset', None)
+	source = bpy.data.objects.new(pose_bone.name + '-source', None)
+	result = bpy.data.objects.new(pose_bone.name + '-result', None)
+
+	for helper in (offset, source, result):
+		helper.empty_display_size = 0
+		helper.hide_select = True
+		collection.objects.link(helper)
+
+	source.parent = offset
+	result.parent = source
+
+	for con_type in ('COPY_LOCATION', 'COPY_ROTATION'):
+		con = source.constraints.new(con_type)
+		con.target_space = 'LOCAL'
+		con.owner_space = 'LOCAL'
+
+	for con_name, con_type in zip(native_constraint_names, ('COPY_LOCATION', 'COPY_ROTATION')):
+		con = pose_bone.constraints.new(con_type)
+		con.name = con_name
+		con.target = result
+		con.target_space = 'WORLD'
+		con.owner_space = 'LOCAL'
+
+	# ahead of the IK constraint, which has to see the retargeted pose
+	for i, con_name in enumerate(native_constraint_names):
+		pose_bone.constraints.move(pose_bone.constraints.find(con_name), i)
+
+
+def update_bone_helpers(ctx, pose_bone, bone_plan):
+	offset, source, result = get_helpers(pose_bone.constraints[native_constraint_names[0]].target)
+	offset.matrix_basis = bone_plan.pre_mat
+	result.matrix_basis = bone_plan.post_mat
+
+	for con in source.constraints:
+		con.target = ctx.source
+		con.subtarget = bone_plan.source
+
+
+def clear_bone_constraints(pose_bone):
+	for con_name in native_constraint_names:
+		con = pose_bone.constraints.get(con_name)
+
+		if con == None:
+			continue
+
+		helpers = get_helpers(con.target)
+
+		if helpers != None:
+			for helper in reversed(helpers):
+				bpy.data.objects.remove(helper, do_unlink=True)
+
+		pose_bone.constraints.remove(con)
+
+
+def get_native_contexts():
+	for name in list(native_targets):
+		obj = bpy.data.objects.get(name)
+
+		if obj == None or obj.type != 'ARMATURE' or obj.retargeting_context.setting_engine != 'CONSTRAINTS':
+			native_targets.discard(name)
+			continue
+
+		ctx = obj.retargeting_context
+
+		if ctx.source == None or ctx.setting_disable_drivers:
+			continue
+
+		yield ctx
+
+
+@bpy.app.handlers.persistent
+def handle_depsgraph_update_post(scene, depsgraph):
+	if len(native_targets) == 0:
+		return
+
+	moved = set(
+		update.id.name for update in depsgraph.updates
+		if update.is_updated_transform and isinstance(update.id, bpy.types.Object)
+	)
+
+	for ctx in get_native_contexts():
+		if ctx.source.name in moved or ctx.target.name in moved:
+			refresh_native_constraints(ctx)
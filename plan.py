@@ -0,0 +1,311 @@
+import bpy
+import numpy as np
+from mathutils import Matrix, Vector, Quaternion
+from .util import rot_mat, loc_mat
+from .kernel import chain_deltas, retarget_mats, mat3_to_quat
+from .log import info
+
+
+retarget_plans = {}
+source_topologies = {}
+
+
+
+class SourceTopology:
+	def __init__(self, ctx):
+		bones = ctx.source.data.bones
+		mapped = set(m.source for m in ctx.mappings)
+
+		self.source_name = ctx.source.name
+		self.mapped_sources = frozenset(mapped)
+		self.names = [bone.name for bone in bones]
+		self.indices = {name: i for i, name in enumerate(self.names)}
+		self.parents = [self.indices[bone.parent.name] if bone.parent else -1 for bone in bones]
+		self.mapped_ancestors = [None] * len(self.names)
+		self.chains = {}
+
+		for i in range(len(self.names)):
+			self.resolve_mapped_ancestor(i)
+
+		for name in mapped:
+			if name in self.indices:
+				self.chains[name] = self.get_chain(self.indices[name])
+
+	def resolve_mapped_ancestor(self, i):
+		# iterative, deep hierarchies would exceed the recursion limit
+		path = []
+
+		while i != -1 and self.mapped_ancestors[i] is None:
+			path.append(i)
+			i = self.parents[i]
+
+		if i == -1:
+			ancestor = -1
+		elif self.names[i] in self.mapped_sources:
+			ancestor = i
+		else:
+			ancestor = self.mapped_ancestors[i]
+
+		for j in reversed(path):
+			self.mapped_ancestors[j] = ancestor
+
+			if self.names[j] in self.mapped_sources:
+				ancestor = j
+
+	def get_chain(self, i):
+		chain = []
+		stop = self.mapped_ancestors[i]
+		i = self.parents[i]
+
+		while i != stop:
+			chain.append(self.names[i])
+			i = self.parents[i]
+
+		return chain
+
+	def is_valid_for(self, ctx):
+		return (
+			self.source_name == ctx.source.name
+			and len(self.names) == len(ctx.source.data.bones)
+			and self.mapped_sources == frozenset(m.source for m in ctx.mappings)
+		)
+
+
+class BonePlan:
+	def __init__(self, ctx, mapping, topology, matrices):
+		rest_mat = Matrix(matrices[0].tolist())
+		offset_mat = Matrix(matrices[1].tolist())
+
+		src_data = ctx.source.data.bones[mapping.source]
+		src_ref_mat = rot_mat(ctx.source.matrix_world) @ rot_mat(src_data.matrix_local)
+		dest_ref_mat = rot_mat(ctx.target.matrix_world) @ rot_mat(rest_mat)
+		diff_mat = src_ref_mat.inverted() @ dest_ref_mat
+
+		scale = ctx.source.matrix_world.to_scale()
+		scale_mat = Matrix.Identity(4)
+		scale_mat[0][0] = scale.x
+		scale_mat[1][1] = scale.y
+		scale_mat[2][2] = scale.z
+
+		self.source = mapping.source
+		self.intermediate_bones = topology.chains[mapping.source]
+		self.has_chain = len(self.intermediate_bones) > 0
+		self.src_rest_rot = src_data.matrix.to_quaternion()
+		self.src_rest_rot_inv = self.src_rest_rot.inverted()
+		self.pre_mat = offset_mat @ diff_mat.inverted() @ scale_mat
+		self.post_mat = diff_mat
+		self.source_parent = src_data.parent.name if src_data.parent else None
+
+		# takes the pose matrix relative to the parent's back to the bone's local space
+		if src_data.parent:
+			self.local_rest_inv = (src_data.parent.matrix_local.inverted() @ src_data.matrix_local).inverted()
+		else:
+			self.local_rest_inv = src_data.matrix_local.inverted()
+
+		if self.has_chain:
+			head_data = ctx.source.data.bones[self.intermediate_bones[0]]
+			base_data = ctx.source.data.bones[self.intermediate_bones[-1]].parent
+			base_rest = base_data.matrix_local.to_quaternion() if base_data else Quaternion()
+
+			self.chain_head = head_data.name
+			self.chain_base = base_data.name if base_data else None
+			self.based_rest_inv = (base_rest.inverted() @ head_data.matrix_local.to_quaternion()).inverted()
+
+			# resolved once, so driver evaluations do no name lookups. Plans are dropped on undo,
+			# load and changes to the source's bones, which is when these references go stale
+			self.chain_head_bone = ctx.source.pose.bones[self.chain_head]
+			self.chain_base_bone = ctx.source.pose.bones[self.chain_base] if base_data else None
+		else:
+			self.based_rest_inv = Quaternion()
+
+	def apply(self, mat):
+		return self.pre_mat @ mat @ self.post_mat
+
+	def get_chain_pose(self):
+		return (
+			self.chain_head_bone.matrix.to_quaternion(),
+			self.chain_base_bone.matrix.to_quaternion() if self.chain_base_bone else Quaternion()
+		)
+
+	def evaluate(self, bone_loc, bone_rot):
+		if self.has_chain:
+			head_pose, base_pose = self.get_chain_pose()
+			based_delta = self.based_rest_inv @ base_pose.inverted() @ head_pose
+			bone_rot = bone_rot @ (self.src_rest_rot_inv @ based_delta @ self.src_rest_rot)
+
+		return self.apply(Matrix.Translation(bone_loc) @ bone_rot.to_matrix().to_4x4())
+
+
+
+class IKLimbPlan:
+	def __init__(self, ctx, mapping, matrices):
+		src_data = ctx.source.data.bones[mapping.source]
+		src_world_mat = loc_mat(ctx.source.matrix_world).inverted() @ ctx.source.matrix_world
+		src_ref_mat = ctx.source.matrix_world @ loc_mat(src_data.matrix_local)
+		src_rot_mat = rot_mat(ctx.source.matrix_world) @ rot_mat(src_data.matrix_local)
+		dest_rest_mat = Matrix(matrices[0].tolist())
+		dest_rot_mat = rot_mat(ctx.target.matrix_world) @ rot_mat(dest_rest_mat)
+
+		self.pre_mat = src_world_mat @ src_ref_mat.inverted() @ loc_mat(dest_rest_mat)
+		self.post_mat = src_rot_mat.inverted() @ dest_rot_mat
+
+	def evaluate(self, src_vars):
+		# source bone loc/rot, then the control cube's loc/rot/scale
+		mat = Matrix.LocRotScale(Vector(src_vars[0:3]), Quaternion(src_vars[3:7]), None)
+		ctl_mat = Matrix.LocRotScale(Vector(src_vars[7:10]), Quaternion(src_vars[10:14]), Vector(src_vars[14:17]))
+
+		return self.pre_mat @ ctl_mat @ mat @ self.post_mat
+
+
+
+class RetargetPlan:
+	def __init__(self, ctx):
+		self.source_name = ctx.source.name
+		self.target_name = ctx.target.name
+		topology = get_topology(ctx)
+		matrices = ctx.get_mapping_matrices()
+		self.bones = {
+			mapping.target: BonePlan(ctx, mapping, topology, matrices[i])
+			for i, mapping in enumerate(ctx.mappings)
+			if mapping.is_valid() and mapping.source in ctx.source.data.bones
+		}
+		self.ik_limbs = {}
+		self.stacks = None
+		self.pose_indices = {pose_bone.name: i for i, pose_bone in enumerate(ctx.source.pose.bones)}
+
+		# first mapping wins on duplicate targets, like Context.get_mapping_for_target
+		mapping_indices = {}
+
+		for i, mapping in enumerate(ctx.mappings):
+			mapping_indices.setdefault(mapping.target, i)
+
+		for i, limb in enumerate(ctx.ik_limbs):
+			mi = mapping_indices.get(limb.target_bone)
+
+			if limb.enabled and mi is not None and ctx.mappings[mi].source in ctx.source.data.bones:
+				self.ik_limbs[i] = IKLimbPlan(ctx, ctx.mappings[mi], matrices[mi])
+
+	def get_stacks(self):
+		if self.stacks is None:
+			bone_plans = list(self.bones.values())
+			self.stacks = {
+				'names': list(self.bones.keys()),
+				'pre_mats': np.array([[list(row) for row in bp.pre_mat] for bp in bone_plans]).reshape(-1, 4, 4),
+				'post_mats': np.array([[list(row) for row in bp.post_mat] for bp in bone_plans]).reshape(-1, 4, 4),
+				'src_rest': np.array([list(bp.src_rest_rot) for bp in bone_plans]).reshape(-1, 4),
+				'based_rest_inv': np.array([list(bp.based_rest_inv) for bp in bone_plans]).reshape(-1, 4),
+				'has_chain': np.array([bp.has_chain for bp in bone_plans], dtype=bool),
+				'local_rest_inv': np.array([[list(row) for row in bp.local_rest_inv] for bp in bone_plans]).reshape(-1, 4, 4),
+				# -1 picks the identity appended after the pose matrices
+				'sources': self.get_pose_indices([bp.source for bp in bone_plans]),
+				'parents': self.get_pose_indices([bp.source_parent for bp in bone_plans]),
+				'chain_heads': self.get_pose_indices([bp.chain_head if bp.has_chain else None for bp in bone_plans]),
+				'chain_bases': self.get_pose_indices([bp.chain_base if bp.has_chain else None for bp in bone_plans])
+			}
+
+		return self.stacks
+
+	def get_pose_indices(self, names):
+		return np.array([self.pose_indices[name] if name else -1 for name in names], dtype=np.int64)
+
+	def read_pose(self, pose_bones):
+		# the local space the drivers' transform variables read, so constraints on the
+		# source count: each pose matrix relative to its parent's, without the rest
+		# offset between them. All pose matrices come in one foreach_get
+		stacks = self.get_stacks()
+		pose_mats = np.empty(len(pose_bones) * 16)
+		pose_bones.foreach_get('matrix', pose_mats)
+		pose_mats = np.concatenate((pose_mats.reshape(-1, 4, 4).transpose(0, 2, 1), np.identity(4)[None]))
+
+		local_mats = stacks['local_rest_inv'] @ np.linalg.inv(pose_mats[stacks['parents']]) @ pose_mats[stacks['sources']]
+
+		return (
+			local_mats[:, :3, 3],
+			mat3_to_quat(local_mats),
+			mat3_to_quat(pose_mats[stacks['chain_bases']]),
+			mat3_to_quat(pose_mats[stacks['chain_heads']])
+		)
+
+	def evaluate_batch(self, locs, rots, base_pose, head_pose):
+		stacks = self.get_stacks()
+		deltas = chain_deltas(base_pose, head_pose, stacks['based_rest_inv'], stacks['src_rest'])
+		deltas = np.where(stacks['has_chain'][:, None], deltas, (1.0, 0.0, 0.0, 0.0))
+
+		return retarget_mats(locs, rots, stacks['pre_mats'], stacks['post_mats'], deltas)
+
+
+
+def get_topology(ctx):
+	topology = source_topologies.get(ctx.target.name)
+
+	if topology is None or not topology.is_valid_for(ctx):
+		topology = SourceTopology(ctx)
+		source_topologies[ctx.target.name] = topology
+
+	return topology
+
+
+def get_intermediate_bones(ctx, mapping):
+	return get_topology(ctx).chains.get(mapping.source, [])
+
+
+def compile_plan(ctx):
+	plan = RetargetPlan(ctx)
+	retarget_plans[ctx.target.name] = plan
+	info('compiled retarget plan for %i bones' % len(plan.bones))
+	return plan
+
+
+def get_plan(ctx):
+	plan = retarget_plans.get(ctx.target.name)
+
+	if plan is None or plan.source_name != ctx.source.name:
+		plan = compile_plan(ctx)
+
+	return plan
+
+
+def invalidate_plan(ctx):
+	retarget_plans.pop(ctx.target.name, None)
+
+
+def invalidate_plans_for_object(name):
+	for key, plan in list(retarget_plans.items()):
+		if name == plan.source_name or name == plan.target_name:
+			del retarget_plans[key]
+
+
+def invalidate_topologies_for_armature(armature):
+	for key, topology in list(source_topologies.items()):
+		source = bpy.data.objects.get(topology.source_name)
+
+		if source == None or source.data == armature:
+			del source_topologies[key]
+			retarget_plans.pop(key, None)
+
+
+def invalidate_all():
+	retarget_plans.clear()
+	source_topologies.clear()
+
+
+@bpy.app.handlers.persistent
+def handle_depsgraph_update_post(scene, depsgraph):
+	if len(retarget_plans) == 0 and len(source_topologies) == 0:
+		return
+
+	for update in depsgraph.updates:
+		if update.is_updated_transform and isinstance(update.id, bpy.types.Object):
+			invalidate_plans_for_object(update.id.name)
+		elif update.is_updated_geometry and isinstance(update.id, bpy.types.Armature):
+			invalidate_topologies_for_armature(update.id.original)
+
+
+@bpy.app.handlers.persistent
+def handle_undo_redo(*_):
+	# undo restores the stored properties without running their update callbacks,
+	# so nothing derived from them is trusted afterwards
+	from .context import invalidate_caches
+
+	invalidate_all()
+	invalidate_caches()
@@ -0,0 +1,202 @@
+import bpy
+import json
+import time
+import functools
+from contextlib import contextmanager
+from bpy_extras.io_utils import ExportHelper
+
+
+# Call counts and accumulated time of the hot paths, to tell driver evaluation, IK
+# and baking apart when playback gets slow. Off by default, a disabled timed
+# function costs one extra call and a flag check. Times include nested timed calls.
+
+
+enabled = False
+stats = {}
+
+
+
+class Stat:
+	__slots__ = ('calls', 'seconds', 'max_seconds')
+
+	def __init__(self):
+		self.calls = 0
+		self.seconds = 0.0
+		self.max_seconds = 0.0
+
+
+
+def timed(name):
+	def decorate(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			if not enabled:
+				return func(*args, **kwargs)
+
+			start = time.perf_counter()
+
+			try:
+				return func(*args, **kwargs)
+			finally:
+				record(name, time.perf_counter() - start)
+
+		return wrapper
+
+	return decorate
+
+
+@contextmanager
+def section(name):
+	if not enabled:
+		yield
+		return
+
+	start = time.perf_counter()
+
+	try:
+		yield
+	finally:
+		record(name, time.perf_counter() - start)
+
+
+def record(name, seconds):
+	stat = stats.get(name)
+
+	if stat is None:
+		stat = stats[name] = Stat()
+
+	stat.calls += 1
+	stat.seconds += seconds
+	stat.max_seconds = max(stat.max_seconds, seconds)
+
+
+def dump_stats():
+	# plain values, so worker processes can hand their stats over as JSON
+	return {name: (stat.calls, stat.seconds, stat.max_seconds) for name, stat in stats.items()}
+
+
+def merge_stats(dumped):
+	for name, (calls, seconds, max_seconds) in dumped.items():
+		stat = stats.get(name)
+
+		if stat is None:
+			stat = stats[name] = Stat()
+
+		stat.calls += calls
+		stat.seconds += seconds
+		stat.max_seconds = max(stat.max_seconds, max_seconds)
+
+
+def set_enabled(state):
+	global enabled
+	enabled = state
+
+
+def reset():
+	stats.clear()
+
+
+def get_report():
+	return {
+		name: {
+			'calls': stat.calls,
+			'total_ms': stat.seconds * 1000,
+			'mean_ms': stat.seconds * 1000 / stat.calls,
+			'max_ms': stat.max_seconds * 1000
+		}
+		for name, stat in sorted(stats.items(), key=lambda item: -item[1].seconds)
+	}
+
+
+@bpy.app.handlers.persistent
+def handle_frame_change_post(scene, depsgraph):
+	# the sidebar only redraws on interaction, the numbers would stay frozen during playback
+	if not enabled or bpy.context.window_manager == None:
+		return
+
+	for window in bpy.context.window_manager.windows:
+		for area in window.screen.areas:
+			if area.type != 'VIEW_3D':
+				continue
+
+			for region in area.regions:
+				if region.type == 'UI':
+					region.tag_redraw()
+
+
+def draw_panel(ctx, layout):
+	row = layout.row()
+
+	if enabled:
+		row.operator(ProfilingToggleOperator.bl_idname, text='Disable', icon='PAUSE')
+	else:
+		row.operator(ProfilingToggleOperator.bl_idname, text='Enable', icon='PLAY')
+
+	row.operator(ProfilingResetOperator.bl_idname, text='Reset', icon='X')
+	row.operator(ProfilingExportOperator.bl_idname, text='Export', icon='EXPORT')
+
+	if len(stats) == 0:
+		layout.label(text='Recording, no calls yet' if enabled else 'Profiling is disabled', icon='INFO')
+		return
+
+	col = layout.column(align=True)
+	row = col.row()
+	row.label(text='Function')
+	row.label(text='Calls')
+	row.label(text='Total')
+	row.label(text='Mean')
+
+	for name, entry in get_report().items():
+		row = col.row()
+		row.label(text=name)
+		row.label(text='%i' % entry['calls'])
+		row.label(text='%.1f ms' % entry['total_ms'])
+		row.label(text='%.3f ms' % entry['mean_ms'])
+
+
+
+class ProfilingToggleOperator(bpy.types.Operator):
+	bl_idname = 'profiling.toggle'
+	bl_label = 'Toggle Profiling'
+	bl_description = 'Start or stop counting calls and time spent in drivers, IK and baking'
+
+	def execute(self, context):
+		set_enabled(not enabled)
+		return {'FINISHED'}
+
+
+class ProfilingResetOperator(bpy.types.Operator):
+	bl_idname = 'profiling.reset'
+	bl_label = 'Reset Profiling'
+	bl_description = 'Discard all recorded calls and timings'
+
+	def execute(self, context):
+		reset()
+		return {'FINISHED'}
+
+
+class ProfilingExportOperator(bpy.types.Operator, ExportHelper):
+	bl_idname = 'profiling.export'
+	bl_label = 'Export Profiling'
+	filename_ext = '.json'
+	bl_description = 'Save the recorded calls and timings as JSON'
+
+	filter_glob: bpy.props.StringProperty(
+		default='*.json',
+		options={'HIDDEN'},
+		maxlen=255
+	)
+
+	def execute(self, context):
+		with open(self.filepath, 'w') as f:
+			json.dump(get_report(), f, indent=4)
+
+		return {'FINISHED'}
+
+
+
+classes = (
+	ProfilingToggleOperator,
+	ProfilingResetOperator,
+	ProfilingExportOperator
+)
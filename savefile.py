@@ -1,7 +1,31 @@
 import bpy
 import json
+import struct
+import numpy as np
+from collections.abc import Mapping
 from bpy_extras.io_utils import ExportHelper, ImportHelper
 from .util import matrix_to_list
+from .context import build_lookup_index
+
+
+# Binary configs are a header, a table of (tag, offset, size) sections and the
+# sections themselves:
+#
+#   META  JSON of the IK limbs and settings
+#   STRS  NUL separated mapping bone names, source and target of every mapping
+#   MATS  float32 rest and offset matrix of every mapping, row-major
+#   ASRC  source armature snapshot, see pack_armature
+#   ATGT  target armature snapshot
+#
+# Loading reads only the first three, so it does not depend on the bone count.
+# Readers skip sections they do not know, the version is only bumped for
+# changes older readers would misread.
+
+binary_magic = b'RTCF'
+binary_version = 1
+binary_header = struct.Struct('<4sHH')
+binary_section = struct.Struct('<4sQQ')
+armature_header = struct.Struct('<II')
 
 
 def draw_panel(ctx, layout):
@@ -25,8 +49,7 @@ class SavefileLoadOperator(bpy.types.Operator, ImportHelper):
 	)
 
 	def execute(self, context):
-		with open(self.filepath, 'r') as f:
-			load_serialized_state(context.object.retargeting_context, json.load(f))
+		load_serialized_state(context.object.retargeting_context, read_state(self.filepath))
 		return {'FINISHED'}
 
 
@@ -43,20 +66,21 @@ class SavefileSaveOperator(bpy.types.Operator, ExportHelper):
 		maxlen=255
 	)
 
-	def execute(self, context):
-		with open(self.filepath, 'w') as f:
-			f.write(
-				json.dumps(
-					serialize_state(context.object.retargeting_context),
-					indent=4
-				)
-			)
+	use_binary: bpy.props.BoolProperty(
+		name='Binary',
+		description='Save in the compact binary format, which loads much faster for large rigs. Off saves readable JSON',
+		default=True
+	)
 
+	def execute(self, context):
+		write_state(self.filepath, context.object.retargeting_context, self.use_binary)
 		return {'FINISHED'}
 
 
 
 def serialize_state(ctx):
+	matrices = ctx.get_mapping_matrices()
+
 	return {
 		'armatures': {
 			'source': serialize_armature(ctx.source),
@@ -66,11 +90,17 @@ def serialize_state(ctx):
 			{
 				'source': m.source,
 				'target': m.target,
-				'rest': list(m.rest),
-				'offset': list(m.offset)
+				'rest': matrices[i, 0].ravel().tolist(),
+				'offset': matrices[i, 1].ravel().tolist()
 			}
-			for m in ctx.mappings
+			for i, m in enumerate(ctx.mappings)
 		], 
+		**serialize_settings(ctx)
+	}
+
+
+def serialize_settings(ctx):
+	return {
 		'ik_limbs': [
 			{
 				'name': l.name,
@@ -108,8 +138,8 @@ def load_serialized_state(ctx, data):
 		mapping = ctx.mappings.add()
 		mapping.source = m['source']
 		mapping.target = m['target']
-		mapping.rest = m['rest']
-		mapping.offset = m['offset']
+
+	ctx.set_mapping_matrices([(m['rest'], m['offset']) for m in data['mappings']])
 
 	for l in data['ik_limbs']:
 		limb = ctx.ik_limbs.add()
@@ -122,10 +152,166 @@ def load_serialized_state(ctx, data):
 	ctx.setting_correct_feet = data['setting_correct_feet']
 	ctx.setting_correct_hands = data['setting_correct_hands']
 	ctx.is_importing = False
+	build_lookup_index(ctx)
 
 	ctx.update_drivers()
 
 
+def read_state(filepath):
+	# either format, told apart by the magic bytes
+	with open(filepath, 'rb') as f:
+		if f.read(len(binary_magic)) == binary_magic:
+			return read_binary_state(f, filepath)
+
+		f.seek(0)
+		return json.loads(f.read().decode('utf-8'))
+
+
+def write_state(filepath, ctx, binary=True):
+	if binary:
+		with open(filepath, 'wb') as f:
+			f.write(serialize_binary_state(ctx))
+	else:
+		with open(filepath, 'w') as f:
+			f.write(json.dumps(serialize_state(ctx), indent=4))
+
+
+def serialize_binary_state(ctx):
+	names = [name for m in ctx.mappings for name in (m.source, m.target)]
+	sections = (
+		(b'META', json.dumps(serialize_settings(ctx)).encode('utf-8')),
+		(b'STRS', '\0'.join(names).encode('utf-8')),
+		(b'MATS', ctx.get_mapping_matrices().astype('<f4').tobytes()),
+		(b'ASRC', pack_armature(ctx.source)),
+		(b'ATGT', pack_armature(ctx.target))
+	)
+	offset = binary_header.size + binary_section.size * len(sections)
+	table = []
+
+	for tag, data in sections:
+		table.append(binary_section.pack(tag, offset, len(data)))
+		offset += len(data)
+
+	return b''.join([binary_header.pack(binary_magic, binary_version, len(sections))] + table + [data for _, data in sections])
+
+
+def read_binary_state(f, filepath):
+	f.seek(0)
+	magic, version, section_n = binary_header.unpack(f.read(binary_header.size))
+
+	if magic != binary_magic:
+		raise Exception('not a retargeting config')
+
+	if version > binary_version:
+		raise Exception('config was saved by a newer version of the add-on (format version %i)' % version)
+
+	table = {}
+
+	for _ in range(section_n):
+		tag, offset, size = binary_section.unpack(f.read(binary_section.size))
+		table[tag] = (offset, size)
+
+	def read_section(tag):
+		offset, size = table[tag]
+		f.seek(offset)
+		return f.read(size)
+
+	data = json.loads(read_section(b'META').decode('utf-8'))
+	names = read_section(b'STRS').decode('utf-8').split('\0')
+	matrices = np.frombuffer(read_section(b'MATS'), dtype='<f4').reshape(-1, 2, 16)
+
+	data['mappings'] = [
+		{
+			'source': names[i * 2],
+			'target': names[i * 2 + 1],
+			'rest': matrices[i, 0],
+			'offset': matrices[i, 1]
+		}
+		for i in range(len(matrices))
+	]
+	data['armatures'] = ArmatureSnapshots(filepath, table)
+
+	return data
+
+
+class ArmatureSnapshots(Mapping):
+	# decoded from the file only when accessed, like data['armatures']['source']
+	roles = {'source': b'ASRC', 'target': b'ATGT'}
+
+	def __init__(self, filepath, table):
+		self.filepath = filepath
+		self.table = table
+		self.decoded = {}
+
+	def __getitem__(self, role):
+		if role not in self.decoded:
+			offset, size = self.table[self.roles[role]]
+
+			with open(self.filepath, 'rb') as f:
+				f.seek(offset)
+				self.decoded[role] = unpack_armature(f.read(size))
+
+		return self.decoded[role]
+
+	def __iter__(self):
+		return iter(self.roles)
+
+	def __len__(self):
+		return len(self.roles)
+
+
+def pack_armature(armature):
+	# bone count and names size, NUL separated names, parent indices (-1 for roots),
+	# then float32 matrix_world, every bone's 3x3 matrix and 4x4 matrix_local, row-major
+	bones = armature.data.bones
+	n = len(bones)
+	indices = {bone.name: i for i, bone in enumerate(bones)}
+	names = '\0'.join(bone.name for bone in bones).encode('utf-8')
+	parents = np.array([indices[bone.parent.name] if bone.parent else -1 for bone in bones], dtype='<i4')
+	matrix = np.empty(n * 9, dtype=np.float32)
+	matrix_local = np.empty(n * 16, dtype=np.float32)
+
+	# foreach_get flattens column-major
+	bones.foreach_get('matrix', matrix)
+	bones.foreach_get('matrix_local', matrix_local)
+
+	return b''.join((
+		armature_header.pack(n, len(names)),
+		names,
+		parents.tobytes(),
+		np.array(armature.matrix_world, dtype='<f4').tobytes(),
+		matrix.reshape(n, 3, 3).transpose(0, 2, 1).astype('<f4').tobytes(),
+		matrix_local.reshape(n, 4, 4).transpose(0, 2, 1).astype('<f4').tobytes()
+	))
+
+
+def unpack_armature(data):
+	# same layout as serialize_armature
+	n, names_size = armature_header.unpack_from(data)
+	offset = armature_header.size
+	names = data[offset:offset + names_size].decode('utf-8').split('\0')
+	offset += names_size
+	parents = np.frombuffer(data, dtype='<i4', count=n, offset=offset).tolist()
+	offset += n * 4
+	matrix_world = np.frombuffer(data, dtype='<f4', count=16, offset=offset).tolist()
+	offset += 16 * 4
+	matrix = np.frombuffer(data, dtype='<f4', count=n * 9, offset=offset).reshape(n, 9).tolist()
+	offset += n * 9 * 4
+	matrix_local = np.frombuffer(data, dtype='<f4', count=n * 16, offset=offset).reshape(n, 16).tolist()
+
+	return {
+		'matrix_world': matrix_world,
+		'bones': {
+			names[i]: {
+				'parent': names[parents[i]] if parents[i] >= 0 else None,
+				'matrix': matrix[i],
+				'matrix_local': matrix_local[i]
+			}
+			for i in range(n)
+		}
+	}
+
+
 
 classes = (
 	SavefileLoadOperator,
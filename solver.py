@@ -0,0 +1,89 @@
+import bpy
+from .plan import get_plan
+from .kernel import mat_to_euler_xyz
+from .log import info
+
+
+solver_targets = set()
+
+
+def enable_solver(ctx):
+	solver_targets.add(ctx.target.name)
+
+	for bone_name in get_plan(ctx).bones:
+		ctx.target.pose.bones[bone_name].rotation_mode = 'XYZ'
+
+	solve(ctx, bpy.context.evaluated_depsgraph_get())
+	info('enabled retarget solver')
+
+
+def resume_solver(ctx):
+	# the file already holds the solved pose, just start following the source again
+	solver_targets.add(ctx.target.name)
+
+
+def disable_solver(ctx):
+	solver_targets.discard(ctx.target.name)
+
+
+def solve(ctx, depsgraph):
+	plan = get_plan(ctx)
+
+	if len(plan.bones) == 0:
+		return
+
+	mats = plan.evaluate_batch(*plan.read_pose(ctx.source.evaluated_get(depsgraph).pose.bones))
+	locs = mats[:, :3, 3].tolist()
+	eulers = mat_to_euler_xyz(mats).tolist()
+	dest_pose_bones = ctx.target.pose.bones
+
+	# same channels the drivers write, scale is left alone
+	for bone_name, loc, euler in zip(plan.get_stacks()['names'], locs, eulers):
+		dest_pose = dest_pose_bones[bone_name]
+		dest_pose.location = loc
+		dest_pose.rotation_euler = euler
+
+
+def get_solver_contexts():
+	for name in list(solver_targets):
+		obj = bpy.data.objects.get(name)
+
+		if obj == None or obj.type != 'ARMATURE' or obj.retargeting_context.setting_engine != 'SOLVER':
+			solver_targets.discard(name)
+			continue
+
+		ctx = obj.retargeting_context
+
+		if ctx.source == None or ctx.setting_disable_drivers:
+			continue
+
+		yield ctx
+
+
+@bpy.app.handlers.persistent
+def handle_frame_change_post(scene, depsgraph):
+	# the source is only evaluated at the new frame after the pre handlers, so the solve
+	# happens here. Its writes go to the original target, which the depsgraph already
+	# evaluated, so it is updated once more. Otherwise render and visual bake, which
+	# read the evaluated pose right after the frame change, would lag one frame behind
+	solved = False
+
+	for ctx in get_solver_contexts():
+		solve(ctx, depsgraph)
+		solved = True
+
+	if solved:
+		depsgraph.update()
+
+
+@bpy.app.handlers.persistent
+def handle_depsgraph_update_post(scene, depsgraph):
+	if len(solver_targets) == 0:
+		return
+
+	updated = set(update.id.name for update in depsgraph.updates if isinstance(update.id, bpy.types.Object))
+
+	for ctx in get_solver_contexts():
+		# only follow source changes, our own writes to the target must not retrigger
+		if ctx.source.name in updated:
+			solve(ctx, depsgraph)
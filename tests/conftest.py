@@ -0,0 +1,26 @@
+import os
+import sys
+import pytest
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_dir)
+
+from benchmarks import run
+
+
+# The add-on is loaded once with the benchmark stand-ins for bpy and mathutils.
+# The repository root is the add-on package itself, so pytest would import it a
+# second time under the directory name, that name points to the loaded one instead.
+
+loaded = run.load_addon()
+sys.modules.setdefault(os.path.basename(root_dir), loaded[1])
+
+
+@pytest.fixture
+def bpy():
+	return loaded[0]
+
+
+@pytest.fixture
+def addon():
+	return loaded[1]
@@ -0,0 +1,50 @@
+import numpy as np
+from benchmarks import run
+
+
+def undo_offsets(ctx, offsets):
+	# undo writes the stored properties back without running their update callbacks
+	ctx.mappings.foreach_set('offset', np.asarray(offsets, dtype=np.float32).ravel())
+
+
+def test_undo_recounts_alignments(bpy, addon):
+	ctx = run.create_scene(bpy, addon, 40)
+	offsets = np.tile(np.identity(4), (len(ctx.mappings), 1, 1))
+
+	assert ctx.get_bone_alignments_count() == 0
+
+	offsets[:3, 0, 3] = 0.1
+	undo_offsets(ctx, offsets)
+	addon.plan.handle_undo_redo(None)
+
+	assert ctx.get_bone_alignments_count() == 3
+
+
+def test_undo_rereads_mapping_matrices(bpy, addon):
+	ctx = run.create_scene(bpy, addon, 40)
+	offsets = np.array(ctx.get_mapping_matrices()[:, 1])
+
+	offsets[:, 2, 3] = 0.25
+	undo_offsets(ctx, offsets)
+	addon.plan.handle_undo_redo(None)
+
+	assert np.allclose(ctx.get_mapping_matrices()[:, 1], offsets)
+
+
+def test_lookup_finds_names_restored_by_undo(bpy, addon):
+	ctx = run.create_scene(bpy, addon, 40)
+	mapping = ctx.mappings[5]
+
+	assert ctx.get_mapping_for_target(mapping.target) == mapping
+
+	# undo swaps the names back without the update callbacks
+	object.__setattr__(mapping, 'target', 'restored')
+
+	assert ctx.get_mapping_for_target('restored') == mapping
+	assert ctx.get_mapping_for_target('missing') == None
+
+	object.__setattr__(mapping, 'source', 'restored')
+	addon.plan.handle_undo_redo(None)
+
+	assert ctx.id_data.name not in addon.context.lookup_indexes
+	assert ctx.get_mapping_for_source('restored') == mapping
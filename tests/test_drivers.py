@@ -0,0 +1,27 @@
+import types
+from benchmarks import run
+from benchmarks.standins import Depsgraph
+
+
+def test_outdated_drivers_restore_when_evaluated(bpy, addon):
+	drivers = addon.drivers
+	ctx = run.create_scene(bpy, addon, 30)
+	bone_name = ctx.mappings[0].target
+	src_vars = [0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0]
+
+	ctx.driver_stamp = 'outdated'
+	drivers.defer_restore(ctx)
+
+	# the first update after loading touches every object, that alone restores nothing
+	depsgraph = Depsgraph()
+	depsgraph.updates = [types.SimpleNamespace(id=obj) for obj in bpy.data.objects]
+	drivers.handle_depsgraph_update_post(bpy.context.scene, depsgraph)
+
+	assert ctx.target.name in drivers.pending_restores
+
+	# a stored expression of an older version, without the frame argument
+	drivers.drive_bone_rot(ctx.target.name, bone_name, 'x', src_vars)
+	drivers.handle_depsgraph_update_post(bpy.context.scene, Depsgraph())
+
+	assert ctx.target.name not in drivers.pending_restores
+	assert ctx.driver_stamp == drivers.get_driver_stamp(ctx)
@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+from benchmarks import run
+from benchmarks.standins import Matrix, Quaternion, Vector
+
+
+def random_rotation(rng, angle=0.6):
+	axis = rng.normal(size=3)
+	axis /= np.linalg.norm(axis)
+	half = rng.uniform(-angle, angle) / 2
+	return Quaternion((np.cos(half),) + tuple(np.sin(half) * axis))
+
+
+def create_scene(bpy, addon, chains=False, scale=1.0, offsets=False, bone_count=60, seed=0):
+	rng = np.random.default_rng(seed)
+	ctx = run.create_scene(bpy, addon, bone_count)
+	source_bones = ctx.source.data.bones
+	target_bones = ctx.target.data.bones
+
+	ctx.mappings.clear()
+
+	for i, (sbone, tbone) in enumerate(zip(source_bones, target_bones)):
+		# unmapped bones in between make the mapped children carry a chain delta
+		if chains and i % 3 == 1 and sbone.parent is not None:
+			continue
+
+		mapping = ctx.mappings.add()
+		mapping.source = sbone.name
+		mapping.target = tbone.name
+
+	ctx.set_mapping_matrices([
+		(
+			target_bones[m.target].matrix_local,
+			Matrix.LocRotScale(Vector(rng.normal(size=3) * 0.05), random_rotation(rng), None) if offsets else np.identity(4)
+		)
+		for m in ctx.mappings
+	])
+
+	ctx.source.matrix_world = Matrix.LocRotScale(Vector((0.2, -0.5, 0.0)), random_rotation(rng, 0.3), Vector((scale,) * 3))
+
+	for pose_bone in ctx.source.pose.bones:
+		pose_bone.location = Vector(rng.normal(size=3) * 0.02)
+		pose_bone.rotation_quaternion = random_rotation(rng)
+
+	addon.post_load(None)
+
+	return ctx
+
+
+def get_driver_mats(addon, ctx):
+	mats = []
+
+	for bone_name, bone_plan in addon.plan.get_plan(ctx).bones.items():
+		basis = ctx.source.pose.bones[bone_plan.source].matrix_basis
+		src_vars = list(basis.to_translation()) + list(basis.to_quaternion())
+		mats.append(np.array(addon.drivers.drive_bone_mat(ctx.target.name, bone_name, src_vars)))
+
+	return np.array(mats)
+
+
+@pytest.mark.parametrize('chains, scale, offsets', [
+	(False, 1.0, False),
+	(True, 1.0, False),
+	(False, 1.7, False),
+	(False, 1.0, True),
+	(True, 0.6, True),
+])
+def test_kernel_matches_drivers(bpy, addon, chains, scale, offsets):
+	ctx = create_scene(bpy, addon, chains=chains, scale=scale, offsets=offsets)
+	plan = addon.plan.get_plan(ctx)
+
+	assert any(bone_plan.has_chain for bone_plan in plan.bones.values()) == chains
+
+	batch_mats = plan.evaluate_batch(*plan.read_pose(ctx.source.pose.bones))
+
+	assert np.abs(batch_mats - get_driver_mats(addon, ctx)).max() < 1e-6
+
+
+def test_chain_deltas_match_quaternion_products(addon):
+	rng = np.random.default_rng(1)
+	quats = [[random_rotation(rng) for _ in range(4)] for _ in range(20)]
+	deltas = addon.kernel.chain_deltas(*(np.array([list(q[i]) for q in quats]) for i in range(4)))
+
+	for delta, (base_pose, head_pose, based_rest_inv, src_rest) in zip(deltas, quats):
+		expected = src_rest.inverted() @ (based_rest_inv @ base_pose.inverted() @ head_pose) @ src_rest
+		# q and -q are the same rotation
+		assert min(np.abs(delta - list(expected)).max(), np.abs(delta + list(expected)).max()) < 1e-9
+
+
+def test_retarget_mats_without_deltas(addon):
+	rng = np.random.default_rng(2)
+	rots = np.array([list(random_rotation(rng)) for _ in range(10)])
+	locs = rng.normal(size=(10, 3))
+	pre_mats = rng.normal(size=(10, 4, 4))
+	post_mats = rng.normal(size=(10, 4, 4))
+	mats = addon.kernel.retarget_mats(locs, rots, pre_mats, post_mats)
+
+	for mat, loc, rot, pre_mat, post_mat in zip(mats, locs, rots, pre_mats, post_mats):
+		expected = pre_mat @ np.array(Matrix.Translation(loc) @ Quaternion(rot).to_matrix().to_4x4()) @ post_mat
+		assert np.abs(mat - expected).max() < 1e-9
+
+
+def test_read_pose_includes_constraints(bpy, addon):
+	ctx = create_scene(bpy, addon)
+	plan = addon.plan.get_plan(ctx)
+	sources = [bone_plan.source for bone_plan in plan.bones.values()]
+	pose_bones = ctx.source.pose.bones
+	constrained = next(pb for pb in pose_bones if pb.name in sources and pb.parent is not None and any(c.name in sources for c in pose_bones if c.parent is pb))
+	child = next(pb for pb in pose_bones if pb.parent is constrained and pb.name in sources)
+	extra = Quaternion((0.8, 0.2, -0.4, 0.4)).normalized().to_matrix().to_4x4()
+
+	# a constraint rotates the evaluated pose past what the channels say, the drivers'
+	# local space transform variables read that result
+	constrained.pose_matrix = (ctx.source.pose.revision, constrained.matrix @ extra)
+	locs, rots, *_ = plan.read_pose(pose_bones)
+
+	for pose_bone, basis in ((constrained, constrained.matrix_basis @ extra), (child, child.matrix_basis)):
+		i = sources.index(pose_bone.name)
+		expected = np.array(list(basis.to_quaternion()))
+
+		assert min(np.abs(rots[i] - expected).max(), np.abs(rots[i] + expected).max()) < 1e-6
+		assert np.abs(locs[i] - list(basis.to_translation())).max() < 1e-6
+
+
+def test_chain_pose_bones_resolved_once_per_plan(bpy, addon):
+	ctx = create_scene(bpy, addon, chains=True)
+	plan = addon.plan.get_plan(ctx)
+	bone_plan = next(bp for bp in plan.bones.values() if bp.has_chain)
+
+	assert bone_plan.chain_head_bone is ctx.source.pose.bones[bone_plan.chain_head]
+
+	# undo may free the pose bones, the plans holding them go with it
+	addon.plan.handle_undo_redo(None)
+
+	assert addon.plan.get_plan(ctx) is not plan
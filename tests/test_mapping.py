@@ -0,0 +1,192 @@
+import random
+import pytest
+from benchmarks import run, rigs as synthetic_rigs
+
+
+def get_pairs(addon, bones):
+	groups = addon.mapping.guess_group_by_side(bones)
+	return set(zip(groups['l'], groups['r'])), groups['x']
+
+
+@pytest.mark.parametrize('left, right', [
+	('hand.L', 'hand.R'),
+	('hand_l', 'hand_r'),
+	('L_Hand', 'R_Hand'),
+	('HandL', 'HandR'),
+	('ThighL', 'ThighR'),
+	('UpperArmL.001', 'UpperArmR.001'),
+	('mixamorig:LeftHand', 'mixamorig:RightHand'),
+	('left_hand', 'Right_hand'),
+	('LeftFoot', 'rightFoot'),
+	('Bip01 L Thigh', 'Bip01 R Thigh'),
+])
+def test_group_by_side_pairs(addon, left, right):
+	pairs, center = get_pairs(addon, [right, 'Spine', left])
+
+	assert pairs == {(left, right)}
+	assert center == ['Spine']
+
+
+@pytest.mark.parametrize('bones', [
+	['Hand', 'Head'],
+	['ThighRoll', 'ThighLoll'],
+	['hand.L', 'foot.R'],
+	['Root', 'Lower'],
+])
+def test_group_by_side_leaves_unpaired(addon, bones):
+	pairs, center = get_pairs(addon, bones)
+
+	assert pairs == set()
+	assert center == bones
+
+
+def get_mixamo_bones(prefix='mixamorig:'):
+	bones = ['Hips', 'Spine', 'Spine1', 'Spine2', 'Neck', 'Head', 'HeadTop_End']
+
+	for side in ('Left', 'Right'):
+		bones += [side + part for part in ('Shoulder', 'Arm', 'ForeArm', 'Hand', 'UpLeg', 'Leg', 'Foot', 'ToeBase', 'Toe_End')]
+		bones += [side + 'Hand' + finger + str(i) for finger in ('Thumb', 'Index', 'Middle', 'Ring', 'Pinky') for i in range(1, 5)]
+
+	return [prefix + bone for bone in bones]
+
+
+def get_ue_bones():
+	bones = ['root', 'pelvis', 'spine_01', 'spine_02', 'spine_03', 'neck_01', 'head']
+
+	for side in ('l', 'r'):
+		bones += [part + '_' + side for part in ('clavicle', 'upperarm', 'lowerarm', 'hand', 'thigh', 'calf', 'foot', 'ball')]
+		bones += ['%s_%02i_%s' % (finger, i, side) for finger in ('thumb', 'index', 'middle', 'ring', 'pinky') for i in range(1, 4)]
+		bones += [part + '_twist_01_' + side for part in ('upperarm', 'lowerarm', 'thigh', 'calf')]
+
+	return bones
+
+
+def get_rigify_bones():
+	bones = ['spine', 'spine.001', 'spine.002', 'spine.003', 'spine.004', 'spine.005', 'spine.006']
+
+	for side in ('L', 'R'):
+		bones += [part + '.' + side for part in ('shoulder', 'upper_arm', 'forearm', 'hand', 'thigh', 'shin', 'foot', 'toe', 'heel.02', 'breast', 'pelvis')]
+		bones += ['thumb.%02i.%s' % (i, side) for i in range(1, 4)]
+		bones += ['f_%s.%02i.%s' % (finger, i, side) for finger in ('index', 'middle', 'ring', 'pinky') for i in range(1, 4)]
+		bones += ['palm.%02i.%s' % (i, side) for i in range(1, 5)]
+
+	return bones
+
+
+def get_biped_bones():
+	bones = ['Bip01', 'Bip01 Pelvis', 'Bip01 Spine', 'Bip01 Spine1', 'Bip01 Spine2', 'Bip01 Neck', 'Bip01 Head', 'Bip01 HeadNub']
+
+	for side in ('L', 'R'):
+		bones += ['Bip01 %s %s' % (side, part) for part in ('Clavicle', 'UpperArm', 'Forearm', 'Hand', 'Thigh', 'Calf', 'Foot', 'Toe0', 'Toe0Nub')]
+		bones += ['Bip01 %s Finger%i%s' % (side, finger, joint) for finger in range(5) for joint in ('', '1', '2', 'Nub')]
+
+	return bones
+
+
+def guess_by_full_scan(mapping, source_bones, target_bones):
+	# the guess as it was before the candidate shortlist: every pair scored, best first
+	matches = []
+	mappings_source = []
+	mappings_target = []
+
+	for tbone in target_bones:
+		for sbone in source_bones:
+			sbone_lower, tbone_lower = mapping.guess_apply_synonym(sbone.lower(), tbone.lower())
+			matcher = mapping.SequenceMatcher(None, sbone_lower, tbone_lower)
+
+			if matcher.find_longest_match().size <= 1:
+				continue
+
+			matches.append((sbone, tbone, matcher.ratio()))
+
+	for sbone, tbone, _ in sorted(matches, key=lambda m: m[2], reverse=True):
+		if sbone in mappings_source or tbone in mappings_target:
+			continue
+
+		mappings_source.append(sbone)
+		mappings_target.append(tbone)
+
+	return list(zip(mappings_source, mappings_target))
+
+
+def guess_by_side(mapping, guess, source_bones, target_bones):
+	source_sides = mapping.guess_group_by_side(source_bones)
+	target_sides = mapping.guess_group_by_side(target_bones)
+	return [pair for side in ('l', 'r', 'x') for pair in guess(source_sides[side], target_sides[side])]
+
+
+rigs = {
+	'mixamo': get_mixamo_bones,
+	'ue': get_ue_bones,
+	'rigify': get_rigify_bones,
+	'biped': get_biped_bones,
+}
+
+
+@pytest.mark.parametrize('source, target', [
+	('mixamo', 'rigify'),
+	('mixamo', 'ue'),
+	('biped', 'mixamo'),
+	('rigify', 'mixamo'),
+	('ue', 'biped'),
+])
+def test_guess_map_by_name_matches_full_scan(addon, source, target):
+	source_bones = rigs[source]()
+	target_bones = rigs[target]()
+	full_scan = lambda s, t: guess_by_full_scan(addon.mapping, s, t)
+
+	guessed = guess_by_side(addon.mapping, addon.mapping.guess_map_by_name, source_bones, target_bones)
+
+	assert guessed == guess_by_side(addon.mapping, full_scan, source_bones, target_bones)
+
+
+def test_compatibility_report_cached_until_mappings_change(bpy, addon):
+	ctx = run.create_scene(bpy, addon, 40)
+	report = addon.mapping.get_compatibility_report(ctx, ctx.source)
+
+	assert report.missing == []
+	assert addon.mapping.get_compatibility_report(ctx, ctx.source) is report
+
+	ctx.mappings[3].source = 'mixamorig:Tail'
+	report = addon.mapping.get_compatibility_report(ctx, ctx.source)
+
+	assert report.missing == ['mixamorig:Tail']
+
+
+def get_topology_bones(skeleton, names, scale=1.0, offset=(0.0, 0.0, 0.0), name_keys=True):
+	# the (name, parent name, head, tail, name key) tuples get_skeleton_bones builds
+	place = lambda p: tuple(p[i] * scale + offset[i] for i in range(3))
+
+	return [
+		(
+			names[i],
+			names[parent] if parent is not None else None,
+			place(head),
+			place(tail),
+			part.lower() if name_keys else ''
+		)
+		for i, (part, parent, side, head, tail) in enumerate(skeleton)
+	]
+
+
+@pytest.mark.parametrize('bone_count', [22, 60, 90])
+def test_match_skeletons_maps_renamed_and_permuted_rig_back(addon, bone_count):
+	skeleton = synthetic_rigs.get_skeleton(bone_count)
+	source_names = [synthetic_rigs.get_bone_name(part, side, 'source') for part, _, side, _, _ in skeleton]
+	target_names = ['bone%03i' % i for i in random.Random(bone_count).sample(range(bone_count), bone_count)]
+
+	source_bones = get_topology_bones(skeleton, source_names)
+	target_bones = get_topology_bones(skeleton, target_names, scale=1.8, offset=(3.0, -2.0, 0.5), name_keys=False)
+	random.Random(bone_count + 1).shuffle(target_bones)
+
+	mappings = addon.topology.match_skeletons(source_bones, target_bones)
+
+	assert sorted(mappings) == sorted(zip(source_names, target_names))
+
+	# left and right are told apart by position alone, the target names carry no side
+	sides = {name: side for name, (_, _, side, _, _) in zip(source_names, skeleton)}
+	renamed = dict(zip(target_names, source_names))
+	left = [(s, t) for s, t in mappings if sides[s] == 'Left']
+
+	assert len(left) > 0
+	assert all(sides[renamed[t]] == 'Left' for _, t in left)
@@ -0,0 +1,47 @@
+import json
+import types
+
+
+class Region:
+	def __init__(self, type):
+		self.type = type
+		self.redraws = 0
+
+	def tag_redraw(self):
+		self.redraws += 1
+
+
+def test_playback_redraws_sidebar_only_while_enabled(bpy, addon):
+	profiling = addon.profiling
+	sidebar, header = Region('UI'), Region('HEADER')
+	area = types.SimpleNamespace(type='VIEW_3D', regions=[header, sidebar])
+	window = types.SimpleNamespace(screen=types.SimpleNamespace(areas=[area]))
+	bpy.context.window_manager.windows = [window]
+
+	try:
+		profiling.handle_frame_change_post(bpy.context.scene, None)
+		assert sidebar.redraws == 0
+
+		profiling.set_enabled(True)
+		profiling.handle_frame_change_post(bpy.context.scene, None)
+		assert sidebar.redraws == 1
+		assert header.redraws == 0
+	finally:
+		profiling.set_enabled(False)
+		bpy.context.window_manager.windows = []
+
+
+def test_worker_stats_merge_into_the_ui_process(addon):
+	profiling = addon.profiling
+	profiling.reset()
+	profiling.record('batch: bake_file', 2.0)
+	dumped = json.loads(json.dumps(profiling.dump_stats()))
+
+	profiling.merge_stats(dumped)
+	profiling.merge_stats({'batch: bake_file': (1, 3.0, 3.0)})
+	report = profiling.get_report()['batch: bake_file']
+	profiling.reset()
+
+	assert report['calls'] == 3
+	assert report['total_ms'] == 7000.0
+	assert report['max_ms'] == 3000.0
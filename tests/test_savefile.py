@@ -0,0 +1,94 @@
+import struct
+import numpy as np
+import pytest
+from benchmarks import run
+
+
+def create_scene(bpy, addon, bone_count=30):
+	ctx = run.create_scene(bpy, addon, bone_count)
+	rng = np.random.default_rng(0)
+	matrices = ctx.get_mapping_matrices().copy()
+	matrices[:, 1, :3, 3] = rng.normal(size=(len(matrices), 3))
+	ctx.set_mapping_matrices(matrices)
+
+	ctx.setting_correct_feet = True
+
+	return ctx
+
+
+def write_and_read(addon, ctx, path, binary):
+	addon.savefile.write_state(str(path), ctx, binary)
+	return addon.savefile.read_state(str(path))
+
+
+def assert_same_state(binary_data, json_data):
+	assert [(m['source'], m['target']) for m in binary_data['mappings']] == [(m['source'], m['target']) for m in json_data['mappings']]
+
+	for key in ('rest', 'offset'):
+		assert np.allclose(
+			np.array([m[key] for m in binary_data['mappings']], dtype=np.float64).reshape(-1, 16),
+			np.array([m[key] for m in json_data['mappings']], dtype=np.float64).reshape(-1, 16),
+			atol=1e-6
+		)
+
+	for key in ('ik_limbs', 'setting_correct_feet', 'setting_correct_hands'):
+		assert binary_data[key] == json_data[key]
+
+
+def test_binary_matches_json(bpy, addon, tmp_path):
+	ctx = create_scene(bpy, addon)
+	binary_data = write_and_read(addon, ctx, tmp_path / 'binary.blend-retarget', True)
+	json_data = write_and_read(addon, ctx, tmp_path / 'json.blend-retarget', False)
+
+	assert len(binary_data['mappings']) == len(ctx.mappings)
+	assert len(binary_data['ik_limbs']) == len(ctx.ik_limbs) > 0
+	assert_same_state(binary_data, json_data)
+
+	# loading the binary config gives back the same mappings and matrices
+	expected = ctx.get_mapping_matrices().copy()
+	addon.savefile.load_serialized_state(ctx, binary_data)
+
+	assert np.allclose(ctx.get_mapping_matrices(), expected, atol=1e-6)
+	assert ctx.setting_correct_feet
+
+
+def test_binary_without_mappings(bpy, addon, tmp_path):
+	ctx = create_scene(bpy, addon)
+	ctx.mappings.clear()
+	binary_data = write_and_read(addon, ctx, tmp_path / 'binary.blend-retarget', True)
+	json_data = write_and_read(addon, ctx, tmp_path / 'json.blend-retarget', False)
+
+	assert binary_data['mappings'] == []
+	assert_same_state(binary_data, json_data)
+
+
+def test_binary_from_newer_version_is_rejected(bpy, addon, tmp_path):
+	ctx = create_scene(bpy, addon)
+	path = tmp_path / 'binary.blend-retarget'
+	addon.savefile.write_state(str(path), ctx, True)
+
+	data = bytearray(path.read_bytes())
+	struct.pack_into('<H', data, len(addon.savefile.binary_magic), addon.savefile.binary_version + 1)
+	path.write_bytes(bytes(data))
+
+	with pytest.raises(Exception, match='newer version'):
+		addon.savefile.read_state(str(path))
+
+
+@pytest.mark.parametrize('role', ['source', 'target'])
+def test_lazy_armature_snapshot_matches_json(bpy, addon, tmp_path, role):
+	ctx = create_scene(bpy, addon)
+	snapshots = write_and_read(addon, ctx, tmp_path / 'binary.blend-retarget', True)['armatures']
+	expected = addon.savefile.serialize_armature(getattr(ctx, role))
+
+	assert snapshots.decoded == {}
+
+	snapshot = snapshots[role]
+
+	assert list(snapshot['bones']) == list(expected['bones'])
+	assert np.allclose(snapshot['matrix_world'], expected['matrix_world'], atol=1e-6)
+
+	for name, bone in expected['bones'].items():
+		assert snapshot['bones'][name]['parent'] == bone['parent']
+		assert np.allclose(snapshot['bones'][name]['matrix'], bone['matrix'], atol=1e-6)
+		assert np.allclose(snapshot['bones'][name]['matrix_local'], bone['matrix_local'], atol=1e-6)
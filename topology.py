@@ -0,0 +1,171 @@
+# Structural bone matching for rigs whose bone names carry no meaning. Both
+# skeletons are reduced to trees of chains (runs of bones without branching),
+# which are aligned top down: the children of every matched pair of chains are
+# paired by rest position, subtree shape and side, with name similarity only
+# breaking ties. Nothing in here depends on bpy, bones are passed in as
+# (name, parent name, head, tail, name key) tuples in world space.
+
+
+position_weight = 1.0
+side_weight = 1.0
+shape_weight = 0.5
+name_weight = 0.1
+center_threshold = 0.02
+
+
+
+class Chain:
+	def __init__(self, bones, head, tail, name_key):
+		self.bones = bones
+		self.head = head
+		self.tail = tail
+		self.name_grams = set(name_key[i:i+2] for i in range(len(name_key) - 1))
+		self.children = []
+		self.size = len(bones)
+		self.side = get_side((head[0] + tail[0]) / 2)
+
+
+
+def build_chains(bones):
+	children = {}
+	roots = []
+	info = {}
+
+	for name, parent, head, tail, name_key in bones:
+		info[name] = (head, tail, name_key)
+		children.setdefault(name, [])
+
+		if parent == None:
+			roots.append(name)
+		else:
+			children.setdefault(parent, []).append(name)
+
+	points = [p for head, tail, _ in info.values() for p in (head, tail)]
+	transform = get_normalize_transform(points)
+	top_chains = []
+	stack = [(name, None) for name in reversed(roots)]
+
+	# iterative, long chains like tails or hair would exceed the recursion limit
+	while len(stack) > 0:
+		name, parent_chain = stack.pop()
+		chain_bones = [name]
+
+		while len(children[chain_bones[-1]]) == 1:
+			chain_bones.append(children[chain_bones[-1]][0])
+
+		chain = Chain(
+			chain_bones,
+			transform(info[chain_bones[0]][0]),
+			transform(info[chain_bones[-1]][1]),
+			info[chain_bones[0]][2]
+		)
+
+		if parent_chain == None:
+			top_chains.append(chain)
+		else:
+			parent_chain.children.append(chain)
+
+		for child in reversed(children[chain_bones[-1]]):
+			stack.append((child, chain))
+
+	for chain in iterate_chains(top_chains, reverse=True):
+		chain.size = len(chain.bones) + sum(child.size for child in chain.children)
+
+	return top_chains
+
+
+def iterate_chains(chains, reverse=False):
+	ordered = []
+	stack = list(chains)
+
+	while len(stack) > 0:
+		chain = stack.pop()
+		ordered.append(chain)
+		stack.extend(chain.children)
+
+	return reversed(ordered) if reverse else ordered
+
+
+def get_side(x):
+	if abs(x) < center_threshold:
+		return 0
+
+	return 1 if x > 0 else -1
+
+
+def get_normalize_transform(points):
+	# centered on x and y, standing on z = 0 and scaled to unit size, so rigs of
+	# different scale and placement become comparable
+	if len(points) == 0:
+		return lambda p: tuple(p)
+
+	lo = [min(p[i] for p in points) for i in range(3)]
+	hi = [max(p[i] for p in points) for i in range(3)]
+	size = max(hi[i] - lo[i] for i in range(3)) or 1.0
+	center = ((lo[0] + hi[0]) / 2, (lo[1] + hi[1]) / 2, lo[2])
+
+	return lambda p: tuple((p[i] - center[i]) / size for i in range(3))
+
+
+def get_chain_cost(a, b):
+	position = distance(a.head, b.head) + distance(a.tail, b.tail)
+	side = 0 if a.side == b.side else 1
+	shape = (
+		abs(a.size - b.size) / (a.size + b.size)
+		+ abs(len(a.children) - len(b.children)) / (len(a.children) + len(b.children) + 1)
+	)
+	name = 1 - 2 * len(a.name_grams & b.name_grams) / (len(a.name_grams) + len(b.name_grams) or 1)
+
+	return position_weight * position + side_weight * side + shape_weight * shape + name_weight * name
+
+
+def distance(a, b):
+	return sum((a[i] - b[i]) ** 2 for i in range(3)) ** 0.5
+
+
+def match_chain_sets(source_chains, target_chains):
+	costs = sorted(
+		(get_chain_cost(a, b), i, j)
+		for i, a in enumerate(source_chains)
+		for j, b in enumerate(target_chains)
+	)
+	matched_source = set()
+	matched_target = set()
+	pairs = []
+
+	for _, i, j in costs:
+		if i in matched_source or j in matched_target:
+			continue
+
+		matched_source.add(i)
+		matched_target.add(j)
+		pairs.append((source_chains[i], target_chains[j]))
+
+	return pairs
+
+
+def match_chain_bones(source_bones, target_bones):
+	# ends map onto ends, the bones in between by their relative position in the chain.
+	# A single bone maps onto the last one, where the chain branches
+	if len(target_bones) == 1:
+		return [(source_bones[-1], target_bones[0])]
+	elif len(source_bones) == 1:
+		return [(source_bones[0], target_bones[-1])]
+	elif len(source_bones) >= len(target_bones):
+		step = (len(source_bones) - 1) / (len(target_bones) - 1)
+		return [(source_bones[round(i * step)], tbone) for i, tbone in enumerate(target_bones)]
+	else:
+		step = (len(target_bones) - 1) / (len(source_bones) - 1)
+		return [(sbone, target_bones[round(i * step)]) for i, sbone in enumerate(source_bones)]
+
+
+def match_skeletons(source_bones, target_bones):
+	mappings = []
+	stack = match_chain_sets(build_chains(source_bones), build_chains(target_bones))
+
+	while len(stack) > 0:
+		source_chain, target_chain = stack.pop()
+		mappings += match_chain_bones(source_chain.bones, target_chain.bones)
+		stack += match_chain_sets(source_chain.children, target_chain.children)
+
+	return mappings
@@ -1,4 +1,7 @@
 import bpy
+import base64
+import hashlib
+import numpy as np
 from mathutils import Matrix
 
 
@@ -41,4 +44,17 @@ def matrix_to_list(matrix):
 		for value in row:
 			values.append(value)
 
-	return values
\ No newline at end of file
+	return values
+
+
+def pack_floats(values):
+	return base64.b64encode(np.asarray(values, dtype=np.float32).tobytes()).decode('ascii')
+
+
+def unpack_floats(data):
+	return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+
+
+def fingerprint(*values):
+	# stable across sessions, unlike hash(), so it can be stored in the .blend
+	return hashlib.md5(repr(values).encode('utf-8')).hexdigest()
\ No newline at end of file